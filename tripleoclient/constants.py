@@ -43,3 +43,18 @@ PLAN_ENVIRONMENT = 'plan-environment.yaml'
 
 # This directory may contain additional environments to use during deploy
 DEFAULT_ENV_DIRECTORY = "~/.tripleo/environments"
+
+# Index of the processed environment files found in environment directories
+ENV_DIRECTORY_INDEX = "~/.tripleo/environments-index.yaml"
+
+# Fingerprints of the inputs of the last successful deployment of each stack
+DEPLOY_FINGERPRINT_DIRECTORY = "~/.tripleo/fingerprints"
+
+# Durations of the node provision state transitions, per driver
+TRANSITION_STATS_FILE = "~/.tripleo/transition-stats.json"
+
+# Checkpoints of the node imports, to resume them after a failure
+NODE_IMPORT_CHECKPOINT_DIRECTORY = "~/.tripleo/node-import"
+
+# Snapshot of the baremetal nodes shared by the successive commands
+NODE_SNAPSHOT_FILE = "~/.tripleo/node-snapshot.json"
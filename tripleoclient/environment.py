@@ -0,0 +1,292 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import collections
+from concurrent import futures
+import hashlib
+import logging
+import os
+
+from heatclient.common import template_utils
+from heatclient import exc as hc_exc
+import six
+import yaml
+
+LOG = logging.getLogger(__name__)
+
+# Sections of a Heat environment for which we record which environment set
+# each of the keys.
+TRACKED_SECTIONS = ('parameter_defaults', 'parameters', 'resource_registry')
+
+
+class LayeredEnvironment(object):
+    """An ordered stack of Heat environments
+
+    Environments are recorded in the order they are added and only merged
+    together once, when :meth:`merge` is called. Later environments take
+    precedence over earlier ones using the same rules as
+    heatclient.common.template_utils.deep_update, which means the merge walks
+    every environment exactly once instead of re-walking the accumulated
+    result for each environment added.
+
+    While merging, the source of every key in the parameter_defaults,
+    parameters and resource_registry sections is recorded so it's possible
+    to find which environment file set a given value.
+    """
+
+    def __init__(self):
+        self._layers = []
+        self._provenance = None
+
+    def __len__(self):
+        return len(self._layers)
+
+    @property
+    def sources(self):
+        """The sources of the environments, in the order they were added"""
+        return [source for source, _env in self._layers]
+
+    def add(self, env, source):
+        """Add an environment on top of the existing ones
+
+        :param env: Heat environment
+        :type  env: dict
+
+        :param source: Where the environment comes from, usually a file path
+        :type  source: string
+        """
+        if not env:
+            return
+        self._layers.append((source, env))
+        self._provenance = None
+
+    def extend(self, other):
+        """Add all the environments of another LayeredEnvironment"""
+        for source, env in other._layers:
+            self.add(env, source)
+
+    def merge(self):
+        """Merge all the environments into a new dict
+
+        The environments added are not modified.
+        """
+        merged = {}
+        provenance = collections.defaultdict(dict)
+
+        for source, env in self._layers:
+            for section, value in six.iteritems(env):
+                if section in TRACKED_SECTIONS and isinstance(value, dict):
+                    self._record(provenance[section], section, value, source)
+            merged = _deep_merge(merged, env)
+
+        self._provenance = dict(provenance)
+        return merged
+
+    def source_of(self, key, section='parameter_defaults'):
+        """Return the source of the environment which last set a key
+
+        :param key: The key in the section, e.g. a parameter name
+        :type  key: string
+
+        :param section: The environment section to look up
+        :type  section: string
+
+        :returns: The source given when adding the environment, or None if
+                  no environment set this key.
+        """
+        if self._provenance is None:
+            self.merge()
+        return self._provenance.get(section, {}).get(key)
+
+    @staticmethod
+    def _record(section_provenance, section, values, source):
+        for key in values:
+            previous = section_provenance.get(key)
+            if previous is not None and previous != source:
+                LOG.debug("%s %s set in %s is overridden by %s",
+                          section, key, previous, source)
+            section_provenance[key] = source
+
+
+class EnvironmentDirectoryIndex(object):
+    """Persistent index of processed environment files
+
+    Each environment file processed is recorded with its modification time,
+    size and sha256 checksum, the modification time and size of every file
+    it references and the result of processing it. When none of those
+    changed, the recorded result is used instead of processing the file
+    again. The other files are processed concurrently.
+
+    Only files referenced with a file:// URL can be checked for changes, an
+    environment referencing anything else is never recorded. The processed
+    environments often hold passwords, so only the user can read the index.
+    """
+
+    # The version 1 indexes were readable by everyone, they are dropped
+    version = 2
+
+    def __init__(self, path, max_workers=4):
+        self.path = path
+        self.max_workers = max_workers
+        self._entries = self._load()
+        self._changed = False
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                index = yaml.safe_load(f)
+        except (IOError, OSError, yaml.YAMLError) as e:
+            LOG.debug("Ignoring environment index %s: %s", self.path, e)
+            return {}
+        if not isinstance(index, dict) or \
+                index.get('version') != self.version:
+            return {}
+        return index.get('entries') or {}
+
+    def save(self):
+        """Write the index if it changed"""
+        for path in list(self._entries):
+            if not os.path.isfile(path):
+                del self._entries[path]
+                self._changed = True
+        if not self._changed:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = '%s.tmp' % self.path
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            yaml.safe_dump({'version': self.version,
+                            'entries': self._entries},
+                           f, default_flow_style=False)
+        os.rename(tmp_path, self.path)
+        self._changed = False
+
+    def process(self, env_paths):
+        """Process environment files, reusing the recorded results
+
+        :param env_paths: Paths of the environment files
+        :type  env_paths: list of strings
+
+        :returns: dict mapping the path of each environment file to a tuple
+                  of its files dict and environment, as returned by
+                  template_utils.process_environment_and_files. The files
+                  heatclient failed to process are left out.
+        """
+        results = {}
+        pending = []
+        for env_path in env_paths:
+            abs_path = os.path.abspath(env_path)
+            entry = self._entries.get(abs_path)
+            if entry is not None and self._is_current(abs_path, entry):
+                LOG.debug("Using indexed environment %s", env_path)
+                results[env_path] = (entry['files'], entry['env'])
+            else:
+                pending.append(env_path)
+
+        if not pending:
+            return results
+
+        executor = futures.ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(pending)))
+        try:
+            processed = [(env_path, executor.submit(self._process, env_path))
+                         for env_path in pending]
+            for env_path, future in processed:
+                result = future.result()
+                if result is not None:
+                    results[env_path] = result
+        finally:
+            executor.shutdown(wait=True)
+        return results
+
+    def _process(self, env_path):
+        abs_path = os.path.abspath(env_path)
+        try:
+            files, env = template_utils.process_environment_and_files(
+                env_path=env_path)
+        except hc_exc.CommandError as e:
+            LOG.debug("Error %s processing environment file %s",
+                      six.text_type(e), env_path)
+            return None
+
+        references = {}
+        for url in files:
+            if not url.startswith('file://'):
+                return files, env
+            references[url[len('file://'):]] = _stat(url[len('file://'):])
+
+        self._entries[abs_path] = {
+            'stat': _stat(abs_path),
+            'sha256': _checksum(abs_path),
+            'references': references,
+            'files': files,
+            'env': env,
+        }
+        self._changed = True
+        return files, env
+
+    def _is_current(self, env_path, entry):
+        """Whether an environment file and its references are unchanged
+
+        A file whose modification time or size changed but with the same
+        checksum, e.g. after a checkout, is still current.
+        """
+        try:
+            for path, stat in six.iteritems(entry['references']):
+                if _stat(path) != stat:
+                    return False
+            stat = _stat(env_path)
+            if stat == entry['stat']:
+                return True
+            if _checksum(env_path) == entry['sha256']:
+                entry['stat'] = stat
+                self._changed = True
+                return True
+        except (IOError, OSError):
+            pass
+        return False
+
+
+def _stat(path):
+    st = os.stat(path)
+    return [st.st_mtime, st.st_size]
+
+
+def _checksum(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _deep_merge(old, new):
+    """Merge nested dictionaries
+
+    This follows the semantics of template_utils.deep_update, but never
+    stores a reference to a dict of the new environment in the result, so
+    the environments which are merged are left untouched.
+    """
+    if old is None:
+        old = {}
+
+    for k, v in six.iteritems(new):
+        if isinstance(v, dict):
+            old[k] = _deep_merge(old.get(k), v)
+        elif v is None and isinstance(old.get(k), dict):
+            # Don't override empty data, to work around yaml syntax issue
+            pass
+        else:
+            old[k] = v
+    return old
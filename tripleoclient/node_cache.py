@@ -0,0 +1,184 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import json
+import logging
+import os
+import threading
+import time
+
+from tripleoclient import utils
+
+LOG = logging.getLogger(__name__)
+
+# How long a snapshot of the nodes is used, in seconds
+DEFAULT_TTL = 30
+
+
+class CachedNode(object):
+    """A node of a snapshot read from disk
+
+    It has the attributes of the node it was saved from.
+    """
+
+    def __init__(self, info):
+        self._info = info
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_info'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self):
+        return dict(self._info)
+
+
+class NodeSnapshotCache(object):
+    """A short-lived snapshot of the list of the baremetal nodes
+
+    The snapshot is kept in memory for ttl seconds, so that the commands and
+    checks of a process which all need the nodes only list them once. With a
+    path, the snapshot is also saved there for the next commands. A snapshot
+    read from disk is only used while the UUIDs and updated_at of the nodes,
+    listed without any other field, are still the same, so that a node
+    changed by another process is never missed.
+
+    A snapshot holds the fields of the nodes it was listed with, it is only
+    used when the same fields are asked for. Below the Ironic API version
+    1.8, which can't list only some fields, the whole nodes are listed and
+    the snapshot is only kept in memory. It must be invalidated after
+    changing nodes.
+    """
+
+    version = 1
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._client = None
+        self._fields = None
+        self._nodes = None
+        self._taken = None
+
+    def _fresh(self, taken):
+        return taken is not None and 0 <= self._clock() - taken < self.ttl
+
+    def nodes(self, baremetal_client, fields=None):
+        """Return the list of all the nodes
+
+        :param baremetal_client: The client to list the nodes with, the
+                                 snapshot in memory is only used for the
+                                 client it was taken with
+        :param fields: The fields of the nodes to list, all of them when None
+        """
+        fields_supported = utils.node_fields_supported(baremetal_client)
+        if fields is not None and fields_supported:
+            fields = sorted(set(fields) | {'uuid', 'updated_at'})
+        elif fields is not None:
+            fields = None
+        with self._lock:
+            if (self._client is baremetal_client and
+                    self._fields == fields and
+                    self._nodes is not None and self._fresh(self._taken)):
+                return list(self._nodes)
+            nodes = taken = None
+            if fields_supported:
+                nodes, taken = self._load(baremetal_client, fields)
+            if nodes is None:
+                if fields is None:
+                    nodes = baremetal_client.node.list(detail=True, limit=0)
+                else:
+                    nodes = baremetal_client.node.list(fields=fields,
+                                                       limit=0)
+                nodes = list(nodes)
+                taken = self._clock()
+                if fields_supported:
+                    self._save(nodes, fields, taken)
+            self._client = baremetal_client
+            self._fields = fields
+            self._nodes = nodes
+            self._taken = taken
+            return list(nodes)
+
+    def _load(self, baremetal_client, fields):
+        if not self.path:
+            return None, None
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug("Ignoring node snapshot %s: %s", self.path, e)
+            return None, None
+        if not isinstance(snapshot, dict) or \
+                snapshot.get('version') != self.version or \
+                snapshot.get('fields') != fields or \
+                not self._fresh(snapshot.get('taken')):
+            return None, None
+
+        nodes = snapshot.get('nodes') or []
+        current = {n.uuid: n.updated_at for n in baremetal_client.node.list(
+            limit=0, fields=['uuid', 'updated_at'])}
+        if current != {n.get('uuid'): n.get('updated_at') for n in nodes}:
+            LOG.debug("Nodes changed since the snapshot %s", self.path)
+            return None, None
+        return [CachedNode(n) for n in nodes], snapshot['taken']
+
+    def _save(self, nodes, fields, taken):
+        if not self.path:
+            return
+        try:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmp_path = '%s.tmp' % self.path
+            # The nodes hold the (masked) credentials of their BMC
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': self.version, 'taken': taken,
+                           'fields': fields,
+                           'nodes': [n.to_dict() for n in nodes]}, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            LOG.debug("Failed to save the node snapshot %s: %s",
+                      self.path, e)
+
+    def invalidate(self):
+        """Forget the snapshot, e.g. after changing nodes"""
+        with self._lock:
+            self._client = self._fields = self._nodes = self._taken = None
+            if self.path and os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path=None, ttl=DEFAULT_TTL):
+    """Return the snapshot cache of this process
+
+    :param path: Where the snapshot is saved, None to only keep it in memory
+    :param ttl: How long the snapshot is used, in seconds
+    """
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = NodeSnapshotCache(path, ttl=ttl)
+        cache.ttl = ttl
+        return cache
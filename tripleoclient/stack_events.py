@@ -0,0 +1,363 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import contextlib
+import gzip
+import json
+import logging
+import threading
+import time
+import zlib
+
+from heatclient.common import utils as heat_utils
+from heatclient import exc as hc_exc
+
+LOG = logging.getLogger(__name__)
+
+MSG_TEMPLATE = "\n Stack %(name)s %(status)s \n"
+
+# The recorder events are written to while recording() is active
+_recorder = None
+
+
+class EventTailer(object):
+    """Follow the events of a stack and of its nested stacks
+
+    Unlike heatclient.common.event_utils.poll_for_events, only the events
+    which happened since the last poll are fetched. When the Heat API
+    supports nested_depth a single marker is kept for the whole stack,
+    otherwise a marker is kept for every nested stack and a nested stack is
+    only looked for again when its parent stack had new events.
+
+    The polling period is reset to min_period whenever there are new events
+    and doubles after every poll without events, up to max_period.
+    """
+
+    def __init__(self, orchestration_client, stack_name, action=None,
+                 marker=None, out=None, nested_depth=2, min_period=2,
+                 max_period=20, sleep=None, recorder=None):
+        self.client = orchestration_client
+        self.stack_name = stack_name
+        self.action = action
+        self.out = out
+        self.nested_depth = nested_depth
+        self.min_period = min_period
+        self.max_period = max_period
+        self.period = min_period
+        self._sleep = sleep or time.sleep
+        self.recorder = recorder
+        self._log_context = heat_utils.EventLogContext()
+
+        # None until the first events tell whether the API supports
+        # nested_depth.
+        self.nested_supported = None
+        # Marker of the last event seen for each stack, and the depth of
+        # each nested stack found when the API doesn't support nested_depth.
+        self._markers = {stack_name: marker}
+        self._depths = {stack_name: 0}
+        self._first_poll = True
+        # A marker means a new action of an existing stack is followed
+        self._existing = marker is not None
+
+    def _stop(self, status):
+        if self.action:
+            return status in ('%s_FAILED' % self.action,
+                              '%s_COMPLETE' % self.action)
+        return status.endswith('_COMPLETE') or status.endswith('_FAILED')
+
+    def _list(self, stack_id, **kwargs):
+        """List the events of a stack
+
+        :returns: the events, or None when a nested stack was deleted, e.g.
+                  when its resource was replaced or scaled down, in which
+                  case it is no longer followed
+        :raises hc_exc.CommandError: when the root stack is not found
+        """
+        kwargs = dict((k, v) for k, v in kwargs.items() if v)
+        kwargs.setdefault('sort_dir', 'asc')
+        try:
+            events = self.client.events.list(stack_id=stack_id, **kwargs)
+        except hc_exc.HTTPNotFound as e:
+            if stack_id == self.stack_name:
+                raise hc_exc.CommandError(str(e))
+            LOG.debug("Nested stack %s was deleted, not following it",
+                      stack_id)
+            self._markers.pop(stack_id, None)
+            self._depths.pop(stack_id, None)
+            return None
+        for event in events:
+            event.stack_name = _stack_name_from_links(event) or \
+                stack_id.split('/')[0]
+        return events
+
+    def _nested_stacks(self, stack_id):
+        try:
+            resources = self.client.resources.list(stack_id=stack_id)
+        except hc_exc.HTTPNotFound:
+            return []
+        nested = []
+        for resource in resources:
+            nested_id = heat_utils.resource_nested_identifier(resource)
+            if nested_id:
+                nested.append(nested_id)
+        return nested
+
+    def poll(self):
+        """Return the events which happened since the last poll"""
+        root = self.stack_name
+        if self.nested_supported is False:
+            events = self._list(root, marker=self._markers[root])
+        else:
+            events = self._list(root, marker=self._markers[root],
+                                nested_depth=self.nested_depth)
+            if events and self.nested_supported is None:
+                self.nested_supported = (not self.nested_depth or
+                                         _has_root_stack_link(events[0]))
+                LOG.debug("Heat API nested_depth support: %s",
+                          self.nested_supported)
+
+        if events:
+            self._markers[root] = events[-1].id
+        if self.nested_supported is not False:
+            return events
+
+        # Without server side nested_depth support the events of each
+        # nested stack are fetched separately, from their own marker.
+        changed = [root] if events else []
+        for stack_id in sorted(self._markers):
+            if stack_id == root:
+                continue
+            nested_events = self._list(stack_id,
+                                       marker=self._markers[stack_id])
+            if nested_events:
+                self._markers[stack_id] = nested_events[-1].id
+                events.extend(nested_events)
+                changed.append(stack_id)
+
+        # New nested stacks can only appear in a stack with new events. On
+        # the first poll every stack is looked at, and when following a new
+        # action of an existing stack only the events which happened after
+        # the first poll are shown for the nested stacks found.
+        if self._first_poll:
+            changed = [root]
+        for stack_id in changed:
+            if stack_id not in self._depths:
+                continue
+            depth = self._depths[stack_id] + 1
+            if depth > self.nested_depth:
+                continue
+            for nested_id in self._nested_stacks(stack_id):
+                if nested_id in self._markers:
+                    continue
+                self._depths[nested_id] = depth
+                if self._first_poll and self._existing:
+                    latest = self._list(nested_id, sort_dir='desc', limit=1)
+                    if latest is None:
+                        continue
+                    self._markers[nested_id] = \
+                        latest[0].id if latest else None
+                    changed.append(nested_id)
+                    continue
+                nested_events = self._list(nested_id)
+                if nested_events is None:
+                    continue
+                self._markers[nested_id] = \
+                    nested_events[-1].id if nested_events else None
+                events.extend(nested_events)
+                changed.append(nested_id)
+        self._first_poll = False
+
+        events.sort(key=lambda e: e.event_time)
+        return events
+
+    def _is_stack_event(self, event):
+        if getattr(event, 'resource_name', '') != self.stack_name:
+            return False
+        phys_id = getattr(event, 'physical_resource_id', '')
+        links = dict((link.get('rel'), link.get('href'))
+                     for link in getattr(event, 'links', []))
+        stack_id = links.get('stack', phys_id).rsplit('/', 1)[-1]
+        return stack_id == phys_id
+
+    def render(self, events):
+        """Write the events to out, if any"""
+        if self.out is None or not events:
+            return
+        self.out.write(heat_utils.event_log_formatter(
+            events, self._log_context))
+        self.out.write('\n')
+
+    def wait(self):
+        """Follow the events until the stack action finishes
+
+        :returns: tuple of the final stack status and a message
+        """
+        idle_polls = 0
+        while True:
+            events = self.poll()
+            if events:
+                idle_polls = 0
+                self.period = self.min_period
+                self.render(events)
+                if self.recorder is not None:
+                    self.recorder.record_events(events, self.stack_name)
+                for event in events:
+                    if self._is_stack_event(event):
+                        status = getattr(event, 'resource_status', '')
+                        if self._stop(status):
+                            return status, MSG_TEMPLATE % dict(
+                                name=self.stack_name, status=status)
+            else:
+                idle_polls += 1
+                self.period = min(self.period * 2, self.max_period)
+
+            if idle_polls >= 2:
+                # After 2 polls without events check the stack itself, in
+                # case the event for its status was missed.
+                idle_polls = 0
+                stack = self.client.stacks.get(self.stack_name,
+                                               resolve_outputs=False)
+                status = stack.stack_status
+                if self._stop(status):
+                    return status, MSG_TEMPLATE % dict(
+                        name=self.stack_name, status=status)
+
+            self._sleep(self.period)
+
+
+class EventRecorder(object):
+    """Append Heat events and workflow messages to a compressed log
+
+    Every record is a JSON object on its own line. Each batch of records is
+    flushed as it's written, so a log is readable up to the last batch when
+    the command is interrupted, and a log can be appended to by several
+    commands. Use read_event_log to read it.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._log_context = heat_utils.EventLogContext()
+        self._file = gzip.open(path, 'ab')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, records):
+        data = ''.join(json.dumps(record, sort_keys=True, default=str) + '\n'
+                       for record in records)
+        with self._lock:
+            self._file.write(data.encode('utf-8'))
+            self._file.flush()
+
+    def record_events(self, events, stack_name):
+        """Record Heat events of the stack stack_name or its nested stacks"""
+        recorded = self._clock()
+        self._write([{
+            'type': 'heat',
+            'recorded': recorded,
+            'stack': stack_name,
+            'id': getattr(event, 'id', None),
+            'stack_name': getattr(event, 'stack_name', None),
+            'resource_name': getattr(event, 'resource_name', None),
+            'stack_id': _event_stack_id(event),
+            'resource_path': self._log_context.build_resource_name(event),
+            'physical_resource_id': getattr(event, 'physical_resource_id',
+                                            None),
+            'status': getattr(event, 'resource_status', None),
+            'status_reason': getattr(event, 'resource_status_reason', None),
+            'event_time': getattr(event, 'event_time', None),
+        } for event in events])
+
+    def record_payload(self, payload):
+        """Record a message received from a Mistral workflow"""
+        self._write([{
+            'type': 'workflow',
+            'recorded': self._clock(),
+            'payload': payload,
+        }])
+
+
+@contextlib.contextmanager
+def recording(path):
+    """Record the events and messages received while the block runs
+
+    Nothing is recorded when path is empty.
+    """
+    global _recorder
+    if not path:
+        yield None
+        return
+    recorder = EventRecorder(path)
+    previous, _recorder = _recorder, recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        recorder.close()
+
+
+def active_recorder():
+    """Return the recorder of the active recording() block, if any"""
+    return _recorder
+
+
+def record_payload(payload):
+    """Record a workflow message if recording() is active"""
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record_payload(payload)
+
+
+def read_event_log(path):
+    """Yield the records of a log written by EventRecorder
+
+    The records written before an interruption are returned, a truncated
+    last batch is ignored.
+    """
+    with gzip.open(path, 'rb') as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line.decode('utf-8'))
+                except ValueError:
+                    LOG.debug("Ignoring invalid record in %s", path)
+        except (EOFError, IOError, zlib.error) as e:
+            LOG.warning("Event log %s is truncated: %s", path, e)
+
+
+def _event_stack_id(event):
+    """Return the ID of the stack an event belongs to"""
+    if getattr(event, 'stack_id', None) is not None:
+        return event.stack_id
+    for link in getattr(event, 'links', []):
+        if link.get('rel') == 'stack' and 'href' in link:
+            return link['href'].rsplit('/', 1)[-1]
+    return None
+
+
+def _has_root_stack_link(event):
+    return any(link.get('rel') == 'root_stack'
+               for link in getattr(event, 'links', None) or [])
+
+
+def _stack_name_from_links(event):
+    for link in getattr(event, 'links', None) or []:
+        if link.get('rel') == 'stack':
+            return link.get('href', '').split(
+                '/stacks/', 1)[-1].split('/')[0]
+    return None
@@ -0,0 +1,153 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import collections
+import logging
+import sys
+
+from heatclient.common import format_utils
+from heatclient import exc as hc_exc
+
+from tripleoclient import stack_inspection
+
+LOG = logging.getLogger(__name__)
+
+DEPLOYMENT_RESOURCE_TYPES = ('OS::Heat::StructuredDeployment',
+                             'OS::Heat::SoftwareDeployment')
+
+
+class StackFailures(object):
+    """The failed resources of a stack
+
+    This gives the same report as "openstack stack failures list" using an
+    existing orchestration client. The failed nested stacks of a level are
+    listed concurrently with a stack_inspection.StackInspector and so are
+    the software deployments of the failed deployment resources.
+
+    As with "openstack stack failures list", a failed nested stack resource
+    is only reported when its nested stack has no failed resources.
+    """
+
+    def __init__(self, orchestration_client, inspector=None):
+        self.client = orchestration_client
+        self.inspector = inspector
+        # Failed resources keyed by their dotted path from the root stack
+        self.resources = collections.OrderedDict()
+        # Software deployments of the failed resources, keyed by their ID
+        self.deployments = {}
+
+    def _deployment(self, deployment_id):
+        try:
+            return self.client.software_deployments.get(
+                deployment_id=deployment_id)
+        except hc_exc.HTTPNotFound:
+            return None
+
+    def collect(self, stack_name):
+        """Find the failed resources of a stack
+
+        :param stack_name: Name or ID of the stack
+        :type  stack_name: string
+
+        :returns: self, with resources and deployments filled in
+        """
+        stack = self.client.stacks.get(stack_name, resolve_outputs=False)
+        if not stack.stack_status.endswith('FAILED'):
+            return self
+
+        if self.inspector is None:
+            with stack_inspection.StackInspector(self.client) as inspector:
+                self._collect(inspector, stack)
+        else:
+            self._collect(self.inspector, stack)
+        return self
+
+    def _collect(self, inspector, stack):
+        failures = {}
+        # Each level of nested stacks is listed at once, every item is the
+        # path of a stack and the failed resource it belongs to, if any.
+        level = [((stack.stack_name,), stack.id, None)]
+        while level:
+            listed = inspector.resources_of(
+                [stack_id for _path, stack_id, _parent in level])
+            next_level = []
+            for item, resources in zip(level, listed):
+                path, _stack_id, parent = item
+                failed = [r for r in resources
+                          if r.resource_status.endswith('FAILED')]
+                if parent is not None and not failed:
+                    failures[path] = parent
+                for rsc in failed:
+                    rsc_path = path + (rsc.resource_name,)
+                    nested_id = stack_inspection.nested_stack_id(rsc)
+                    if nested_id:
+                        next_level.append((rsc_path, nested_id, rsc))
+                    else:
+                        failures[rsc_path] = rsc
+            level = next_level
+
+        for path in sorted(failures):
+            self.resources['.'.join(path)] = failures[path]
+
+        deployment_ids = [
+            r.physical_resource_id for r in self.resources.values()
+            if r.resource_type in DEPLOYMENT_RESOURCE_TYPES]
+        for deployment_id, deployment in zip(
+                deployment_ids, inspector.map(self._deployment,
+                                              deployment_ids)):
+            if deployment is not None:
+                self.deployments[deployment_id] = deployment
+
+    def write(self, out=None, long=False):
+        """Write the failed resources and their deployment output
+
+        :param out: File to write to, sys.stdout by default
+
+        :param long: Whether to write the full deployment output
+        :type  long: boolean
+        """
+        out = out or sys.stdout
+        for path, rsc in self.resources.items():
+            out.write('%s:\n' % path)
+            out.write('  resource_type: %s\n' % rsc.resource_type)
+            out.write('  physical_resource_id: %s\n' %
+                      rsc.physical_resource_id)
+            out.write('  status: %s\n' % rsc.resource_status)
+            reason = format_utils.indent_and_truncate(
+                rsc.resource_status_reason,
+                spaces=4,
+                truncate=not long,
+                truncate_prefix='...\n')
+            out.write('  status_reason: |\n%s\n' % reason)
+            deployment = self.deployments.get(rsc.physical_resource_id)
+            if deployment:
+                for output in ('deploy_stdout', 'deploy_stderr'):
+                    format_utils.print_software_deployment_output(
+                        data=deployment.output_values, name=output,
+                        long=long, out=out)
+
+
+def print_failures(orchestration_client, stack_name, out=None, long=False):
+    """Print the failed resources of a stack
+
+    Errors are logged rather than raised, so they don't hide the error
+    which caused the stack to fail.
+    """
+    try:
+        StackFailures(orchestration_client).collect(stack_name).write(
+            out=out, long=long)
+    except Exception as e:
+        LOG.error("Failed to list the failures of stack %s: %s",
+                  stack_name, e)
@@ -0,0 +1,133 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+from concurrent import futures
+import logging
+import threading
+
+from heatclient.common import utils as heat_utils
+from heatclient import exc as hc_exc
+
+LOG = logging.getLogger(__name__)
+
+
+def nested_stack_id(resource):
+    """Return the identifier of the nested stack of a resource, if any"""
+    return heat_utils.resource_nested_identifier(resource)
+
+
+def _settled(resources):
+    """Whether none of the resources can change until the next stack action"""
+    for resource in resources:
+        status = resource.resource_status
+        if not status.endswith('_COMPLETE') or status == 'INIT_COMPLETE':
+            return False
+    return True
+
+
+class StackInspector(object):
+    """Walk the resources of a stack and of its nested stacks
+
+    Nested stacks are walked breadth first, the stacks of each level being
+    listed concurrently. The resources of a stack are kept once all of them
+    completed, as they can't change before the next stack action, so an
+    inspector is meant to be used for the duration of a single action.
+
+    The inspector can be used as a context manager, otherwise close() must
+    be called to stop its worker threads.
+    """
+
+    def __init__(self, orchestration_client, max_workers=8):
+        self.client = orchestration_client
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def map(self, fn, items):
+        """Call fn for every item concurrently and return the results"""
+        return list(self._executor.map(fn, items))
+
+    def resources(self, stack_id):
+        """Return the resources of a stack, or [] if it doesn't exist"""
+        with self._lock:
+            cached = self._cache.get(stack_id)
+        if cached is not None:
+            return cached
+        try:
+            resources = self.client.resources.list(stack_id)
+        except hc_exc.HTTPNotFound:
+            return []
+        if _settled(resources):
+            with self._lock:
+                self._cache[stack_id] = resources
+        return resources
+
+    def resources_of(self, stack_ids):
+        """Return the resources of each stack, listing them concurrently"""
+        if len(stack_ids) == 1:
+            return [self.resources(stack_ids[0])]
+        return self.map(self.resources, stack_ids)
+
+    def walk(self, stack_id, nested_depth=None, descend=None):
+        """Yield the resources of a stack and of its nested stacks
+
+        :param stack_id: Name or ID of the stack
+        :type  stack_id: string
+
+        :param nested_depth: How many levels of nested stacks to walk, all
+                             of them when None
+        :type  nested_depth: integer
+
+        :param descend: Called with each resource with a nested stack to
+                        decide whether to walk it, all are walked when None
+
+        :returns: iterator of tuples of the path of resource names from the
+                  stack and resource, level by level
+        """
+        level = [((), stack_id)]
+        depth = 0
+        while level:
+            listed = self.resources_of([sid for _path, sid in level])
+            next_level = []
+            for (path, _sid), resources in zip(level, listed):
+                for resource in resources:
+                    resource_path = path + (resource.resource_name,)
+                    yield resource_path, resource
+                    if nested_depth is not None and depth >= nested_depth:
+                        continue
+                    nested_id = nested_stack_id(resource)
+                    if nested_id and (descend is None or descend(resource)):
+                        next_level.append((resource_path, nested_id))
+            level = next_level
+            depth += 1
+
+    def find(self, stack_id, resource_types, nested_depth=None):
+        """Return the resources of the given types, breadth first
+
+        :param resource_types: Resource types to look for
+        :type  resource_types: list of strings
+        """
+        return [resource for _path, resource in
+                self.walk(stack_id, nested_depth=nested_depth)
+                if resource.resource_type in resource_types]
@@ -0,0 +1,201 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import copy
+import os
+import shutil
+import stat
+import tempfile
+
+from heatclient.common import template_utils
+from heatclient import exc as hc_exc
+import mock
+from unittest import TestCase
+
+from tripleoclient import environment
+
+
+class TestLayeredEnvironment(TestCase):
+
+    def setUp(self):
+        self.envs = [
+            ('params.yaml', {
+                'parameter_defaults': {
+                    'ControllerCount': 1,
+                    'ExtraConfig': {'a': 1, 'b': {'c': 2}},
+                },
+            }),
+            ('first.yaml', {
+                'resource_registry': {'Foo': 'foo.yaml'},
+                'parameter_defaults': {
+                    'ControllerCount': 3,
+                    'ExtraConfig': {'b': {'d': 3}},
+                    'NtpServer': ['pool.ntp.org'],
+                },
+            }),
+            ('second.yaml', {
+                'resource_registry': {'Foo': 'OS::Heat::None',
+                                      'Bar': 'bar.yaml'},
+                'parameter_defaults': {'ExtraConfig': None},
+                'parameters': {'ServiceNetMap': {'x': 'y'}},
+            }),
+        ]
+
+    def _layered(self):
+        layers = environment.LayeredEnvironment()
+        for source, env in self.envs:
+            layers.add(env, source)
+        return layers
+
+    def test_merge_matches_deep_update(self):
+        expected = {}
+        for _source, env in copy.deepcopy(self.envs):
+            template_utils.deep_update(expected, env)
+
+        self.assertEqual(expected, self._layered().merge())
+
+    def test_merge_leaves_environments_untouched(self):
+        original = copy.deepcopy(self.envs)
+        merged = self._layered().merge()
+        merged['parameter_defaults']['ExtraConfig']['b']['e'] = 4
+
+        self.assertEqual(original, self.envs)
+
+    def test_source_of(self):
+        layers = self._layered()
+
+        self.assertEqual('first.yaml', layers.source_of('ControllerCount'))
+        self.assertEqual('second.yaml', layers.source_of('ExtraConfig'))
+        self.assertEqual('second.yaml',
+                         layers.source_of('Foo', 'resource_registry'))
+        self.assertEqual('second.yaml',
+                         layers.source_of('ServiceNetMap', 'parameters'))
+        self.assertIsNone(layers.source_of('Missing'))
+
+    def test_empty_environments_ignored(self):
+        layers = environment.LayeredEnvironment()
+        layers.add({}, 'empty.yaml')
+        layers.add(None, 'none.yaml')
+
+        self.assertEqual(0, len(layers))
+        self.assertEqual({}, layers.merge())
+
+    def test_extend(self):
+        layers = environment.LayeredEnvironment()
+        layers.add({'parameter_defaults': {'A': 1}}, 'cli')
+        layers.extend(self._layered())
+
+        self.assertEqual(['cli', 'params.yaml', 'first.yaml', 'second.yaml'],
+                         layers.sources)
+
+
+class TestEnvironmentDirectoryIndex(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.index_path = os.path.join(self.root, 'index', 'index.yaml')
+        self.env_path = os.path.join(self.root, 'env.yaml')
+        self.nested_path = os.path.join(self.root, 'nested.yaml')
+        self._write(self.nested_path, 'heat_template_version: ocata\n')
+        self._write(self.env_path,
+                    'resource_registry:\n  Test: nested.yaml\n'
+                    'parameter_defaults:\n  Foo: bar\n')
+        patcher = mock.patch(
+            'heatclient.common.template_utils.process_environment_and_files',
+            side_effect=template_utils.process_environment_and_files)
+        self.mock_process = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, path, contents, mtime=None):
+        with open(path, 'w') as f:
+            f.write(contents)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def _process(self):
+        index = environment.EnvironmentDirectoryIndex(self.index_path)
+        result = index.process([self.env_path])
+        index.save()
+        return result
+
+    def test_process(self):
+        files, env = self._process()[self.env_path]
+
+        self.assertEqual({'Foo': 'bar'}, env['parameter_defaults'])
+        self.assertIn('file://%s' % self.nested_path, files)
+        self.assertTrue(os.path.isfile(self.index_path))
+        # The environments may hold secrets
+        self.assertEqual(0o600,
+                         stat.S_IMODE(os.stat(self.index_path).st_mode))
+
+    def test_old_index_dropped(self):
+        # An index written readable by everyone by an older version
+        with mock.patch.object(environment.EnvironmentDirectoryIndex,
+                               'version', 1):
+            self._process()
+        os.chmod(self.index_path, 0o644)
+
+        self._process()
+
+        self.assertEqual(2, self.mock_process.call_count)
+
+        self.assertEqual(0o600,
+                         stat.S_IMODE(os.stat(self.index_path).st_mode))
+
+    def test_unchanged_reused(self):
+        first = self._process()
+        second = self._process()
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.mock_process.call_count)
+
+    def test_env_changed(self):
+        self._process()
+        self._write(self.env_path, 'parameter_defaults:\n  Foo: baz\n',
+                    mtime=1)
+
+        files, env = self._process()[self.env_path]
+        self.assertEqual({'Foo': 'baz'}, env['parameter_defaults'])
+        self.assertEqual(2, self.mock_process.call_count)
+
+    def test_env_touched(self):
+        self._process()
+        os.utime(self.env_path, (1, 1))
+
+        self._process()
+        self._process()
+        self.assertEqual(1, self.mock_process.call_count)
+
+    def test_reference_changed(self):
+        self._process()
+        self._write(self.nested_path, 'heat_template_version: pike\n',
+                    mtime=1)
+
+        files, env = self._process()[self.env_path]
+        self.assertIn('pike', files['file://%s' % self.nested_path])
+        self.assertEqual(2, self.mock_process.call_count)
+
+    def test_process_error(self):
+        self.mock_process.side_effect = hc_exc.CommandError('error')
+
+        self.assertEqual({}, self._process())
+        self.assertFalse(os.path.exists(self.index_path))
+
+    def test_corrupt_index(self):
+        os.mkdir(os.path.dirname(self.index_path))
+        self._write(self.index_path, '{invalid')
+
+        self.assertIn(self.env_path, self._process())
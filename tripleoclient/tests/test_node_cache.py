@@ -0,0 +1,150 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from tripleoclient import node_cache
+
+
+class FakeNode(object):
+
+    def __init__(self, uuid, updated_at=None, **info):
+        self.uuid = uuid
+        self.updated_at = updated_at
+        self.__dict__.update(info)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class TestNodeSnapshotCache(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'cache', 'node-snapshot.json')
+        self.now = 1000.0
+        self.nodes = [FakeNode('uuid1', provision_state='available',
+                               properties={'capabilities': 'profile:compute'}),
+                      FakeNode('uuid2', '2017-01-01T00:00:00+00:00',
+                               provision_state='active', properties={})]
+        self.client = self._client()
+
+    def _client(self):
+        client = mock.Mock()
+        client.http_client.os_ironic_api_version = '1.8'
+
+        def list_nodes(fields=None, **kwargs):
+            if fields:
+                return [FakeNode(n.uuid, n.updated_at) for n in self.nodes]
+            return list(self.nodes)
+
+        client.node.list.side_effect = list_nodes
+        return client
+
+    def _cache(self, path=None, ttl=30):
+        return node_cache.NodeSnapshotCache(path, ttl=ttl,
+                                            clock=lambda: self.now)
+
+    def test_memory(self):
+        cache = self._cache()
+
+        self.assertEqual(self.nodes, cache.nodes(self.client))
+        self.assertEqual(self.nodes, cache.nodes(self.client))
+        self.client.node.list.assert_called_once_with(detail=True, limit=0)
+
+        # Another client, or an expired snapshot, lists the nodes again
+        self.assertEqual(self.nodes, cache.nodes(self._client()))
+        self.now += 30
+        cache.nodes(self.client)
+        self.assertEqual(2, self.client.node.list.call_count)
+
+    def test_invalidate(self):
+        cache = self._cache(self.path)
+        cache.nodes(self.client)
+        self.assertTrue(os.path.exists(self.path))
+
+        cache.invalidate()
+
+        self.assertFalse(os.path.exists(self.path))
+        cache.nodes(self.client)
+        self.assertEqual(2, self.client.node.list.call_count)
+
+    def test_disk(self):
+        self._cache(self.path).nodes(self.client)
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+        client = self._client()
+        nodes = self._cache(self.path).nodes(client)
+
+        # Only the UUIDs and updated_at are listed to check the snapshot
+        client.node.list.assert_called_once_with(
+            limit=0, fields=['uuid', 'updated_at'])
+        self.assertEqual(['uuid1', 'uuid2'], [n.uuid for n in nodes])
+        self.assertEqual('profile:compute',
+                         nodes[0].properties['capabilities'])
+        self.assertRaises(AttributeError, getattr, nodes[0], 'missing')
+
+    def test_disk_nodes_changed(self):
+        self._cache(self.path).nodes(self.client)
+        self.nodes[0].updated_at = '2017-01-02T00:00:00+00:00'
+
+        client = self._client()
+        nodes = self._cache(self.path).nodes(client)
+
+        self.assertEqual(self.nodes, nodes)
+        self.assertEqual(2, client.node.list.call_count)
+
+    def test_disk_expired(self):
+        self._cache(self.path).nodes(self.client)
+        self.now += 60
+
+        client = self._client()
+        self._cache(self.path).nodes(client)
+
+        client.node.list.assert_called_once_with(detail=True, limit=0)
+
+    def test_disk_invalid(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('not json')
+
+        self.assertEqual(self.nodes, self._cache(self.path).nodes(
+            self.client))
+
+    def test_fields_unsupported(self):
+        self.client.http_client.os_ironic_api_version = '1.6'
+        cache = self._cache(self.path)
+
+        self.assertEqual(self.nodes, cache.nodes(self.client,
+                                                 fields=['uuid']))
+        self.assertEqual(self.nodes, cache.nodes(self.client))
+
+        # The whole nodes are listed once, and never saved to disk
+        self.client.node.list.assert_called_once_with(detail=True, limit=0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_get_cache(self):
+        cache = node_cache.get_cache(self.path, ttl=10)
+
+        self.assertIs(cache, node_cache.get_cache(self.path, ttl=20))
+        self.assertEqual(20, cache.ttl)
+        self.assertIsNot(cache, node_cache.get_cache())
@@ -0,0 +1,278 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from heatclient import exc as hc_exc
+import mock
+import six
+
+from tripleoclient import stack_events
+
+
+def fake_event(id, resource_name, status, event_time, stack='overcloud',
+               physical_resource_id='', root_stack=True):
+    event = mock.Mock()
+    event.id = id
+    event.stack_id = None
+    event.resource_name = resource_name
+    event.resource_status = status
+    event.resource_status_reason = 'state changed'
+    event.event_time = event_time
+    event.physical_resource_id = physical_resource_id
+    event.links = [{'rel': 'stack',
+                    'href': 'http://heat/v1/t/stacks/%s/%s-id' % (stack,
+                                                                  stack)}]
+    if root_stack:
+        event.links.append({'rel': 'root_stack',
+                            'href': 'http://heat/v1/t/stacks/overcloud'})
+    return event
+
+
+def fake_resource(nested_id=None):
+    resource = mock.Mock()
+    resource.links = []
+    if nested_id:
+        resource.links.append({'rel': 'nested',
+                               'href': 'http://heat/v1/t/stacks/%s' %
+                               nested_id})
+    return resource
+
+
+class TestEventTailer(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.sleep = mock.Mock()
+
+    def tailer(self, **kwargs):
+        return stack_events.EventTailer(self.client, 'overcloud',
+                                        sleep=self.sleep, **kwargs)
+
+    def test_wait_complete_event(self):
+        self.client.events.list.side_effect = [
+            [fake_event('1', 'Controller', 'CREATE_IN_PROGRESS', '01')],
+            [fake_event('2', 'Controller', 'CREATE_COMPLETE', '02'),
+             fake_event('3', 'overcloud', 'CREATE_COMPLETE', '03',
+                        physical_resource_id='overcloud-id')],
+        ]
+        out = six.StringIO()
+
+        status, msg = self.tailer(action='CREATE', out=out).wait()
+
+        self.assertEqual('CREATE_COMPLETE', status)
+        self.assertIn('overcloud CREATE_COMPLETE', msg)
+        self.assertEqual([
+            mock.call(stack_id='overcloud', sort_dir='asc', nested_depth=2),
+            mock.call(stack_id='overcloud', sort_dir='asc', nested_depth=2,
+                      marker='1'),
+        ], self.client.events.list.call_args_list)
+        self.assertIn('[Controller]: CREATE_COMPLETE', out.getvalue())
+        self.sleep.assert_called_once_with(2)
+
+    def test_wait_backoff_and_stack_status(self):
+        self.client.events.list.side_effect = [[], [], [], []]
+        self.client.stacks.get.side_effect = [
+            mock.Mock(stack_status='UPDATE_IN_PROGRESS'),
+            mock.Mock(stack_status='UPDATE_FAILED'),
+        ]
+
+        status, msg = self.tailer(action='UPDATE', marker='0',
+                                  max_period=10).wait()
+
+        self.assertEqual('UPDATE_FAILED', status)
+        self.assertEqual([mock.call(4), mock.call(8), mock.call(10)],
+                         self.sleep.call_args_list)
+        self.client.stacks.get.assert_called_with('overcloud',
+                                                  resolve_outputs=False)
+
+    def test_no_output_when_not_verbose(self):
+        self.client.events.list.return_value = [
+            fake_event('3', 'overcloud', 'CREATE_COMPLETE', '03',
+                       physical_resource_id='overcloud-id')]
+        with mock.patch('heatclient.common.utils.event_log_formatter') as f:
+            self.tailer().wait()
+        self.assertFalse(f.called)
+
+    def test_poll_nested_markers(self):
+        # An API without nested_depth support returns the events of the
+        # root stack only, the nested stacks are polled separately.
+        root_events = [
+            [fake_event('r1', 'Controller', 'CREATE_IN_PROGRESS', '01',
+                        root_stack=False)],
+            [],
+        ]
+        nested_events = [
+            [fake_event('n1', 'Server', 'CREATE_IN_PROGRESS', '02',
+                        stack='overcloud-Controller', root_stack=False)],
+            [fake_event('n2', 'Server', 'CREATE_COMPLETE', '04',
+                        stack='overcloud-Controller', root_stack=False)],
+        ]
+
+        def list_events(stack_id, **kwargs):
+            if stack_id == 'overcloud':
+                return root_events.pop(0)
+            return nested_events.pop(0)
+
+        self.client.events.list.side_effect = list_events
+        self.client.resources.list.return_value = [
+            fake_resource(),
+            fake_resource('overcloud-Controller/ctrl-id')]
+
+        tailer = self.tailer(nested_depth=1)
+        events = tailer.poll()
+        self.assertFalse(tailer.nested_supported)
+        self.assertEqual(['r1', 'n1'], [e.id for e in events])
+        self.assertEqual('overcloud-Controller', events[1].stack_name)
+
+        events = tailer.poll()
+        self.assertEqual(['n2'], [e.id for e in events])
+        self.client.events.list.assert_called_with(
+            stack_id='overcloud-Controller/ctrl-id', sort_dir='asc',
+            marker='n1')
+        # The root stack had no new events so no new nested stack is
+        # looked for.
+        self.client.resources.list.assert_called_once_with(
+            stack_id='overcloud')
+
+    def test_poll_nested_deleted(self):
+        root_events = [
+            [fake_event('r1', 'Controller', 'UPDATE_IN_PROGRESS', '01',
+                        root_stack=False)],
+            [],
+            [],
+        ]
+        nested_events = [
+            [fake_event('n1', 'Server', 'UPDATE_IN_PROGRESS', '02',
+                        stack='overcloud-Controller', root_stack=False)],
+            hc_exc.HTTPNotFound(),
+        ]
+
+        def list_events(stack_id, **kwargs):
+            if stack_id == 'overcloud':
+                return root_events.pop(0)
+            result = nested_events.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.client.events.list.side_effect = list_events
+        self.client.resources.list.return_value = [
+            fake_resource('overcloud-Controller/ctrl-id')]
+
+        tailer = self.tailer(nested_depth=1)
+        self.assertEqual(['r1', 'n1'], [e.id for e in tailer.poll()])
+
+        # The nested stack was deleted, it's no longer followed
+        self.assertEqual([], tailer.poll())
+        self.assertEqual([], tailer.poll())
+        # Only the root stack is listed by the last poll
+        self.assertEqual(5, self.client.events.list.call_count)
+        self.client.events.list.assert_called_with(stack_id='overcloud',
+                                                   sort_dir='asc',
+                                                   marker='r1')
+
+    def test_poll_root_not_found(self):
+        self.client.events.list.side_effect = hc_exc.HTTPNotFound()
+
+        self.assertRaises(hc_exc.CommandError, self.tailer().poll)
+
+    def test_poll_nested_existing_stack(self):
+        self.client.events.list.side_effect = [
+            [fake_event('r2', 'Controller', 'UPDATE_IN_PROGRESS', '05',
+                        root_stack=False)],
+            [fake_event('n9', 'Server', 'CREATE_COMPLETE', '02',
+                        stack='overcloud-Controller', root_stack=False)],
+        ]
+        self.client.resources.list.return_value = [
+            fake_resource('overcloud-Controller/ctrl-id')]
+
+        tailer = self.tailer(marker='r1', nested_depth=1)
+        events = tailer.poll()
+
+        # The events of the previous actions of the nested stack are
+        # skipped.
+        self.assertEqual(['r2'], [e.id for e in events])
+        self.client.events.list.assert_called_with(
+            stack_id='overcloud-Controller/ctrl-id', sort_dir='desc',
+            limit=1)
+
+
+class TestEventRecorder(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'events.log.gz')
+
+    def test_record_and_read(self):
+        with stack_events.recording(self.path) as recorder:
+            self.assertIs(recorder, stack_events.active_recorder())
+            recorder.record_events([
+                fake_event('1', 'Controller', 'CREATE_IN_PROGRESS',
+                           '2017-10-01T00:00:00Z',
+                           physical_resource_id='ctrl-id')],
+                'overcloud')
+            stack_events.record_payload({'execution': {'id': 'x'}})
+        self.assertIsNone(stack_events.active_recorder())
+
+        # Another command appends to the same log
+        with stack_events.recording(self.path) as recorder:
+            stack_events.record_payload({'execution': {'id': 'y'}})
+
+        records = list(stack_events.read_event_log(self.path))
+        self.assertEqual(['heat', 'workflow', 'workflow'],
+                         [r['type'] for r in records])
+        self.assertEqual('Controller', records[0]['resource_path'])
+        self.assertEqual('overcloud-id', records[0]['stack_id'])
+        self.assertEqual('CREATE_IN_PROGRESS', records[0]['status'])
+        self.assertEqual('y', records[2]['payload']['execution']['id'])
+
+    def test_read_truncated(self):
+        with stack_events.recording(self.path):
+            stack_events.record_payload({'execution': {'id': 'x'}})
+        with gzip.open(self.path, 'ab') as f:
+            f.write(b'{"type": "work')
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-6])
+
+        records = list(stack_events.read_event_log(self.path))
+
+        self.assertEqual(['workflow'], [r['type'] for r in records])
+
+    def test_recording_without_path(self):
+        with stack_events.recording(None) as recorder:
+            self.assertIsNone(recorder)
+            stack_events.record_payload({'execution': {'id': 'x'}})
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_tailer_records_events(self):
+        client = mock.Mock()
+        client.events.list.return_value = [
+            fake_event('1', 'overcloud', 'CREATE_COMPLETE', '01',
+                       physical_resource_id='overcloud-id')]
+        recorder = mock.Mock()
+
+        stack_events.EventTailer(client, 'overcloud', action='CREATE',
+                                 recorder=recorder).wait()
+
+        recorder.record_events.assert_called_once_with(
+            client.events.list.return_value, 'overcloud')
@@ -0,0 +1,133 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+from unittest import TestCase
+
+from heatclient import exc as hc_exc
+import mock
+import six
+
+from tripleoclient import stack_failures
+
+
+def fake_resource(name, status, resource_type='OS::Heat::Value',
+                  nested=False):
+    resource = mock.Mock()
+    resource.resource_name = name
+    resource.resource_status = status
+    resource.resource_status_reason = '%s reason' % name
+    resource.resource_type = resource_type
+    resource.physical_resource_id = '%s-id' % name
+    resource.links = [{'rel': 'self', 'href': 'http://heat/%s' % name}]
+    if nested:
+        resource.links.append({'rel': 'nested',
+                               'href': 'http://heat/stacks/%s/%s-id' %
+                               (name, name)})
+    return resource
+
+
+class TestStackFailures(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.stacks.get.return_value = mock.Mock(
+            stack_name='overcloud', id='overcloud-id',
+            stack_status='CREATE_FAILED')
+
+    def test_not_failed(self):
+        self.client.stacks.get.return_value.stack_status = 'CREATE_COMPLETE'
+
+        failures = stack_failures.StackFailures(self.client).collect(
+            'overcloud')
+
+        self.assertEqual({}, failures.resources)
+        self.assertFalse(self.client.resources.list.called)
+
+    def test_collect(self):
+        resources = {
+            'overcloud-id': [
+                fake_resource('Networks', 'CREATE_COMPLETE', nested=True),
+                fake_resource('Controller', 'CREATE_FAILED', nested=True),
+                fake_resource('Compute', 'CREATE_FAILED', nested=True),
+                fake_resource('Value', 'CREATE_FAILED'),
+            ],
+            'Controller/Controller-id': [
+                fake_resource('0', 'CREATE_FAILED', nested=True),
+            ],
+            'Compute/Compute-id': [
+                fake_resource('0', 'CREATE_COMPLETE'),
+            ],
+            '0/0-id': [
+                fake_resource('Deployment', 'CREATE_FAILED',
+                              'OS::Heat::StructuredDeployment'),
+            ],
+        }
+        self.client.resources.list.side_effect = lambda s: resources[s]
+        deployment = mock.Mock(output_values={
+            'deploy_stdout': 'stdout', 'deploy_stderr': 'stderr'})
+        self.client.software_deployments.get.return_value = deployment
+
+        failures = stack_failures.StackFailures(self.client).collect(
+            'overcloud')
+
+        # A failed nested stack resource is only reported when its stack
+        # has no failed resources.
+        self.assertEqual(['overcloud.Compute',
+                          'overcloud.Controller.0.Deployment',
+                          'overcloud.Value'],
+                         list(failures.resources))
+        self.assertEqual({'Deployment-id': deployment},
+                         failures.deployments)
+        self.client.software_deployments.get.assert_called_once_with(
+            deployment_id='Deployment-id')
+
+        out = six.StringIO()
+        failures.write(out=out)
+        self.assertIn('overcloud.Controller.0.Deployment:\n'
+                      '  resource_type: OS::Heat::StructuredDeployment\n'
+                      '  physical_resource_id: Deployment-id\n'
+                      '  status: CREATE_FAILED\n'
+                      '  status_reason: |\n'
+                      '    Deployment reason\n',
+                      out.getvalue())
+        self.assertIn('stderr', out.getvalue())
+
+    def test_collect_nested_not_found(self):
+        resources = {
+            'overcloud-id': [
+                fake_resource('Controller', 'UPDATE_FAILED', nested=True),
+            ],
+        }
+
+        def list_resources(stack_id):
+            if stack_id not in resources:
+                raise hc_exc.HTTPNotFound()
+            return resources[stack_id]
+
+        self.client.resources.list.side_effect = list_resources
+
+        failures = stack_failures.StackFailures(self.client).collect(
+            'overcloud')
+
+        self.assertEqual(['overcloud.Controller'], list(failures.resources))
+        self.assertFalse(self.client.software_deployments.get.called)
+
+    def test_print_failures_error(self):
+        self.client.stacks.get.side_effect = hc_exc.HTTPNotFound()
+        out = six.StringIO()
+
+        stack_failures.print_failures(self.client, 'overcloud', out=out)
+
+        self.assertEqual('', out.getvalue())
@@ -0,0 +1,101 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+from unittest import TestCase
+
+from heatclient import exc as hc_exc
+import mock
+
+from tripleoclient import stack_inspection
+
+
+def fake_resource(name, resource_type='OS::Heat::Value',
+                  status='CREATE_COMPLETE', nested=None):
+    resource = mock.Mock()
+    resource.resource_name = name
+    resource.resource_type = resource_type
+    resource.resource_status = status
+    resource.physical_resource_id = '%s-id' % name
+    resource.links = []
+    if nested:
+        resource.links.append({'rel': 'nested',
+                               'href': 'http://heat/stacks/%s' % nested})
+    return resource
+
+
+class TestStackInspector(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.stacks = {
+            'overcloud': [
+                fake_resource('Controller', nested='ctrl/1'),
+                fake_resource('Value'),
+            ],
+            'ctrl/1': [
+                fake_resource('0', 'OS::TripleO::Server', nested='server/2',
+                              status='CREATE_IN_PROGRESS'),
+            ],
+            'server/2': [
+                fake_resource('Deployment', 'OS::Heat::SoftwareDeployment'),
+            ],
+        }
+
+        def list_resources(stack_id):
+            if stack_id not in self.stacks:
+                raise hc_exc.HTTPNotFound()
+            return self.stacks[stack_id]
+
+        self.client.resources.list.side_effect = list_resources
+        self.inspector = stack_inspection.StackInspector(self.client)
+        self.addCleanup(self.inspector.close)
+
+    def test_walk(self):
+        walked = [(path, r.resource_name) for path, r in
+                  self.inspector.walk('overcloud')]
+        self.assertEqual([
+            (('Controller',), 'Controller'),
+            (('Value',), 'Value'),
+            (('Controller', '0'), '0'),
+            (('Controller', '0', 'Deployment'), 'Deployment'),
+        ], walked)
+
+    def test_walk_nested_depth(self):
+        walked = [path for path, _r in
+                  self.inspector.walk('overcloud', nested_depth=1)]
+        self.assertEqual([('Controller',), ('Value',), ('Controller', '0')],
+                         walked)
+
+    def test_walk_descend(self):
+        walked = [path for path, _r in self.inspector.walk(
+            'overcloud', descend=lambda r: r.resource_name != 'Controller')]
+        self.assertEqual([('Controller',), ('Value',)], walked)
+
+    def test_find(self):
+        servers = self.inspector.find('overcloud', ('OS::TripleO::Server',))
+        self.assertEqual(['0-id'], [s.physical_resource_id for s in servers])
+
+    def test_resources_not_found(self):
+        self.assertEqual([], self.inspector.resources('missing'))
+
+    def test_resources_cached_when_complete(self):
+        self.inspector.find('overcloud', ('OS::TripleO::Server',))
+        self.inspector.find('overcloud', ('OS::TripleO::Server',))
+
+        calls = [c[0][0] for c in self.client.resources.list.call_args_list]
+        # The stack with a resource in progress is listed again
+        self.assertEqual(1, calls.count('overcloud'))
+        self.assertEqual(2, calls.count('ctrl/1'))
+        self.assertEqual(1, calls.count('server/2'))
@@ -0,0 +1,191 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import json
+import tempfile
+
+import mock
+from unittest import TestCase
+
+from tripleoclient import timing
+
+
+class TestStageTimer(TestCase):
+
+    def setUp(self):
+        self.clock = mock.Mock(side_effect=[100.0, 100.5, 102.5, 103.0, 104.0])
+        self.timer = timing.StageTimer(clock=self.clock)
+
+    def test_stages(self):
+        with self.timer.stage('first'):
+            pass
+        with self.timer.stage('second'):
+            pass
+
+        self.assertEqual([
+            {'name': 'first', 'start': 0.5, 'duration': 2.0,
+             'status': 'COMPLETE'},
+            {'name': 'second', 'start': 3.0, 'duration': 1.0,
+             'status': 'COMPLETE'},
+        ], self.timer.stages)
+        self.assertEqual(4.0, self.timer.total)
+
+    def test_failed_stage(self):
+        def fail():
+            with self.timer.stage('failing'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual('FAILED', self.timer.stages[0]['status'])
+
+    def test_as_table(self):
+        with self.timer.stage('first'):
+            pass
+
+        table = self.timer.as_table().get_string()
+        self.assertIn('first', table)
+        self.assertIn('2.00', table)
+        self.assertIn('Total', table)
+
+    def test_write_json(self):
+        with self.timer.stage('first'):
+            pass
+
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.json') as f:
+            self.timer.write_json(f.name, stack='overcloud')
+            report = json.load(f)
+
+        self.assertEqual('overcloud', report['stack'])
+        self.assertEqual(2.5, report['total'])
+        self.assertEqual('first', report['stages'][0]['name'])
+
+    def test_no_stages(self):
+        self.assertEqual(0.0, self.timer.total)
+
+
+def heat_record(id, path, status, event_time, physical_resource_id='',
+                stack_id='nested-id', resource_name=None):
+    return {'type': 'heat', 'id': id, 'stack': 'overcloud',
+            'stack_id': stack_id, 'resource_path': path,
+            'resource_name': resource_name or path.split('.')[-1],
+            'physical_resource_id': physical_resource_id,
+            'status': status, 'event_time': event_time}
+
+
+class TestEventTimeline(TestCase):
+
+    def setUp(self):
+        self.timeline = timing.EventTimeline([
+            heat_record('1', 'overcloud', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:00Z', 'overcloud-id',
+                        'overcloud-id'),
+            heat_record('2', 'Networks', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:01Z'),
+            heat_record('3', 'Networks', 'CREATE_COMPLETE',
+                        '2017-10-01T00:00:11Z'),
+            heat_record('4', 'Controller', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:12Z'),
+            heat_record('5', 'Controller.0', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:13.500000'),
+            heat_record('6', 'Controller.0', 'CREATE_COMPLETE',
+                        '2017-10-01T00:01:00Z'),
+            # Stack events of nested stacks are ignored
+            heat_record('7', 'Controller', 'CREATE_COMPLETE',
+                        '2017-10-01T00:01:01Z', 'nested-id'),
+            heat_record('8', 'Controller', 'CREATE_COMPLETE',
+                        '2017-10-01T00:01:02Z'),
+            heat_record('8', 'Controller', 'CREATE_COMPLETE',
+                        '2017-10-01T00:01:02Z'),
+            heat_record('9', 'Compute', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:12Z'),
+            heat_record('10', 'Compute.0', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:12Z'),
+            heat_record('11', 'Compute.0', 'CREATE_COMPLETE',
+                        '2017-10-01T00:00:40Z'),
+            heat_record('12', 'Compute', 'CREATE_COMPLETE',
+                        '2017-10-01T00:00:41Z'),
+            heat_record('13', 'AllNodesDeploySteps.ComputeDeployment_Step1',
+                        'CREATE_IN_PROGRESS', '2017-10-01T00:01:05Z'),
+            heat_record('14', 'AllNodesDeploySteps.ComputeDeployment_Step1',
+                        'CREATE_FAILED', '2017-10-01T00:01:10Z'),
+            heat_record('15', 'overcloud', 'CREATE_FAILED',
+                        '2017-10-01T00:01:10Z', 'overcloud-id',
+                        'overcloud-id'),
+            {'type': 'workflow', 'recorded': 100.0,
+             'payload': {'execution': {'id': 'x'}}},
+            {'type': 'workflow', 'recorded': 130.0,
+             'payload': {'execution': {'id': 'x'}, 'status': 'SUCCESS'}},
+        ])
+
+    def test_parse_event_time(self):
+        self.assertEqual(1506816000.0,
+                         timing.parse_event_time('2017-10-01T00:00:00Z'))
+        self.assertEqual(1506816000.25,
+                         timing.parse_event_time('2017-10-01T00:00:00.25'))
+
+    def test_resources(self):
+        durations = dict((r['path'], self.timeline.duration(r))
+                         for r in self.timeline.finished())
+        self.assertEqual({'Networks': 10, 'Controller': 50,
+                          'Controller.0': 46.5, 'Compute': 29,
+                          'Compute.0': 28,
+                          'AllNodesDeploySteps.ComputeDeployment_Step1': 5},
+                         durations)
+        self.assertEqual('Controller', self.timeline.finished()[0]['path'])
+        stack = self.timeline.stacks['overcloud']
+        self.assertEqual(70, self.timeline.duration(stack))
+        self.assertEqual('CREATE_FAILED', stack['status'])
+
+    def test_rerun(self):
+        timeline = timing.EventTimeline([
+            heat_record('1', 'Value', 'CREATE_IN_PROGRESS',
+                        '2017-10-01T00:00:00Z'),
+            heat_record('2', 'Value', 'CREATE_COMPLETE',
+                        '2017-10-01T00:00:10Z'),
+            heat_record('3', 'Value', 'UPDATE_IN_PROGRESS',
+                        '2017-10-02T00:00:00Z'),
+            heat_record('4', 'Value', 'UPDATE_COMPLETE',
+                        '2017-10-02T00:00:02Z'),
+        ])
+        self.assertEqual(2, timeline.duration(timeline.resources['Value']))
+
+    def test_roles(self):
+        roles = dict((r['path'], (self.timeline.duration(r), r['count']))
+                     for r in self.timeline.roles())
+        self.assertEqual({'Controller': (50, 2), 'Compute': (58, 3)}, roles)
+
+    def test_critical_path(self):
+        # Compute ran alongside Controller, which finished last
+        self.assertEqual(['Networks', 'Controller'],
+                         [r['path'] for r in self.timeline.critical_path()])
+
+    def test_critical_path_same_times(self):
+        # Resources of the same second, with a zero duration, don't loop
+        timeline = timing.EventTimeline([
+            heat_record(str(i), name, status, '2017-10-01T00:00:00Z')
+            for i, (name, status) in enumerate(
+                [(n, s) for n in ('First', 'Second')
+                 for s in ('CREATE_IN_PROGRESS', 'CREATE_COMPLETE')])
+        ])
+        self.assertEqual(['First', 'Second'],
+                         sorted(r['path'] for r in timeline.critical_path()))
+
+    def test_as_tables(self):
+        tables = [str(t) for t in self.timeline.as_tables(top=2)]
+
+        self.assertEqual(5, len(tables))
+        self.assertIn('Controller.0', tables[1])
+        self.assertNotIn('Compute.0', tables[1])
+        self.assertIn('SUCCESS', tables[4])
@@ -16,21 +16,29 @@
 from uuid import uuid4
 
 import argparse
+from heatclient.exc import HTTPNotFound
+from heatclient.v1 import stacks
+import json
 import mock
 from mock import call
 import os.path
+import shutil
+import six
 import tempfile
+import threading
 
 from unittest import TestCase
 import yaml
 
 from tripleoclient import exceptions
 from tripleoclient import utils
+from tripleoclient import waiting
 
 
 class TestWaitForStackUtil(TestCase):
     def setUp(self):
         self.mock_orchestration = mock.Mock()
+        self.mock_orchestration.events.list.return_value = []
         sleep_patch = mock.patch('time.sleep')
         self.addCleanup(sleep_patch.stop)
         sleep_patch.start()
@@ -73,10 +81,10 @@ class TestWaitForStackUtil(TestCase):
 
         self.assertFalse(complete)
 
-    @mock.patch("heatclient.common.event_utils.poll_for_events")
-    def test_wait_for_stack_in_progress(self, mock_poll_for_events):
+    @mock.patch("tripleoclient.stack_events.EventTailer.wait")
+    def test_wait_for_stack_in_progress(self, mock_wait):
 
-        mock_poll_for_events.return_value = ("CREATE_IN_PROGRESS", "MESSAGE")
+        mock_wait.return_value = ("CREATE_IN_PROGRESS", "MESSAGE")
 
         stack = mock.Mock()
         stack.stack_name = 'stack'
@@ -86,11 +94,17 @@ class TestWaitForStackUtil(TestCase):
         result = utils.wait_for_stack_ready(self.mock_orchestration, 'stack')
         self.assertEqual(False, result)
 
-    @mock.patch('tripleoclient.utils.wait_for_provision_state')
-    def test_set_nodes_state(self, wait_for_state_mock):
+    @mock.patch('time.sleep')
+    def test_set_nodes_state(self, mock_sleep):
 
-        wait_for_state_mock.return_value = True
         bm_client = mock.Mock()
+        bm_client.http_client.os_ironic_api_version = '1.8'
+        bm_client.node.list.return_value = [
+            mock.Mock(uuid="ABCDEFGH", provision_state="active",
+                      last_error=None),
+            mock.Mock(uuid="IJKLMNOP", provision_state="available",
+                      last_error=None),
+        ]
 
         # One node already deployed, one in the manageable state after
         # introspection.
@@ -100,14 +114,81 @@ class TestWaitForStackUtil(TestCase):
         ]
 
         skipped_states = ('active', 'available')
+        stats = waiting.TransitionStats()
         uuids = list(utils.set_nodes_state(bm_client, nodes, 'provide',
-                                           'available', skipped_states))
+                                           'available', skipped_states,
+                                           stats=stats))
 
         bm_client.node.set_provision_state.assert_has_calls([
             mock.call('IJKLMNOP', 'provide'),
         ])
+        bm_client.node.list.assert_called_once_with(
+            limit=0,
+            fields=['uuid', 'provision_state', 'last_error', 'driver'])
+        self.assertFalse(mock_sleep.called)
 
         self.assertEqual(uuids, ['IJKLMNOP', ])
+        self.assertEqual(1, len(stats.durations('provide')))
+
+    @mock.patch('time.sleep')
+    def test_set_nodes_state_concurrency(self, mock_sleep):
+
+        bm_client = mock.Mock()
+        started = []
+        bm_client.node.set_provision_state.side_effect = (
+            lambda uuid, transition: started.append(uuid))
+        polls = []
+
+        def list_nodes(**kwargs):
+            # Every node reaches its target state on its second poll
+            done = [n for n in started if any(n in p for p in polls)]
+            polls.append(list(started))
+            return [mock.Mock(uuid=n, last_error=None,
+                              provision_state='manageable' if n in done
+                              else 'verifying')
+                    for n in started]
+
+        bm_client.node.list.side_effect = list_nodes
+        nodes = [mock.Mock(uuid=str(i), provision_state='enroll')
+                 for i in range(5)]
+
+        uuids = list(utils.set_nodes_state(bm_client, nodes, 'manage',
+                                           'manageable', max_concurrency=2))
+
+        self.assertEqual(['0', '1', '2', '3', '4'], uuids)
+        # A node is only started once another one finished
+        self.assertEqual([['0', '1'], ['0', '1'], ['0', '1', '2', '3'],
+                          ['0', '1', '2', '3'], ['0', '1', '2', '3', '4'],
+                          ['0', '1', '2', '3', '4']], polls)
+
+    @mock.patch('time.sleep')
+    def test_set_nodes_state_failures(self, mock_sleep):
+
+        bm_client = mock.Mock()
+        bm_client.node.list.return_value = [
+            mock.Mock(uuid="FAILED", provision_state="enroll",
+                      last_error="node on fire"),
+            mock.Mock(uuid="SLOW", provision_state="verifying",
+                      last_error=None),
+        ]
+        nodes = [
+            mock.Mock(uuid="SLOW", provision_state="enroll"),
+            mock.Mock(uuid="FAILED", provision_state="enroll"),
+            mock.Mock(uuid="MISSING", provision_state="enroll"),
+        ]
+
+        stats = waiting.TransitionStats()
+        uuids = list(utils.set_nodes_state(
+            bm_client, nodes, 'manage', 'manageable',
+            strategy=waiting.WaitStrategy.fixed(3, 1), stats=stats))
+
+        self.assertEqual(['FAILED', 'MISSING', 'SLOW'], sorted(uuids))
+        self.assertEqual('SLOW', uuids[-1])
+        self.assertEqual(3, bm_client.node.list.call_count)
+        self.assertEqual([mock.call(1), mock.call(1)],
+                         mock_sleep.call_args_list)
+        # Only the durations of the nodes which succeeded are recorded
+        self.assertEqual([], stats.durations('manage'))
 
     def test_wait_for_provision_state(self):
 
@@ -191,6 +272,201 @@ class TestWaitForStackUtil(TestCase):
         self.assertRaises(ValueError, utils.file_checksum, '/dev/zero')
 
 
+class TestNodeStatePoller(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.http_client.os_ironic_api_version = '1.8'
+        self.states = {}
+        self.client.node.list.side_effect = lambda **kwargs: [
+            mock.Mock(uuid=uuid, provision_state=state, last_error=error)
+            for uuid, (state, error) in sorted(self.states.items())]
+        self.poller = utils.NodeStatePoller(
+            self.client, strategy=waiting.WaitStrategy.fixed(2, 3))
+
+    def test_poll(self):
+        self.states = {'A': ('manageable', None), 'B': ('verifying', None),
+                       'C': ('enroll', 'node on fire'),
+                       'D': ('active', None)}
+        for uuid in ('A', 'B', 'C', 'X'):
+            self.poller.watch(uuid, 'manageable')
+
+        done = self.poller.poll()
+
+        self.assertEqual(['A', 'C', 'X'], [w.node_uuid for w in done])
+        self.assertIsNone(done[0].error)
+        self.assertIsInstance(done[1].error,
+                              exceptions.StateTransitionFailed)
+        self.assertIsNone(done[2].error)
+        self.assertEqual(1, len(self.poller))
+        self.client.node.list.assert_called_once_with(
+            limit=0,
+            fields=['uuid', 'provision_state', 'last_error', 'driver'])
+
+    @mock.patch('time.sleep')
+    def test_wait(self, mock_sleep):
+        self.states = {'A': ('verifying', None), 'B': ('verifying', None)}
+        self.poller.watch('A', 'manageable')
+        self.poller.watch('B', 'manageable')
+
+        def sleep(seconds):
+            self.states['A'] = ('manageable', None)
+
+        mock_sleep.side_effect = sleep
+        done = list(self.poller.wait())
+
+        self.assertEqual(['A', 'B'], [w.node_uuid for w in done])
+        self.assertIsNone(done[0].error)
+        self.assertIsInstance(done[1].error, exceptions.Timeout)
+        # One request per poll whatever the number of nodes
+        self.assertEqual(2, self.client.node.list.call_count)
+        mock_sleep.assert_called_once_with(3)
+
+    def test_poll_nothing_watched(self):
+        self.assertEqual([], self.poller.poll())
+        self.assertFalse(self.client.node.list.called)
+
+
+class TestIterEnvFile(TestCase):
+
+    nodes = [
+        {'pm_type': 'pxe_ipmitool', 'pm_addr': '192.168.0.%d' % i,
+         'pm_user': 'root', 'pm_password': 'p4ss {"]', 'cpu': 4,
+         'mac': ['00:0b:d0:69:7e:%02d' % i]}
+        for i in range(5)]
+
+    def env_file(self, content, name='instackenv.json'):
+        env_file = six.StringIO(content)
+        env_file.name = name
+        return env_file
+
+    def test_json_stream(self):
+        content = json.dumps({'arch': 'x86_64', 'nodes': self.nodes,
+                              'extra': [1, {'nodes': 2}], 'size': 12345})
+        # Small chunks split the nodes, strings and numbers
+        with mock.patch.object(utils._JSONNodeStream, 'chunk_size', 7):
+            nodes = list(utils.iter_env_file(self.env_file(content)))
+
+        self.assertEqual(self.nodes, nodes)
+
+    def test_json_list(self):
+        content = json.dumps(self.nodes, indent=2)
+        self.assertEqual(self.nodes, utils.parse_env_file(
+            self.env_file(content)))
+        self.assertEqual([], utils.parse_env_file(self.env_file('[ ]')))
+
+    def test_json_truncated(self):
+        content = json.dumps({'nodes': self.nodes})[:-60]
+        nodes = utils.iter_env_file(self.env_file(content))
+
+        # The nodes read before the error are available
+        self.assertEqual(self.nodes[:4], [next(nodes) for _i in range(4)])
+        self.assertRaises(exceptions.InvalidConfiguration, next, nodes)
+
+    def test_invalid_node(self):
+        nodes = [dict(self.nodes[0]), dict(self.nodes[1], mac='00:0b'),
+                 dict(self.nodes[2], memory='lots'), self.nodes[3]]
+        del nodes[0]['pm_type']
+        content = json.dumps({'nodes': nodes})
+
+        with self.assertRaises(exceptions.InvalidConfiguration) as cm:
+            list(utils.iter_env_file(self.env_file(content), validate=True))
+        self.assertEqual('Node 0 of instackenv.json is invalid: pm_type is '
+                         'missing', str(cm.exception))
+
+        errors = []
+        valid = list(utils.iter_env_file(self.env_file(content),
+                                         errors=errors, validate=True))
+        self.assertEqual([self.nodes[3]], valid)
+        self.assertEqual(3, len(errors))
+        self.assertIn('mac must be a list', errors[1])
+        self.assertIn('memory must be a number', errors[2])
+
+    def test_not_validated(self):
+        nodes = [dict(self.nodes[0], mac='00:0b', memory='lots')]
+        del nodes[0]['pm_type']
+        content = json.dumps({'nodes': nodes})
+
+        # The import commands accept what validate_node rejects
+        self.assertEqual(nodes, list(utils.iter_env_file(
+            self.env_file(content))))
+        self.assertEqual(nodes, utils.parse_env_file(self.env_file(content)))
+
+    def test_parse_without_nodes(self):
+        content = json.dumps({'arch': 'x86_64'})
+        self.assertEqual({'arch': 'x86_64'},
+                         utils.parse_env_file(self.env_file(content)))
+
+    def test_csv(self):
+        content = ('pxe_ipmitool,192.168.0.1,root,secret,00:0b:d0:69:7e:01\n'
+                   'pxe_ipmitool,192.168.0.2,root,secret,00:0b:d0:69:7e:02,'
+                   '623\n')
+        nodes = list(utils.iter_env_file(self.env_file(content,
+                                                       'nodes.csv')))
+
+        self.assertEqual(['192.168.0.1', '192.168.0.2'],
+                         [n['pm_addr'] for n in nodes])
+        self.assertEqual('623', nodes[1]['pm_port'])
+
+    def test_yaml(self):
+        content = yaml.safe_dump({'nodes': self.nodes})
+        self.assertEqual(self.nodes, utils.parse_env_file(
+            self.env_file(content, 'nodes.yaml')))
+
+    def test_invalid_extension(self):
+        self.assertRaises(exceptions.InvalidConfiguration,
+                          utils.parse_env_file,
+                          self.env_file('', 'nodes.txt'))
+
+
+class TestTreeChecksum(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, 'sub'))
+        with open(os.path.join(self.root, 'sub', 'a.yaml'), 'w') as f:
+            f.write('a')
+        os.symlink('sub/a.yaml', os.path.join(self.root, 'link.yaml'))
+
+    def test_stable(self):
+        self.assertEqual(utils.tree_checksum(self.root),
+                         utils.tree_checksum(self.root))
+
+    def test_contents_changed(self):
+        before = utils.tree_checksum(self.root)
+        with open(os.path.join(self.root, 'sub', 'a.yaml'), 'w') as f:
+            f.write('b')
+        self.assertNotEqual(before, utils.tree_checksum(self.root))
+
+    def test_file_renamed(self):
+        before = utils.tree_checksum(self.root)
+        os.rename(os.path.join(self.root, 'sub', 'a.yaml'),
+                  os.path.join(self.root, 'sub', 'b.yaml'))
+        self.assertNotEqual(before, utils.tree_checksum(self.root))
+
+
+class TestDeployFingerprint(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        patcher = mock.patch(
+            'tripleoclient.constants.DEPLOY_FINGERPRINT_DIRECTORY',
+            os.path.join(self.root, 'fingerprints'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_fingerprint(self):
+        self.assertIsNone(utils.read_deploy_fingerprint('overcloud'))
+
+    def test_write_read(self):
+        utils.write_deploy_fingerprint('overcloud', 'abc')
+        utils.write_deploy_fingerprint('other', 'def')
+        self.assertEqual('abc', utils.read_deploy_fingerprint('overcloud'))
+        self.assertEqual('def', utils.read_deploy_fingerprint('other'))
+
+
 class TestEnsureRunAsNormalUser(TestCase):
 
     @mock.patch('os.geteuid')
@@ -262,6 +538,96 @@ class TestGetEndpointMap(TestCase):
                          {'KeystonePublic': {'uri': 'http://foo:8000/'}})
 
 
+class TestStackOutputs(TestCase):
+
+    def setUp(self):
+        self.stack = mock.Mock()
+        self.stack.outputs = [
+            {'output_key': 'KeystoneURL',
+             'output_value': 'http://192.0.2.1:5000'},
+            {'output_key': 'KeystoneAdminVip', 'output_value': '192.0.2.2'},
+            {'output_key': 'RoleData',
+             'output_value': {'Controller': {'step_config': 'include x'}}},
+        ]
+
+    def test_outputs_without_to_dict(self):
+        outputs = utils.StackOutputs(self.stack)
+
+        self.assertEqual('http://192.0.2.1:5000',
+                         utils.get_overcloud_endpoint(outputs))
+        self.assertEqual('192.0.2.2',
+                         utils.get_endpoint('KeystoneAdmin', outputs))
+        self.assertEqual({'Controller': {'step_config': 'include x'}},
+                         utils.get_role_data(outputs))
+        self.assertEqual({}, utils.get_role_config(outputs))
+        self.assertIn('RoleData', outputs)
+        self.assertIsNone(outputs.get('Missing'))
+        self.assertFalse(self.stack.to_dict.called)
+
+    def test_of(self):
+        outputs = utils.StackOutputs(self.stack)
+        self.assertIs(outputs, utils.StackOutputs.of(outputs))
+        self.assertIsNot(outputs, utils.StackOutputs.of(self.stack))
+
+    def test_get_service_ips(self):
+        self.assertEqual({
+            'KeystoneURL': 'http://192.0.2.1:5000',
+            'KeystoneAdminVip': '192.0.2.2',
+            'RoleData': {'Controller': {'step_config': 'include x'}},
+        }, utils.get_service_ips(self.stack))
+
+
+class TestStackOutputsLazy(TestCase):
+
+    def setUp(self):
+        self.manager = mock.Mock()
+        self.stack = stacks.Stack(self.manager,
+                                  {'stack_name': 'overcloud', 'id': 'ID',
+                                   'stack_status': 'CREATE_COMPLETE'},
+                                  loaded=True)
+
+    def test_output_show(self):
+        self.manager.output_show.return_value = {
+            'output': {'output_key': 'KeystoneURL',
+                       'output_value': 'http://192.0.2.1:5000'}}
+        outputs = utils.StackOutputs(self.stack)
+
+        self.assertEqual('http://192.0.2.1:5000',
+                         utils.get_overcloud_endpoint(outputs))
+        self.assertEqual('http://192.0.2.1:5000', outputs.get('KeystoneURL'))
+
+        self.manager.output_show.assert_called_once_with('overcloud/ID',
+                                                         'KeystoneURL')
+        self.assertFalse(self.manager.get.called)
+
+    def test_output_show_missing(self):
+        self.manager.output_show.side_effect = HTTPNotFound()
+        outputs = utils.StackOutputs(self.stack)
+
+        self.assertEqual({}, utils.get_endpoint_map(outputs))
+        self.assertNotIn('EndpointMap', outputs)
+        self.assertEqual(1, self.manager.output_show.call_count)
+
+    def test_as_dict_fetches_stack(self):
+        self.manager.get.return_value = stacks.Stack(
+            self.manager,
+            {'stack_name': 'overcloud', 'id': 'ID',
+             'outputs': [{'output_key': 'KeystoneAdminVip',
+                          'output_value': '192.0.2.2'}]},
+            loaded=True)
+
+        self.assertEqual({'KeystoneAdminVip': '192.0.2.2'},
+                         utils.get_service_ips(self.stack))
+        self.manager.get.assert_called_once_with('overcloud/ID')
+        self.assertFalse(self.manager.output_show.called)
+
+    def test_get_stack_without_outputs(self):
+        client = mock.Mock()
+        utils.get_stack(client, 'overcloud', resolve_outputs=False)
+        client.stacks.get.assert_called_once_with('overcloud',
+                                                  resolve_outputs=False)
+
+
 class TestNodeGetCapabilities(TestCase):
     def test_with_capabilities(self):
         node = mock.Mock(properties={'capabilities': 'x:y,foo:bar'})
@@ -285,6 +651,111 @@ class TestNodeAddCapabilities(TestCase):
         self.assertEqual({'x': 'y'}, new_caps)
 
 
+class FakeIronicNodes(object):
+    """Node API of a synthetic Ironic, sending the nodes as JSON"""
+
+    def __init__(self, count):
+        self.nodes = [{
+            'uuid': str(uuid4()),
+            'name': 'node-%d' % i,
+            'updated_at': '2017-01-01T00:00:00+00:00',
+            'provision_state': 'available',
+            'maintenance': i % 50 == 0,
+            'instance_uuid': None,
+            'driver': 'pxe_ipmitool',
+            'driver_info': {
+                'ipmi_address': '10.0.%d.%d' % (i // 250, i % 250),
+                'ipmi_username': 'admin', 'ipmi_password': '******',
+                'deploy_kernel': str(uuid4()),
+                'deploy_ramdisk': str(uuid4())},
+            'driver_internal_info': {
+                'clean_steps': None, 'agent_url': 'http://192.0.2.%d:9999' %
+                (i % 250), 'agent_last_heartbeat': 1483228800,
+                'is_whole_disk_image': False},
+            'instance_info': {},
+            'properties': {'cpus': '8', 'memory_mb': '16384',
+                           'local_gb': '100', 'cpu_arch': 'x86_64',
+                           'capabilities': 'boot_option:local,'
+                           'compute_profile:1'},
+            'extra': {'hardware_swift_object': 'extra_hardware-%d' % i,
+                      'system_vendor': {'manufacturer': 'Fake',
+                                        'product_name': 'Server %d' % i}},
+            'links': [{'href': 'http://ironic/v1/nodes/%d' % i,
+                       'rel': 'self'}],
+            'ports': [{'href': 'http://ironic/v1/nodes/%d/ports' % i,
+                       'rel': 'self'}],
+        } for i in range(count)]
+        self.payload = 0
+
+    def list(self, detail=False, fields=None, limit=None, maintenance=None):
+        nodes = self.nodes
+        if maintenance is not None:
+            nodes = [n for n in nodes if n['maintenance'] == maintenance]
+        if fields is not None:
+            nodes = [{k: n[k] for k in fields} for n in nodes]
+        elif not detail:
+            nodes = [{k: n[k] for k in ('uuid', 'name', 'provision_state',
+                                        'maintenance', 'instance_uuid')}
+                     for n in nodes]
+        body = json.dumps({'nodes': nodes})
+        self.payload += len(body)
+        return [mock.Mock(spec=sorted(n), **n)
+                for n in json.loads(body)['nodes']]
+
+
+class TestListNodes(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock(
+            spec=['http_client', 'node'], node=FakeIronicNodes(5000),
+            http_client=mock.Mock(os_ironic_api_version='1.8'))
+
+    def test_fields(self):
+        nodes = utils.list_nodes(self.client,
+                                 fields=utils.PROFILE_NODE_FIELDS,
+                                 maintenance=False)
+        projected = self.client.node.payload
+
+        self.client.node.payload = 0
+        detailed = utils.list_nodes(self.client, maintenance=False)
+
+        self.assertEqual([n.uuid for n in detailed], [n.uuid for n in nodes])
+        self.assertEqual(4900, len(nodes))
+        self.assertFalse(hasattr(nodes[0], 'driver_info'))
+        # The projected listing is several times smaller
+        self.assertLess(projected * 3, self.client.node.payload)
+
+    def test_fields_unsupported(self):
+        client = mock.Mock()
+        client.http_client.os_ironic_api_version = '1.6'
+
+        utils.list_nodes(client, fields=['uuid'], maintenance=False)
+
+        client.node.list.assert_called_once_with(limit=0, maintenance=False,
+                                                 detail=True)
+
+    def test_node_fields_supported(self):
+        client = mock.Mock()
+        for version, supported in (('1.8', True), ('1.31', True),
+                                   ('latest', True), ('1.6', False),
+                                   (None, False)):
+            client.http_client.os_ironic_api_version = version
+            self.assertEqual(supported, utils.node_fields_supported(client),
+                             version)
+
+    def test_cache(self):
+        cache = mock.Mock(spec=['nodes'])
+        cache.nodes.return_value = [mock.Mock(maintenance=False),
+                                    mock.Mock(maintenance=True)]
+
+        nodes = utils.list_nodes(self.client, fields=['uuid'],
+                                 maintenance=False, cache=cache)
+
+        self.assertEqual(cache.nodes.return_value[:1], nodes)
+        cache.nodes.assert_called_once_with(
+            self.client, fields=['uuid', 'maintenance'])
+
+
 class FakeFlavor(object):
     def __init__(self, name, profile=''):
         self.name = name
@@ -299,12 +770,36 @@ class FakeFlavor(object):
         }
 
 
+def record_node_updates(bm_client):
+    """Record the UUIDs of the nodes updated with a mock baremetal client
+
+    The nodes are updated concurrently and the call counts of mocks aren't
+    thread safe, so the updates are recorded under a lock. Returns the list
+    of the updated UUIDs and a set of the UUIDs whose update must fail.
+    """
+    updated = []
+    failing = set()
+    lock = threading.Lock()
+
+    def update(node_uuid, patch):
+        with lock:
+            updated.append(node_uuid)
+        if node_uuid in failing:
+            raise exceptions.InvalidConfiguration('Conflict')
+
+    bm_client.node.update.side_effect = update
+    return updated, failing
+
+
 class TestAssignVerifyProfiles(TestCase):
     def setUp(self):
 
         super(TestAssignVerifyProfiles, self).setUp()
-        self.bm_client = mock.Mock(spec=['node'],
-                                   node=mock.Mock(spec=['list', 'update']))
+        self.bm_client = mock.Mock(
+            spec=['http_client', 'node'],
+            node=mock.Mock(spec=['list', 'update']),
+            http_client=mock.Mock(os_ironic_api_version='1.8'))
+        self.updated, _failing = record_node_updates(self.bm_client)
         self.nodes = []
         self.bm_client.node.list.return_value = self.nodes
         self.flavors = {name: (FakeFlavor(name), 1)
@@ -382,7 +877,7 @@ class TestAssignVerifyProfiles(TestCase):
 
         # one warning for a redundant node
         self._test(0, 1, assign_profiles=True)
-        self.assertEqual(2, self.bm_client.node.update.call_count)
+        self.assertEqual(2, len(self.updated))
 
         actual_profiles = [utils.node_get_capabilities(node).get('profile')
                            for node in self.nodes]
@@ -396,7 +891,7 @@ class TestAssignVerifyProfiles(TestCase):
                                                                 'control'])]
 
         self._test(0, 0, assign_profiles=True)
-        self.assertEqual(2, self.bm_client.node.update.call_count)
+        self.assertEqual(2, len(self.updated))
 
         actual_profiles = [utils.node_get_capabilities(node).get('profile')
                            for node in self.nodes]
@@ -410,7 +905,7 @@ class TestAssignVerifyProfiles(TestCase):
 
         self._test(1, 1, assign_profiles=True)
         # no node update for failed flavor
-        self.assertEqual(1, self.bm_client.node.update.call_count)
+        self.assertEqual(1, len(self.updated))
 
         actual_profiles = [utils.node_get_capabilities(node).get('profile')
                            for node in self.nodes]
@@ -455,6 +950,111 @@ class TestAssignVerifyProfiles(TestCase):
         self.flavors = {'baremetal': (FakeFlavor('baremetal', None), 1)}
         self._test(0, 0)
 
+    def test_assign_profiles_cache(self):
+        self.nodes[:] = [self._get_fake_node(possible_profiles=['compute']),
+                         self._get_fake_node(possible_profiles=['control']),
+                         self._get_fake_node(possible_profiles=['control'])]
+        for node, maintenance in zip(self.nodes, (False, True, False)):
+            node.maintenance = maintenance
+        cache = mock.Mock(spec=['nodes', 'invalidate'])
+        cache.nodes.return_value = self.nodes
+
+        errors, warnings = utils.assign_and_verify_profiles(
+            self.bm_client, self.flavors, assign_profiles=True, cache=cache)
+
+        self.assertEqual((0, 0), (errors, warnings))
+        self.assertFalse(self.bm_client.node.list.called)
+        # The node in maintenance isn't given a profile
+        self.assertEqual(['compute', None, 'control'],
+                         [utils.node_get_capabilities(node).get('profile')
+                          for node in self.nodes])
+        # Once, after all the nodes were updated
+        cache.invalidate.assert_called_once_with()
+        self.assertEqual(2, len(self.updated))
+
+
+class FakeProfileNode(object):
+
+    def __init__(self, uuid, profile=None, possible_profiles=(),
+                 provision_state='available'):
+        caps = {'%s_profile' % p: '1' for p in possible_profiles}
+        if profile is not None:
+            caps['profile'] = profile
+        self.uuid = uuid
+        self.provision_state = provision_state
+        self.properties = {'capabilities': utils.dict_to_capabilities(caps)}
+
+
+class TestAssignVerifyProfilesIndexed(TestCase):
+
+    def setUp(self):
+        self.bm_client = mock.Mock(
+            spec=['http_client', 'node'],
+            node=mock.Mock(spec=['list', 'update']),
+            http_client=mock.Mock(os_ironic_api_version='1.8'))
+        self.updated, self.failing = record_node_updates(self.bm_client)
+
+    def test_deterministic(self):
+        nodes = [FakeProfileNode('uuid%d' % i,
+                                 possible_profiles=['compute', 'control'])
+                 for i in range(4)]
+        flavors = {name: (FakeFlavor(name), 1)
+                   for name in ('control', 'compute')}
+        self.bm_client.node.list.return_value = list(reversed(nodes))
+
+        utils.assign_and_verify_profiles(self.bm_client, flavors,
+                                         assign_profiles=True)
+
+        # The flavors are matched by name and the nodes by UUID order
+        self.assertEqual(['compute', 'control', None, None],
+                         [utils.node_get_capabilities(n).get('profile')
+                          for n in nodes])
+        self.assertEqual(['uuid0', 'uuid1'], sorted(self.updated))
+
+    def test_update_error(self):
+        self.bm_client.node.list.return_value = [
+            FakeProfileNode('uuid%d' % i, possible_profiles=['compute'])
+            for i in range(3)]
+        self.failing.add('uuid1')
+        cache = mock.Mock(spec=['nodes', 'invalidate'])
+        cache.nodes.return_value = self.bm_client.node.list.return_value
+        for node in cache.nodes.return_value:
+            node.maintenance = False
+
+        self.assertRaises(exceptions.InvalidConfiguration,
+                          utils.assign_and_verify_profiles, self.bm_client,
+                          {'compute': (FakeFlavor('compute'), 3)},
+                          assign_profiles=True, cache=cache,
+                          max_concurrency=2)
+        self.assertEqual(3, len(self.updated))
+        cache.invalidate.assert_called_once_with()
+
+    def test_scale(self):
+        # 10000 nodes and 20 flavors, half of the nodes already have their
+        # profile and the others can be given one.
+        profiles = ['profile%d' % i for i in range(20)]
+        nodes = []
+        for i in range(10000):
+            profile = profiles[i % 20]
+            if i % 2:
+                nodes.append(FakeProfileNode('uuid%05d' % i, profile=profile))
+            else:
+                nodes.append(FakeProfileNode(
+                    'uuid%05d' % i, possible_profiles=[profile, 'spare']))
+        self.bm_client.node.list.return_value = nodes
+        flavors = {p: (FakeFlavor(p), 500) for p in profiles}
+
+        errors, warnings = utils.assign_and_verify_profiles(
+            self.bm_client, flavors, assign_profiles=True)
+
+        self.assertEqual((0, 0), (errors, warnings))
+        self.assertEqual(5000, len(self.updated))
+        self.assertEqual(
+            [500] * 20,
+            [sum(1 for n in nodes
+                 if utils.node_get_capabilities(n).get('profile') == p)
+             for p in profiles])
+
 
 class TestPromptUser(TestCase):
     def setUp(self):
@@ -552,6 +1152,62 @@ class TestReplaceLinks(TestCase):
             utils.replace_links_in_template_contents(
                 source, self.link_replacement))
 
+    def test_replace_links_no_links(self):
+        source = (
+            'description: my template\n'
+            'heat_template_version: "2014-10-16"\n'
+            'resources:\n'
+            '  test_config:\n'
+            '    properties:\n'
+            '      config: {get_file: other.sh}\n'
+            '    type: OS::Heat::SoftwareConfig\n'
+        )
+        self.assertIs(
+            source,
+            utils.replace_links_in_template_contents(
+                source, self.link_replacement))
+
+    def test_replace_links_in_template_copy_on_write(self):
+        untouched = {'type': 'OS::Heat::None', 'list': [1, 2, {'a': 'b'}]}
+        template = {
+            'resources': {
+                'changed': {
+                    'type': 'file:///usr/share/extra-templates/my.yml',
+                    'properties': {'outputs': ['x', {'y': 'z'}]},
+                },
+                'unchanged': untouched,
+            },
+            'list': [
+                {'get_file': 'file:///home/stack/test.sh'},
+                untouched,
+            ],
+        }
+        result = utils.replace_links_in_template(
+            template, self.link_replacement)
+
+        self.assertEqual(
+            'user-files/usr/share/extra-templates/my.yml',
+            result['resources']['changed']['type'])
+        self.assertEqual(
+            [{'get_file': 'user-files/home/stack/test.sh'}, untouched],
+            result['list'])
+        self.assertIsInstance(result['list'], list)
+        # the input is left alone
+        self.assertEqual('file:///home/stack/test.sh',
+                         template['list'][0]['get_file'])
+        # only the path to the replaced links is copied
+        self.assertIsNot(template, result)
+        self.assertIs(untouched, result['resources']['unchanged'])
+        self.assertIs(untouched, result['list'][1])
+        self.assertIs(template['resources']['changed']['properties'],
+                      result['resources']['changed']['properties'])
+
+    def test_replace_links_in_template_unchanged(self):
+        template = {'resources': {'a': {'type': 'OS::Heat::None'}},
+                    'list': [{'get_file': 'other.sh'}]}
+        self.assertIs(template, utils.replace_links_in_template(
+            template, self.link_replacement))
+
     def test_relative_link_replacement(self):
         current_dir = 'user-files/home/stack'
         expected = {
@@ -0,0 +1,124 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from tripleoclient import waiting
+
+
+class TestBackoff(TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.clock = lambda: self.now
+
+    def test_exponential_delays(self):
+        strategy = waiting.WaitStrategy(timeout=20, initial=1, maximum=5,
+                                        jitter=0)
+        backoff = strategy.start(clock=self.clock)
+
+        delays = [backoff.next_delay() for _i in range(5)]
+
+        self.assertEqual([1, 2, 4, 5, 5], delays)
+        backoff.reset()
+        self.assertEqual(1, backoff.next_delay())
+
+    def test_jitter(self):
+        strategy = waiting.WaitStrategy(initial=10, factor=1, jitter=0.2)
+        backoff = waiting.Backoff(strategy, clock=self.clock,
+                                  rand=mock.Mock(side_effect=[0.0, 1.0]))
+
+        self.assertAlmostEqual(8.0, backoff.next_delay())
+        self.assertAlmostEqual(12.0, backoff.next_delay())
+
+    def test_deadline(self):
+        strategy = waiting.WaitStrategy(timeout=10, initial=8, jitter=0)
+        backoff = strategy.start(clock=self.clock)
+
+        self.assertTrue(backoff.attempt())
+        self.assertEqual(8, backoff.next_delay())
+        self.now += 8
+        # The last delay stops at the deadline
+        self.assertEqual(2, backoff.next_delay())
+        self.now += 2
+        self.assertTrue(backoff.expired)
+        self.assertFalse(backoff.attempt())
+
+    def test_fixed(self):
+        backoff = waiting.WaitStrategy.fixed(2, 3).start(clock=self.clock)
+
+        self.assertIsNone(backoff.remaining)
+        self.assertEqual([3, 3], [backoff.next_delay(), backoff.next_delay()])
+        self.assertTrue(backoff.attempt())
+        self.assertFalse(backoff.attempt())
+
+
+class TestTransitionStats(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'stats', 'transition-stats.json')
+
+    def test_save_and_load(self):
+        stats = waiting.TransitionStats(self.path)
+        stats.record('ipmi', 'manage', 10)
+        stats.record('redfish', 'manage', 4)
+        stats.record('ipmi', 'provide', 30)
+        stats.save()
+
+        stats = waiting.TransitionStats(self.path)
+
+        self.assertEqual([10, 4], sorted(stats.durations('manage'),
+                                         reverse=True))
+        self.assertEqual([4], stats.durations('manage', driver='redfish'))
+        table = str(stats.as_table())
+        self.assertIn('redfish', table)
+        self.assertIn('provide', table)
+
+    def test_load_invalid(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('not json')
+
+        self.assertEqual([], waiting.TransitionStats(
+            self.path).durations('manage'))
+
+    def test_window(self):
+        stats = waiting.TransitionStats(window=3)
+        for duration in range(5):
+            stats.record('ipmi', 'manage', duration)
+
+        self.assertEqual([2, 3, 4], stats.durations('manage'))
+        # Nothing to save to without a path
+        stats.save()
+
+    def test_strategy(self):
+        stats = waiting.TransitionStats()
+        default = waiting.WaitStrategy()
+        self.assertIs(default, stats.strategy('manage', default=default))
+
+        for duration in (8, 8, 12, 40):
+            stats.record('ipmi', 'manage', duration)
+        strategy = stats.strategy('manage', default=default)
+
+        self.assertEqual(120, strategy.timeout)
+        self.assertEqual(1.5, strategy.initial)
+        self.assertEqual(6, strategy.maximum)
@@ -50,9 +50,9 @@ class FakeBaremetalNodeClient(object):
         self.last_errors[node_uuid] = self.transition_errors.get(key, None)
         self.updates.append(key)
 
-    def _get(self, uuid, detail=False, **kwargs):
+    def _get(self, uuid, detail=False, fields=None, **kwargs):
         mock_node = mock.Mock(uuid=uuid, provision_state=self.states[uuid])
-        if detail:
+        if detail or 'last_error' in (fields or ()):
             mock_node.last_error = self.last_errors.get(uuid, None)
         else:
             mock_node.mock_add_spec(
@@ -15,9 +15,12 @@
 import copy
 import json
 import os
+import shutil
 import tempfile
 
 import mock
+from osc_lib.tests import utils as test_utils
+import six
 import yaml
 
 from tripleoclient import exceptions
@@ -62,6 +65,11 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(0, self.cmd.error_count)
 
+    def test_max_workers_not_positive(self):
+        for value in ('0', '-1'):
+            self.assertRaises(test_utils.ParserException, self.check_parser,
+                              self.cmd, ['--max-workers', value], [])
+
     def test_empty_password(self):
         self.mock_instackenv_json({
             "nodes": [{
@@ -197,9 +205,9 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(1, self.cmd.error_count)
 
-    @mock.patch('tripleoclient.utils.run_shell')
-    def test_ipmitool_success(self, mock_run_shell):
-        mock_run_shell.return_value = 0
+    @mock.patch('tripleoclient.utils.check_ipmi_bmc')
+    def test_ipmitool_success(self, mock_check_bmc):
+        mock_check_bmc.return_value = (0, 'System Power : on')
         self.mock_instackenv_json({
             "nodes": [{
                 "pm_user": "stack",
@@ -218,9 +226,9 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(0, self.cmd.error_count)
 
-    @mock.patch('tripleoclient.utils.run_shell')
-    def test_ipmitool_failure(self, mock_run_shell):
-        mock_run_shell.return_value = 1
+    @mock.patch('tripleoclient.utils.check_ipmi_bmc')
+    def test_ipmitool_failure(self, mock_check_bmc):
+        mock_check_bmc.return_value = (1, 'Unable to establish session')
         self.mock_instackenv_json({
             "nodes": [{
                 "pm_user": "stack",
@@ -239,9 +247,9 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(1, self.cmd.error_count)
 
-    @mock.patch('tripleoclient.utils.run_shell')
-    def test_duplicated_baremetal_ip(self, mock_run_shell):
-        mock_run_shell.return_value = 0
+    @mock.patch('tripleoclient.utils.check_ipmi_bmc')
+    def test_duplicated_baremetal_ip(self, mock_check_bmc):
+        mock_check_bmc.return_value = (0, 'System Power : on')
         self.mock_instackenv_json({
             "nodes": [{
                 "pm_user": "stack",
@@ -269,6 +277,79 @@ class TestValidateInstackEnv(fakes.TestBaremetal):
 
         self.assertEqual(1, self.cmd.error_count)
 
+    def test_invalid_node(self):
+        self.mock_instackenv_json({
+            "nodes": [{
+                "pm_user": "stack",
+                "pm_addr": "192.168.122.1",
+                "pm_password": "SOME SSH KEY",
+                "mac": ["00:0b:d0:69:7e:59"],
+            }, {
+                "pm_user": "stack",
+                "pm_addr": "192.168.122.2",
+                "pm_password": "SOME SSH KEY",
+                "pm_type": "pxe_ssh",
+                "mac": ["00:0b:d0:69:7e:58"],
+            }]
+        })
+
+        arglist = ['-f', self.instack_json.name]
+        parsed_args = self.check_parser(self.cmd, arglist, [])
+        self.cmd.take_action(parsed_args)
+
+        # The node without pm_type is reported and the next one checked
+        self.assertEqual(1, self.cmd.error_count)
+
+    def _fake_ipmitool(self, script):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'ipmitool')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + script)
+        os.chmod(path, 0o755)
+        return path
+
+    def test_ipmitool_concurrent(self):
+        # The fake ipmitool fails for the BMC whose password is "bad" and
+        # hangs for the one whose password is "slow"
+        ipmitool = self._fake_ipmitool(
+            'case "$IPMI_PASSWORD" in\n'
+            '  bad) echo "Unable to establish session"; exit 1;;\n'
+            '  slow) exec sleep 10;;\n'
+            'esac\n'
+            'echo "args: $*"\n')
+        self.mock_instackenv_json({
+            "nodes": [{
+                "pm_user": "stack",
+                "pm_addr": "192.168.122.%d" % i,
+                "pm_password": password,
+                "pm_type": "pxe_ipmitool",
+                "mac": ["00:0b:d0:69:7e:%02d" % i],
+            } for i, password in enumerate(['good; rm -rf /', 'bad',
+                                            'slow'])]
+        })
+
+        arglist = ['-f', self.instack_json.name, '--bmc-timeout', '1',
+                   '--ipmitool', ipmitool]
+        parsed_args = self.check_parser(self.cmd, arglist, [])
+        with mock.patch('sys.stdout', new=six.StringIO()) as out:
+            self.cmd.take_action(parsed_args)
+
+        self.assertEqual(2, self.cmd.error_count)
+        output = out.getvalue()
+        rows = dict((line.split('|')[1].strip(),
+                     [c.strip() for c in line.split('|')[3:5]])
+                    for line in output.splitlines()
+                    if line.startswith('| 192.168'))
+        # The password is only given in the environment
+        self.assertEqual(['OK', 'args: -R 1 -I lanplus -H 192.168.122.0 '
+                                '-U stack -E chassis status'],
+                         rows['192.168.122.0'])
+        self.assertEqual(['FAILED', 'Unable to establish session'],
+                         rows['192.168.122.1'])
+        self.assertEqual(['TIMEOUT', 'No answer after 1 seconds'],
+                         rows['192.168.122.2'])
+
 
 class TestImportBaremetal(fakes.TestBaremetal):
 
@@ -600,6 +681,14 @@ class TestStartBaremetalIntrospectionBulk(fakes.TestBaremetal):
         self.mock_uuid4 = uuid4_patcher.start()
         self.addCleanup(self.mock_uuid4.stop)
 
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.stats_file = os.path.join(tmp, 'transition-stats.json')
+        stats_patcher = mock.patch(
+            'tripleoclient.constants.TRANSITION_STATS_FILE', self.stats_file)
+        stats_patcher.start()
+        self.addCleanup(stats_patcher.stop)
+
         # Get the command object to test
         self.cmd = baremetal.StartBaremetalIntrospectionBulk(self.app, None)
 
@@ -644,6 +733,9 @@ class TestStartBaremetalIntrospectionBulk(fakes.TestBaremetal):
         self.cmd.take_action(parsed_args)
 
         self._check_workflow_call()
+        with open(self.stats_file) as f:
+            stats = json.load(f)
+        self.assertEqual(1, len(stats['durations']))
 
     def test_introspect_bulk_failed(self):
         client = self.app.client_manager.baremetal
@@ -14,7 +14,9 @@
 #
 
 import fixtures
+import json
 import os
+import shutil
 import six
 import tempfile
 import yaml
@@ -23,10 +25,13 @@ from heatclient import exc as hc_exc
 import mock
 from osc_lib import exceptions as oscexc
 from swiftclient.exceptions import ClientException as ObjectClientException
+from tripleo_common import update
 
 from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient import stack_events
 from tripleoclient.tests.v1.overcloud_deploy import fakes
+from tripleoclient import utils
 from tripleoclient.v1 import overcloud_deploy
 
 
@@ -50,6 +55,21 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         self.parameter_defaults_env_file = (
             tempfile.NamedTemporaryFile(mode='w', delete=False).name)
         self.tmp_dir = self.useFixture(fixtures.TempDir())
+        fingerprints = mock.patch(
+            'tripleoclient.constants.DEPLOY_FINGERPRINT_DIRECTORY',
+            self.tmp_dir.join('fingerprints'))
+        fingerprints.start()
+        self.addCleanup(fingerprints.stop)
+        env_index = mock.patch(
+            'tripleoclient.constants.ENV_DIRECTORY_INDEX',
+            self.tmp_dir.join('environments-index.yaml'))
+        env_index.start()
+        self.addCleanup(env_index.stop)
+        # Don't wait for the Heat stack action to start
+        sleep_patch = mock.patch(
+            'tripleoclient.workflows.deployment.time.sleep')
+        sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
 
     def tearDown(self):
         super(TestDeployOvercloud, self).tearDown()
@@ -207,7 +227,8 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         clients = self.app.client_manager
         orchestration_client = clients.orchestration
         mock_stack = fakes.create_tht_stack()
-        orchestration_client.stacks.get.side_effect = [None, mock.Mock()]
+        orchestration_client.stacks.get.side_effect = [
+            None, mock.Mock(), mock.Mock()]
         workflow_client = clients.workflow_engine
         workflow_client.action_executions.create.return_value = mock.MagicMock(
             output='{"result":[]}')
@@ -332,7 +353,8 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         clients = self.app.client_manager
         orchestration_client = clients.orchestration
         mock_stack = fakes.create_tht_stack()
-        orchestration_client.stacks.get.side_effect = [None, mock.Mock()]
+        orchestration_client.stacks.get.side_effect = [
+            None, mock.Mock(), mock.Mock()]
         workflow_client = clients.workflow_engine
         workflow_client.environments.get.return_value = mock.MagicMock(
             variables={'environments': []})
@@ -467,7 +489,8 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         clients = self.app.client_manager
         orchestration_client = clients.orchestration
         mock_stack = fakes.create_tht_stack()
-        orchestration_client.stacks.get.side_effect = [None, mock.Mock()]
+        orchestration_client.stacks.get.side_effect = [
+            None, mock.Mock(), mock.Mock()]
         workflow_client = clients.workflow_engine
         workflow_client.action_executions.create.return_value = mock.MagicMock(
             output='{"result":[]}')
@@ -1107,6 +1130,214 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         self.assertFalse(mock_create_ocrc.called)
         self.assertFalse(mock_create_tempest_deployer_input.called)
 
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_try_overcloud_deploy_with_compat_yaml', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_build_environment', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_download_missing_files_from_plan', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'update_plan_from_templates', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'list_deployment_plans', autospec=True)
+    def test_skip_if_unchanged(self, mock_list_plans, mock_update_plan,
+                               mock_download, mock_build_env, mock_deploy):
+        mock_list_plans.return_value = ['overcloud']
+        user_tht_root = self.tmp_dir.join('tht')
+        os.mkdir(user_tht_root)
+        with open(os.path.join(user_tht_root, 'overcloud.yaml'), 'w') as f:
+            f.write('heat_template_version: 2016-10-14\n')
+
+        def _build_env(_self, stack, parsed_args, parameters, tht_root,
+                       user_tht_root):
+            return ({'file://%s/foo.yaml' % tht_root: 'foo'},
+                    {'parameter_defaults': {'Foo': 'bar'}})
+
+        mock_build_env.side_effect = _build_env
+
+        arglist = ['--templates', user_tht_root, '--skip-if-unchanged']
+        verifylist = [('skip_if_unchanged', True)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd._setup_clients(parsed_args)
+        stack = fakes.create_tht_stack(stack_status='UPDATE_COMPLETE')
+
+        self.cmd._deploy_tripleo_heat_templates(
+            stack, parsed_args, '/tmp/tht-1', user_tht_root)
+        self.assertEqual(1, self._stack_deploys(mock_deploy))
+
+        # Nothing changed, the temporary directory is ignored
+        self.cmd._deploy_tripleo_heat_templates(
+            stack, parsed_args, '/tmp/tht-2', user_tht_root)
+        self.assertEqual(1, self._stack_deploys(mock_deploy))
+        # The plan is still uploaded
+        self.assertEqual(2, mock_deploy.call_count)
+
+        # The last deployment failed
+        failed_stack = fakes.create_tht_stack(stack_status='UPDATE_FAILED')
+        self.cmd._deploy_tripleo_heat_templates(
+            failed_stack, parsed_args, '/tmp/tht-3', user_tht_root)
+        self.assertEqual(2, self._stack_deploys(mock_deploy))
+
+        # The templates changed
+        with open(os.path.join(user_tht_root, 'overcloud.yaml'), 'a') as f:
+            f.write('description: changed\n')
+        self.cmd._deploy_tripleo_heat_templates(
+            stack, parsed_args, '/tmp/tht-4', user_tht_root)
+        self.assertEqual(3, self._stack_deploys(mock_deploy))
+
+    def _stack_deploys(self, mock_deploy):
+        # The calls of _try_overcloud_deploy_with_compat_yaml which didn't
+        # only update the plan
+        return len([c for c in mock_deploy.call_args_list if not c[0][8]])
+
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_try_overcloud_deploy_with_compat_yaml', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_build_environment', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_download_missing_files_from_plan', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'update_plan_from_templates', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'list_deployment_plans', autospec=True)
+    def test_skip_if_unchanged_after_create(self, mock_list_plans,
+                                            mock_update_plan, mock_download,
+                                            mock_build_env, mock_deploy):
+        mock_list_plans.return_value = ['overcloud']
+        user_tht_root = self.tmp_dir.join('tht')
+        os.mkdir(user_tht_root)
+        with open(os.path.join(user_tht_root, 'overcloud.yaml'), 'w') as f:
+            f.write('heat_template_version: 2016-10-14\n')
+
+        def _build_env(_self, stack, parsed_args, parameters, tht_root,
+                       user_tht_root):
+            # As _build_environment, the parameters are merged in the
+            # environment and the breakpoints are cleaned up on update
+            env = {'parameter_defaults': dict(parameters, Foo='bar')}
+            if stack:
+                update.add_breakpoints_cleanup_into_env(env)
+            return {}, env
+
+        mock_build_env.side_effect = _build_env
+
+        arglist = ['--templates', user_tht_root, '--skip-if-unchanged',
+                   '--libvirt-type', 'qemu']
+        verifylist = [('skip_if_unchanged', True)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd._setup_clients(parsed_args)
+
+        self.cmd._deploy_tripleo_heat_templates(
+            None, parsed_args, '/tmp/tht-1', user_tht_root)
+        self.assertEqual(1, self._stack_deploys(mock_deploy))
+
+        # The update after the creation is skipped
+        stack = fakes.create_tht_stack(stack_status='CREATE_COMPLETE')
+        self.cmd._deploy_tripleo_heat_templates(
+            stack, parsed_args, '/tmp/tht-2', user_tht_root)
+        self.assertEqual(1, self._stack_deploys(mock_deploy))
+
+    @mock.patch('tripleoclient.workflows.deployment.deploy_and_wait',
+                autospec=True)
+    @mock.patch('tripleoclient.workflows.parameters.'
+                'check_deprecated_parameters', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_process_and_upload_environment', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_upload_missing_files', autospec=True)
+    @mock.patch('heatclient.common.template_utils.get_template_contents',
+                autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_build_environment', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_download_missing_files_from_plan', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'update_plan_from_templates', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'list_deployment_plans', autospec=True)
+    def test_skip_if_unchanged_uploads_plan(
+            self, mock_list_plans, mock_update_plan, mock_download,
+            mock_build_env, mock_get_template_contents, mock_upload_missing,
+            mock_upload_env, mock_check_deprecated, mock_deploy_and_wait):
+        mock_list_plans.return_value = ['overcloud']
+        mock_get_template_contents.return_value = [{}, 'template']
+        mock_upload_missing.return_value = {}
+        user_tht_root = self.tmp_dir.join('tht')
+        os.mkdir(user_tht_root)
+        env = {'parameter_defaults': {'Foo': 'bar'}}
+        mock_build_env.return_value = ({}, env)
+
+        arglist = ['--templates', user_tht_root, '--skip-if-unchanged']
+        verifylist = [('skip_if_unchanged', True)]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd._setup_clients(parsed_args)
+        stack = fakes.create_tht_stack(stack_status='UPDATE_COMPLETE')
+
+        self.cmd._deploy_tripleo_heat_templates(
+            stack, parsed_args, '/tmp/tht-1', user_tht_root)
+        mock_update_plan.reset_mock()
+        mock_upload_env.reset_mock()
+        self.cmd._deploy_tripleo_heat_templates(
+            stack, parsed_args, '/tmp/tht-2', user_tht_root)
+
+        # The plan, its environment and parameters match the stack again,
+        # only the stack update is skipped
+        self.assertEqual(1, mock_update_plan.call_count)
+        mock_upload_env.assert_called_once_with(
+            self.cmd, 'overcloud', env, {}, '/tmp/tht-2')
+        self.assertEqual(1, mock_deploy_and_wait.call_count)
+
+    @mock.patch('tripleoclient.utils.tree_checksum', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_try_overcloud_deploy_with_compat_yaml', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_build_environment', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_download_missing_files_from_plan', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'update_plan_from_templates', autospec=True)
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'list_deployment_plans', autospec=True)
+    def test_no_fingerprint_without_skip_if_unchanged(
+            self, mock_list_plans, mock_update_plan, mock_download,
+            mock_build_env, mock_deploy, mock_tree_checksum):
+        mock_list_plans.return_value = ['overcloud']
+        mock_build_env.return_value = ({}, {'parameter_defaults': {}})
+        user_tht_root = self.tmp_dir.join('tht')
+        utils.write_deploy_fingerprint('overcloud', 'stale')
+
+        parsed_args = self.check_parser(
+            self.cmd, ['--templates', user_tht_root], [])
+        self.cmd._setup_clients(parsed_args)
+        self.cmd._deploy_tripleo_heat_templates(
+            fakes.create_tht_stack(stack_status='UPDATE_COMPLETE'),
+            parsed_args, '/tmp/tht-1', user_tht_root)
+
+        self.assertEqual(1, mock_deploy.call_count)
+        self.assertFalse(mock_tree_checksum.called)
+        # The stack changed, the fingerprint of the last deployment is gone
+        self.assertIsNone(utils.read_deploy_fingerprint('overcloud'))
+
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_deploy_tripleo_heat_templates', autospec=True)
+    def test_dry_run_timing_report(self, mock_deploy_tht):
+        report = self.tmp_dir.join('timing.json')
+        arglist = ['--templates', '--dry-run', '--timing-report', report]
+        verifylist = [
+            ('templates', '/usr/share/openstack-tripleo-heat-templates/'),
+            ('dry_run', True),
+            ('timing_report', report),
+        ]
+
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+        self.cmd.take_action(parsed_args)
+
+        with open(report) as f:
+            timings = json.load(f)
+        self.assertEqual('overcloud', timings['stack'])
+        self.assertEqual(['Pre-deploy validations'],
+                         [s['name'] for s in timings['stages']])
+        self.assertEqual('COMPLETE', timings['stages'][0]['status'])
+
     @mock.patch('tripleoclient.workflows.plan_management.tarball',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
@@ -1326,6 +1557,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         mock_stack = fakes.create_tht_stack()
         orchestration_client.stacks.get.side_effect = [
             None,
+            mock.MagicMock(),
             mock.MagicMock()
         ]
 
@@ -1442,6 +1674,74 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
 
         self.assertFalse(mock_deploy_and_wait.called)
 
+    @mock.patch('tripleoclient.workflows.parameters.update_parameters',
+                autospec=True)
+    def test_process_and_upload_environment_changed_parameters(
+            self, mock_update_parameters):
+        object_client = mock.Mock()
+        self.cmd.object_client = object_client
+        self.cmd.workflow_client = mock.Mock()
+        plan_env = {
+            'environments': [{'path': 'user-environment.yaml'}],
+            'parameter_defaults': {'Same': 1, 'Changed': 1},
+        }
+        object_client.get_object.return_value = ({},
+                                                 yaml.safe_dump(plan_env))
+
+        env = {'parameter_defaults': {'Same': 1, 'Changed': 2, 'New': 3}}
+        self.cmd._process_and_upload_environment('overcloud', env, {}, '/tmp')
+
+        mock_update_parameters.assert_called_once_with(
+            self.cmd.workflow_client, container='overcloud',
+            parameters={'Changed': 2, 'New': 3})
+        object_client.get_object.assert_called_once_with(
+            'overcloud', constants.PLAN_ENVIRONMENT)
+        # Only user-environment.yaml is uploaded, the plan environment
+        # already includes it.
+        object_client.put_object.assert_called_once_with(
+            'overcloud', 'user-environment.yaml', mock.ANY)
+
+    @mock.patch('tripleoclient.workflows.parameters.update_parameters',
+                autospec=True)
+    def test_process_and_upload_environment_unchanged_parameters(
+            self, mock_update_parameters):
+        object_client = mock.Mock()
+        self.cmd.object_client = object_client
+        self.cmd.workflow_client = mock.Mock()
+        plan_env = {
+            'environments': [],
+            'parameter_defaults': {'Same': {'nested': True}},
+        }
+        object_client.get_object.return_value = ({},
+                                                 yaml.safe_dump(plan_env))
+
+        env = {'parameter_defaults': {'Same': {'nested': True}}}
+        self.cmd._process_and_upload_environment('overcloud', env, {}, '/tmp')
+
+        self.assertFalse(mock_update_parameters.called)
+        plan_env['environments'].append({'path': 'user-environment.yaml'})
+        object_client.put_object.assert_has_calls([
+            mock.call('overcloud', 'user-environment.yaml', mock.ANY),
+            mock.call('overcloud', constants.PLAN_ENVIRONMENT,
+                      yaml.safe_dump(plan_env, default_flow_style=False)),
+        ])
+
+    def test_write_user_environment(self):
+        object_client = mock.Mock()
+        self.cmd.object_client = object_client
+        env = {'parameter_defaults': {'Foo': 'bar'}}
+
+        env_path, swift_path = self.cmd._write_user_environment(
+            env, 'tripleoclient-parameters.yaml', self.tmp_dir.path,
+            'overcloud')
+
+        contents = yaml.safe_dump(env, default_flow_style=False)
+        object_client.put_object.assert_called_once_with(
+            'overcloud', 'user-environments/tripleoclient-parameters.yaml',
+            contents)
+        with open(env_path) as f:
+            self.assertEqual(contents, f.read())
+
     def test_heat_stack_busy(self):
 
         clients = self.app.client_manager
@@ -1537,6 +1837,63 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         self.assertRaises(exceptions.InvalidConfiguration,
                           self.cmd.take_action, parsed_args)
 
+    @mock.patch('tripleoclient.workflows.plan_management.'
+                'list_deployment_plans', autospec=True)
+    @mock.patch('shutil.rmtree', autospec=True)
+    @mock.patch('shutil.copytree', autospec=True)
+    @mock.patch('tempfile.mkdtemp', autospec=True)
+    def test_validations_failure_before_plan_update(
+            self, mock_tmpdir, mock_copy, mock_rmtree, mock_list_plans):
+        mock_tmpdir.return_value = self.tmp_dir.path
+        clients = self.app.client_manager
+        orchestration_client = clients.orchestration
+        orchestration_client.stacks.get.return_value = mock.Mock()
+        self.cmd._predeploy_verify_capabilities = mock.Mock(
+            return_value=(1, 0))
+
+        arglist = ['--templates']
+        verifylist = [
+            ('templates', '/usr/share/openstack-tripleo-heat-templates/'),
+        ]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+
+        self.assertRaises(exceptions.InvalidConfiguration,
+                          self.cmd.take_action, parsed_args)
+        self.assertTrue(mock_copy.called)
+        self.assertFalse(mock_list_plans.called)
+        self.assertTrue(mock_rmtree.called)
+
+    @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
+                autospec=True)
+    @mock.patch('tripleoclient.utils.get_overcloud_endpoint', autospec=True)
+    @mock.patch('tripleoclient.utils.write_overcloudrc', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.overcloudrc',
+                autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_deploy_tripleo_heat_templates_tmpdir', autospec=True)
+    def test_validations_failure_nonfatal(
+            self, mock_deploy_tmpdir,
+            mock_overcloudrc, mock_write_overcloudrc,
+            mock_overcloud_endpoint,
+            mock_create_tempest_deployer_input):
+        clients = self.app.client_manager
+        orchestration_client = clients.orchestration
+        orchestration_client.stacks.get.return_value = mock.Mock()
+        self.cmd._predeploy_verify_capabilities = mock.Mock(
+            return_value=(1, 0))
+
+        arglist = ['--templates', '--validation-errors-nonfatal']
+        verifylist = [
+            ('templates', '/usr/share/openstack-tripleo-heat-templates/'),
+            ('validation_errors_fatal', False),
+        ]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+
+        self.cmd.take_action(parsed_args)
+        self.assertTrue(self.cmd._predeploy_verify_capabilities.called)
+        self.assertTrue(mock_deploy_tmpdir.called)
+        self.assertIsNone(self.cmd._pending_validations)
+
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
     @mock.patch('tripleoclient.utils.wait_for_provision_state')
@@ -1628,3 +1985,38 @@ class TestArgumentValidation(fakes.TestDeployOvercloud):
     def test_validate_env_dir_ignore_default_not_existing(self):
         full_path = os.path.expanduser(constants.DEFAULT_ENV_DIRECTORY)
         self.assertIsNone(self.validate([full_path]))
+
+
+class TestDeployTimeline(fakes.TestDeployOvercloud):
+
+    def setUp(self):
+        super(TestDeployTimeline, self).setUp()
+        self.cmd = overcloud_deploy.DeployTimeline(self.app, None)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'events.log.gz')
+
+    @mock.patch('sys.stdout', new_callable=six.StringIO)
+    def test_timeline(self, mock_stdout):
+        event = mock.Mock(id='1', stack_id='nested-id', resource_name='0',
+                          resource_status='CREATE_COMPLETE',
+                          physical_resource_id='0-id',
+                          event_time='2017-10-01T00:00:10Z', links=[])
+        with stack_events.recording(self.path) as recorder:
+            recorder.record_events([mock.Mock(
+                id='0', stack_id='nested-id', resource_name='0',
+                resource_status='CREATE_IN_PROGRESS',
+                physical_resource_id='0-id',
+                event_time='2017-10-01T00:00:00Z', links=[]), event],
+                'overcloud')
+
+        parsed_args = self.check_parser(self.cmd, [self.path], [
+            ('event_log', self.path), ('top', 20)])
+        self.cmd.take_action(parsed_args)
+
+        self.assertIn('| 0 ', mock_stdout.getvalue())
+
+    def test_timeline_missing_log(self):
+        parsed_args = self.check_parser(self.cmd, [self.path], [])
+        self.assertRaises(oscexc.CommandError, self.cmd.take_action,
+                          parsed_args)
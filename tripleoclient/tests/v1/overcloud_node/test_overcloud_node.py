@@ -17,13 +17,16 @@ import copy
 import json
 import mock
 import os
+import shutil
 import tempfile
+import time
 
 from osc_lib.tests import utils as test_utils
 
 from tripleoclient import exceptions
 from tripleoclient.tests.v1.overcloud_node import fakes
 from tripleoclient.v1 import overcloud_node
+from tripleoclient.workflows import baremetal
 
 
 class TestDeleteNode(fakes.TestDeleteNode):
@@ -323,6 +326,46 @@ class TestIntrospectNode(fakes.TestOvercloudNode):
                                          ('provide', True)])
         self._check_introspect_nodes(parsed_args, nodes, provide=True)
 
+    def test_introspect_all_manageable_in_batches(self):
+        self.app.client_manager.baremetal.node.list.return_value = [
+            mock.Mock(uuid='node_uuid%d' % i, provision_state=state)
+            for i, state in enumerate(['manageable', 'available',
+                                       'manageable', 'manageable'])]
+        self.websocket.wait_for_messages.side_effect = lambda **kw: iter([{
+            "execution": {"id": "IDID"},
+            "status": "SUCCESS",
+            "message": "Success",
+            "introspected_nodes": {}
+        }])
+        parsed_args = self.check_parser(self.cmd,
+                                        ['--all-manageable', '--provide',
+                                         '--batch-size', '2',
+                                         '--max-concurrency', '2'],
+                                        [('all_manageable', True),
+                                         ('batch_size', 2),
+                                         ('max_concurrency', 2)])
+
+        self.cmd.take_action(parsed_args)
+
+        calls = self.workflow.executions.create.call_args_list
+        introspected = sorted(
+            (c[1]['workflow_input']['queue_name'],
+             c[1]['workflow_input']['node_uuids']) for c in calls
+            if c[0][0] == 'tripleo.baremetal.v1.introspect')
+        self.assertEqual([('UUID4-0', ['node_uuid0', 'node_uuid2']),
+                          ('UUID4-1', ['node_uuid3'])], introspected)
+        self.assertEqual(mock.call(
+            'tripleo.baremetal.v1.provide', workflow_input={
+                'node_uuids': ['node_uuid0', 'node_uuid2', 'node_uuid3'],
+                'queue_name': 'UUID4'}), calls[-1])
+
+    def test_introspect_in_batches_not_positive(self):
+        for option in ('--batch-size', '--max-concurrency'):
+            for value in ('0', '-1', 'two'):
+                self.assertRaises(test_utils.ParserException,
+                                  self.check_parser, self.cmd,
+                                  ['--all-manageable', option, value], [])
+
     def test_introspect_no_node_or_flag_specified(self):
         self.assertRaises(test_utils.ParserException,
                           self.check_parser,
@@ -370,6 +413,13 @@ class TestImportNode(fakes.TestOvercloudNode):
         client = self.app.client_manager.tripleoclient
         self.websocket = client.messaging_websocket()
 
+        tmp = self.checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        checkpoint_patcher = mock.patch(
+            'tripleoclient.constants.NODE_IMPORT_CHECKPOINT_DIRECTORY', tmp)
+        checkpoint_patcher.start()
+        self.addCleanup(checkpoint_patcher.stop)
+
         # Get the command object to test
         self.cmd = overcloud_node.ImportNode(self.app, None)
 
@@ -380,6 +430,8 @@ class TestImportNode(fakes.TestOvercloudNode):
             "message": "Success",
             "registered_nodes": [{
                 "uuid": "MOCK_NODE_UUID"
+            }, {
+                "uuid": "MOCK_NODE_UUID2"
             }]
         }]
 
@@ -403,7 +455,7 @@ class TestImportNode(fakes.TestOvercloudNode):
             call_count += 1
             call_list.append(mock.call(
                 'tripleo.baremetal.v1.introspect', workflow_input={
-                    'node_uuids': ['MOCK_NODE_UUID'],
+                    'node_uuids': ['MOCK_NODE_UUID', 'MOCK_NODE_UUID2'],
                     'run_validations': False,
                     'queue_name': 'UUID4'}
             ))
@@ -412,7 +464,7 @@ class TestImportNode(fakes.TestOvercloudNode):
             call_count += 1
             call_list.append(mock.call(
                 'tripleo.baremetal.v1.provide', workflow_input={
-                    'node_uuids': ['MOCK_NODE_UUID'],
+                    'node_uuids': ['MOCK_NODE_UUID', 'MOCK_NODE_UUID2'],
                     'queue_name': 'UUID4'
                 }
             ))
@@ -467,6 +519,54 @@ class TestImportNode(fakes.TestOvercloudNode):
         parsed_args = self.check_parser(self.cmd, arglist, verifylist)
         self._check_workflow_call(parsed_args, no_deploy_image=True)
 
+    def test_import_resume(self):
+        argslist = [self.json_file.name, '--provide']
+        parsed_args = self.check_parser(self.cmd, argslist, [])
+        # A previous import registered the first node
+        checkpoint = self.cmd._checkpoint(parsed_args)
+        checkpoint.record(self.nodes_list[:1], [{'uuid': 'FIRST_UUID'}])
+        self.websocket.wait_for_messages.return_value = [{
+            "status": "SUCCESS",
+            "message": "Success",
+            "registered_nodes": [{
+                "uuid": "MOCK_NODE_UUID"
+            }]
+        }]
+
+        self.cmd.take_action(parsed_args)
+
+        self.workflow.executions.create.assert_has_calls([
+            mock.call('tripleo.baremetal.v1.register_or_update',
+                      workflow_input={
+                          'nodes_json': self.nodes_list[1:],
+                          'queue_name': 'UUID4',
+                          'kernel_name': 'bm-deploy-kernel',
+                          'ramdisk_name': 'bm-deploy-ramdisk',
+                          'instance_boot_option': 'local'}),
+            mock.call('tripleo.baremetal.v1.provide',
+                      workflow_input={
+                          'node_uuids': ['FIRST_UUID', 'MOCK_NODE_UUID'],
+                          'queue_name': 'UUID4'}),
+        ])
+        self.assertEqual({}, self.cmd._checkpoint(parsed_args).nodes)
+
+    def test_import_chunks_not_positive(self):
+        for option in ('--chunk-size', '--concurrency'):
+            for value in ('0', '-1'):
+                self.assertRaises(test_utils.ParserException,
+                                  self.check_parser, self.cmd,
+                                  [self.json_file.name, option, value], [])
+
+    def test_import_stale_checkpoint(self):
+        parsed_args = self.check_parser(self.cmd, [self.json_file.name], [])
+        checkpoint = self.cmd._checkpoint(parsed_args)
+        checkpoint.record(self.nodes_list[:1], [{'uuid': 'FIRST_UUID'}])
+        old = time.time() - baremetal.CHECKPOINT_MAX_AGE - 60
+        os.utime(checkpoint.path, (old, old))
+
+        self.assertEqual({}, self.cmd._checkpoint(parsed_args).nodes)
+        self.assertEqual([], os.listdir(self.checkpoint_dir))
+
 
 class TestConfigureNode(fakes.TestOvercloudNode):
 
@@ -12,9 +12,12 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import os
+
 import mock
 
 from tripleoclient import exceptions
+from tripleoclient import node_cache
 from tripleoclient.tests import test_utils
 from tripleoclient.tests.v1 import test_plugin
 from tripleoclient import utils
@@ -53,7 +56,8 @@ class TestMatchProfiles(test_plugin.TestPluginV1):
             self.app.client_manager.baremetal,
             {'compute': (self.flavors[0], 3),
              'control': (self.flavors[1], 1)},
-            assign_profiles=True, dry_run=False)
+            assign_profiles=True, dry_run=False,
+            cache=node_cache.get_cache())
 
     def test_failed(self, mock_assign):
         mock_assign.return_value = (2, 0)
@@ -73,7 +77,8 @@ class TestMatchProfiles(test_plugin.TestPluginV1):
             self.app.client_manager.baremetal,
             {'compute': (self.flavors[0], 3),
              'control': (self.flavors[1], 1)},
-            assign_profiles=True, dry_run=False)
+            assign_profiles=True, dry_run=False,
+            cache=node_cache.get_cache())
 
     def test_dry_run(self, mock_assign):
         mock_assign.return_value = (0, 0)
@@ -93,7 +98,8 @@ class TestMatchProfiles(test_plugin.TestPluginV1):
             self.app.client_manager.baremetal,
             {'compute': (self.flavors[0], 3),
              'control': (self.flavors[1], 1)},
-            assign_profiles=True, dry_run=True)
+            assign_profiles=True, dry_run=True,
+            cache=node_cache.get_cache())
 
 
 class TestListProfiles(test_plugin.TestPluginV1):
@@ -104,21 +110,28 @@ class TestListProfiles(test_plugin.TestPluginV1):
         self.app.client_manager.baremetal = mock.Mock()
         self.nodes = [
             mock.Mock(uuid='uuid1', provision_state='active',
-                      properties={}),
+                      properties={}, maintenance=False),
             mock.Mock(uuid='uuid2', provision_state='enroll',
-                      properties={'capabilities': 'profile:compute'}),
+                      properties={'capabilities': 'profile:compute'},
+                      maintenance=False),
             mock.Mock(uuid='uuid3', provision_state='available',
                       properties={'capabilities': 'profile:compute,'
-                                  'compute_profile:1,control_profile:true'}),
+                                  'compute_profile:1,control_profile:true'},
+                      maintenance=False),
             mock.Mock(uuid='uuid4', provision_state='available',
                       properties={'capabilities': 'profile:compute,'
-                                  'compute_profile:0'}),
+                                  'compute_profile:0'},
+                      maintenance=False),
+            mock.Mock(uuid='uuid5', provision_state='available',
+                      properties={}, maintenance=True),
         ]
         self.bm_client = self.app.client_manager.baremetal
+        self.bm_client.http_client.os_ironic_api_version = '1.8'
         self.bm_client.node.list.return_value = self.nodes
 
     def test_list(self):
-        result = self.cmd.take_action(None)
+        parsed_args = self.check_parser(self.cmd, [], [])
+        result = self.cmd.take_action(parsed_args)
         self.assertEqual(5, len(result[0]))
         self.assertEqual(
             [('uuid1', self.nodes[0].name, 'active', None, ''),
@@ -126,3 +139,27 @@ class TestListProfiles(test_plugin.TestPluginV1):
               'compute, control'),
              ('uuid4', self.nodes[3].name, 'available', 'compute', '')],
             result[1])
+
+    def test_list_twice(self):
+        parsed_args = self.check_parser(self.cmd, [], [])
+
+        first = self.cmd.take_action(parsed_args)
+        second = self.cmd.take_action(parsed_args)
+
+        self.assertEqual(first[1], second[1])
+        self.bm_client.node.list.assert_called_once_with(
+            fields=['maintenance', 'name', 'properties', 'provision_state',
+                    'updated_at', 'uuid'], limit=0)
+
+    @mock.patch.object(node_cache, 'get_cache', autospec=True)
+    def test_list_node_cache_ttl(self, mock_get_cache):
+        mock_get_cache.return_value.nodes.return_value = self.nodes
+        parsed_args = self.check_parser(self.cmd,
+                                        ['--node-cache-ttl', '300'],
+                                        [('node_cache_ttl', 300)])
+
+        self.cmd.take_action(parsed_args)
+
+        mock_get_cache.assert_called_once_with(
+            os.path.expanduser('~/.tripleo/node-snapshot.json'), ttl=300)
+        self.assertFalse(self.bm_client.node.list.called)
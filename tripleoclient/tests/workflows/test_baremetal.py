@@ -12,6 +12,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 import mock
 
 from osc_lib.tests import utils
@@ -238,6 +245,83 @@ class TestBaremetalWorkflows(utils.TestCommand):
                 'queue_name': "QUEUE_NAME"
             })
 
+    def test_introspection_scheduler_retries(self):
+        attempts = {}
+        batches = []
+
+        def create(workflow, workflow_input):
+            batches.append(workflow_input)
+            return mock.Mock()
+
+        def wait_for_messages(timeout=None):
+            # The node4 always fails, node3 only the first time
+            batch = batches[-1]['node_uuids']
+            results = {}
+            for node in batch:
+                attempts[node] = attempts.get(node, 0) + 1
+                failed = node == 'node4' or (
+                    node == 'node3' and attempts[node] == 1)
+                results[node] = {'finished': True,
+                                 'error': 'Timeout' if failed else None}
+            return iter([{"execution": {"id": "IDID"},
+                          "status": "SUCCESS",
+                          "introspected_nodes": results}])
+
+        self.workflow.executions.create.side_effect = create
+        self.websocket.wait_for_messages.side_effect = wait_for_messages
+        scheduler = baremetal.IntrospectionScheduler(
+            self.app.client_manager, ['node%d' % i for i in range(5)],
+            batch_size=2, retries=1, run_validations=True,
+            queue_name='QUEUE_NAME')
+
+        with mock.patch('sys.stdout'):
+            self.assertRaises(exceptions.IntrospectionError, scheduler.run)
+
+        self.assertEqual([
+            (['node0', 'node1'], True, 'QUEUE_NAME-0'),
+            (['node2', 'node3'], False, 'QUEUE_NAME-1'),
+            (['node4', 'node3'], False, 'QUEUE_NAME-2'),
+            (['node4'], False, 'QUEUE_NAME-3'),
+        ], [(b['node_uuids'], b['run_validations'], b['queue_name'])
+            for b in batches])
+        self.assertEqual({'node4': 'Timeout'}, scheduler.errors)
+        self.assertEqual('failed', scheduler.nodes['node4'])
+        self.assertEqual(
+            'Introspection: 4 of 5 nodes done, 1 failed, 0 in progress, '
+            '0 pending', scheduler.progress())
+
+    @mock.patch('tripleoclient.workflows.baremetal.IntrospectionScheduler.'
+                '_introspect')
+    def test_introspection_scheduler_concurrency(self, mock_introspect):
+        lock = threading.Lock()
+        running = []
+        most_running = []
+
+        def introspect(index, batch):
+            with lock:
+                running.append(index)
+                most_running.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(index)
+            # A workflow which failed without any node result
+            if index == 0:
+                raise exceptions.WebSocketTimeout()
+            return {}
+
+        mock_introspect.side_effect = introspect
+        scheduler = baremetal.IntrospectionScheduler(
+            self.app.client_manager, ['node%d' % i for i in range(10)],
+            batch_size=1, max_concurrency=3, retries=1,
+            queue_name='QUEUE_NAME')
+
+        with mock.patch('sys.stdout'):
+            scheduler.run()
+
+        self.assertEqual(11, mock_introspect.call_count)
+        self.assertEqual(3, max(most_running))
+        self.assertEqual(10, scheduler.count(scheduler.DONE))
+
     def test_provide_manageable_nodes_success(self):
 
         self.websocket.wait_for_messages.return_value = self.message_success
@@ -322,3 +406,139 @@ class TestBaremetalWorkflows(utils.TestCommand):
             workflow_input={
                 'queue_name': "QUEUE_NAME"
             })
+
+    @mock.patch('tripleoclient.workflows.baremetal.register_or_update')
+    def test_register_or_update_in_chunks_resume(self, mock_register):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'checkpoint.json')
+        nodes = [{'pm_type': 'ipmi', 'mac': ['00:00:00:00:00:%02d' % i]}
+                 for i in range(5)]
+        failing = ['00:00:00:00:00:02']
+
+        def register(clients, nodes_json, queue_name, **kwargs):
+            if any(n['mac'] == failing for n in nodes_json):
+                raise exceptions.RegisterOrUpdateError('Node on fire')
+            return [{'uuid': 'uuid-%s' % n['mac'][0][-2:]}
+                    for n in nodes_json]
+
+        mock_register.side_effect = register
+
+        self.assertRaises(
+            exceptions.RegisterOrUpdateError,
+            baremetal.register_or_update_in_chunks,
+            self.app.client_manager, nodes, chunk_size=2,
+            checkpoint=baremetal.RegistrationCheckpoint(path),
+            queue_name='QUEUE_NAME', kernel_name='kernel')
+        self.assertEqual(
+            ['QUEUE_NAME-0', 'QUEUE_NAME-1', 'QUEUE_NAME-2'],
+            sorted(c[1]['queue_name'] for c in mock_register.call_args_list))
+        with open(path) as f:
+            self.assertEqual({'00:00:00:00:00:00': 'uuid-00',
+                              '00:00:00:00:00:01': 'uuid-01',
+                              '00:00:00:00:00:04': 'uuid-04'},
+                             {k: v['uuid']
+                              for k, v in json.load(f)['nodes'].items()})
+
+        # Only the chunk which failed is registered again
+        failing = []
+        mock_register.reset_mock()
+        registered = baremetal.register_or_update_in_chunks(
+            self.app.client_manager, nodes, chunk_size=2,
+            checkpoint=baremetal.RegistrationCheckpoint(path),
+            queue_name='QUEUE_NAME', kernel_name='kernel')
+
+        mock_register.assert_called_once_with(
+            self.app.client_manager, nodes_json=nodes[2:4],
+            queue_name='QUEUE_NAME', kernel_name='kernel')
+        self.assertEqual(['uuid-00', 'uuid-01', 'uuid-04', 'uuid-02',
+                          'uuid-03'], [n['uuid'] for n in registered])
+        self.assertFalse(os.path.exists(path))
+
+    @mock.patch('six.moves.builtins.print')
+    @mock.patch('tripleoclient.workflows.baremetal.register_or_update')
+    def test_register_or_update_in_chunks_of_zero(self, mock_register,
+                                                  mock_print):
+        nodes = [{'pm_type': 'ipmi', 'mac': ['00:00:00:00:00:%02d' % i]}
+                 for i in range(2)]
+        mock_register.side_effect = lambda clients, nodes_json, **kw: [
+            {'uuid': 'uuid-%s' % n['mac'][0][-2:]} for n in nodes_json]
+
+        registered = baremetal.register_or_update_in_chunks(
+            self.app.client_manager, nodes, chunk_size=0, max_concurrency=1,
+            queue_name='QUEUE_NAME')
+
+        # Each node is registered alone rather than none of them
+        self.assertEqual(['uuid-00', 'uuid-01'],
+                         [n['uuid'] for n in registered])
+        mock_print.assert_has_calls([
+            mock.call('Registering nodes 1 to 1 of 2'),
+            mock.call('Registering nodes 2 to 2 of 2')])
+
+    @mock.patch('tripleoclient.workflows.baremetal.register_or_update')
+    def test_register_or_update_in_chunks_changed(self, mock_register):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        checkpoint = baremetal.RegistrationCheckpoint(
+            os.path.join(tmp, 'checkpoint.json'))
+        nodes = [{'pm_type': 'ipmi', 'mac': ['00:00:00:00:00:%02d' % i]}
+                 for i in range(2)]
+        checkpoint.record(nodes, [{'uuid': 'uuid-00'}, {'uuid': 'uuid-01'}])
+        mock_register.return_value = [{'uuid': 'uuid-01'}]
+
+        # The node changed in the inventory is registered again
+        nodes[1]['pm_type'] = 'redfish'
+        registered = baremetal.register_or_update_in_chunks(
+            self.app.client_manager, nodes, checkpoint=checkpoint,
+            queue_name='QUEUE_NAME')
+
+        mock_register.assert_called_once_with(
+            self.app.client_manager, nodes_json=nodes[1:],
+            queue_name='QUEUE_NAME')
+        self.assertEqual(['uuid-00', 'uuid-01'],
+                         [n['uuid'] for n in registered])
+
+    @mock.patch('tripleoclient.workflows.baremetal.register_or_update')
+    def test_register_or_update_in_chunks_unmatched(self, mock_register):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'checkpoint.json')
+        nodes = [{'pm_type': 'ipmi', 'mac': ['00:00:00:00:00:%02d' % i]}
+                 for i in range(4)]
+        mock_register.side_effect = [
+            [{'uuid': 'uuid-00'}, {'uuid': 'uuid-01'}],
+            [{'uuid': 'uuid-02'}],
+        ]
+
+        self.assertRaises(
+            exceptions.RegisterOrUpdateError,
+            baremetal.register_or_update_in_chunks,
+            self.app.client_manager, nodes, chunk_size=2, max_concurrency=1,
+            checkpoint=baremetal.RegistrationCheckpoint(path),
+            queue_name='QUEUE_NAME')
+
+        # The nodes of the chunk which can't be matched are never recorded
+        checkpoint = baremetal.RegistrationCheckpoint(path)
+        self.assertEqual(['00:00:00:00:00:00', '00:00:00:00:00:01'],
+                         sorted(checkpoint.nodes))
+        self.assertNotIn(nodes[2], checkpoint)
+
+    def test_remove_stale_checkpoints(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        for name in ('stale.json', 'recent.json'):
+            with open(os.path.join(tmp, name), 'w') as f:
+                f.write('{}')
+        old = time.time() - baremetal.CHECKPOINT_MAX_AGE - 60
+        os.utime(os.path.join(tmp, 'stale.json'), (old, old))
+
+        baremetal.remove_stale_checkpoints(tmp)
+        baremetal.remove_stale_checkpoints(os.path.join(tmp, 'missing'))
+
+        self.assertEqual(['recent.json'], os.listdir(tmp))
+
+    def test_node_key(self):
+        self.assertEqual('aa:bb,cc:dd', baremetal.node_key(
+            {'mac': ['CC:DD'], 'ports': [{'address': 'aa:bb'}]}))
+        self.assertEqual('192.168.0.1:623', baremetal.node_key(
+            {'pm_addr': '192.168.0.1', 'pm_port': 623}))
@@ -0,0 +1,104 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from heatclient import exc as hc_exc
+import mock
+from osc_lib.tests import utils
+
+from tripleoclient import exceptions
+from tripleoclient.workflows import deployment
+
+
+class TestDeploymentWorkflows(utils.TestCommand):
+
+    def setUp(self):
+        super(TestDeploymentWorkflows, self).setUp()
+        self.orchestration = mock.Mock()
+        self.app.client_manager.orchestration = self.orchestration
+        self.app.client_manager.workflow_engine = mock.Mock()
+        sleep_patch = mock.patch('time.sleep')
+        self.mock_sleep = sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    def test_wait_for_stack_action_create(self):
+        self.orchestration.stacks.get.side_effect = [
+            hc_exc.HTTPNotFound(), None, mock.Mock()]
+
+        self.assertTrue(deployment.wait_for_stack_action(
+            self.orchestration, 'overcloud', None, 'CREATE'))
+
+        self.orchestration.stacks.get.assert_called_with(
+            'overcloud', resolve_outputs=False)
+        self.assertEqual([mock.call(0.5), mock.call(1)],
+                         self.mock_sleep.call_args_list)
+
+    def test_wait_for_stack_action_update(self):
+        previous = mock.Mock(stack_status='UPDATE_COMPLETE',
+                             updated_time='2017-10-01T00:00:00Z')
+        self.orchestration.stacks.get.side_effect = [
+            mock.Mock(stack_status='UPDATE_COMPLETE',
+                      updated_time='2017-10-01T00:00:00Z'),
+            mock.Mock(stack_status='UPDATE_IN_PROGRESS',
+                      updated_time='2017-10-02T00:00:00Z'),
+        ]
+
+        self.assertTrue(deployment.wait_for_stack_action(
+            self.orchestration, 'overcloud', previous, 'UPDATE'))
+        self.assertEqual(1, self.mock_sleep.call_count)
+
+    def test_wait_for_stack_action_timeout(self):
+        previous = mock.Mock(stack_status='UPDATE_COMPLETE',
+                             updated_time='2017-10-01T00:00:00Z')
+        self.orchestration.stacks.get.return_value = previous
+
+        self.assertFalse(deployment.wait_for_stack_action(
+            self.orchestration, 'overcloud', previous, 'UPDATE',
+            timeout=10))
+        self.assertEqual([0.5, 1, 2, 4, 5],
+                         [c[0][0] for c in self.mock_sleep.call_args_list])
+
+    @mock.patch('tripleoclient.utils.wait_for_stack_ready', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.deploy', autospec=True)
+    @mock.patch('heatclient.common.event_utils.get_events', autospec=True)
+    def test_deploy_and_wait_update(self, mock_get_events, mock_deploy,
+                                    mock_wait_for_stack_ready):
+        previous = mock.Mock(stack_status='CREATE_COMPLETE',
+                             updated_time=None)
+        self.orchestration.stacks.get.return_value = mock.Mock(
+            stack_status='UPDATE_IN_PROGRESS', updated_time=None)
+        mock_get_events.return_value = [mock.Mock(id='marker')]
+        mock_wait_for_stack_ready.return_value = True
+
+        deployment.deploy_and_wait(mock.Mock(), self.app.client_manager,
+                                   previous, 'overcloud', 1)
+
+        mock_get_events.assert_called_once_with(
+            self.orchestration, stack_id='overcloud',
+            event_args={'sort_dir': 'desc', 'limit': 1})
+        mock_wait_for_stack_ready.assert_called_once_with(
+            self.orchestration, 'overcloud', 'marker', 'UPDATE', True)
+        self.assertFalse(self.mock_sleep.called)
+
+    @mock.patch('tripleoclient.stack_failures.print_failures', autospec=True)
+    @mock.patch('tripleoclient.utils.wait_for_stack_ready', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.deploy', autospec=True)
+    def test_deploy_and_wait_failed(self, mock_deploy,
+                                    mock_wait_for_stack_ready,
+                                    mock_print_failures):
+        mock_wait_for_stack_ready.return_value = False
+
+        self.assertRaises(exceptions.DeploymentError,
+                          deployment.deploy_and_wait, mock.Mock(),
+                          self.app.client_manager, None, 'overcloud', 0)
+
+        mock_print_failures.assert_called_once_with(self.orchestration,
+                                                    'overcloud')
@@ -0,0 +1,292 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import calendar
+import collections
+import contextlib
+import json
+import time
+
+from prettytable import PrettyTable
+
+from tripleoclient import stack_events
+
+
+class StageTimer(object):
+    """Record how long each stage of a command takes
+
+    Stages are timed with the :meth:`stage` context manager and are reported
+    in the order they finished.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self.started = clock()
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block as the stage called name
+
+        A stage which raises an exception is recorded as failed and the
+        exception is re-raised.
+        """
+        start = self._clock()
+        status = 'FAILED'
+        try:
+            yield
+            status = 'COMPLETE'
+        finally:
+            end = self._clock()
+            self.stages.append({
+                'name': name,
+                'start': start - self.started,
+                'duration': end - start,
+                'status': status,
+            })
+
+    @property
+    def total(self):
+        """Time elapsed between the creation of the timer and the last stage"""
+        if not self.stages:
+            return 0.0
+        return max(s['start'] + s['duration'] for s in self.stages)
+
+    def as_table(self):
+        """Return the stages as a PrettyTable"""
+        table = PrettyTable(['Stage', 'Duration (s)', '%', 'Status'])
+        table.align['Stage'] = 'l'
+        table.align['Duration (s)'] = 'r'
+        table.align['%'] = 'r'
+        total = self.total
+        for s in self.stages:
+            share = 100.0 * s['duration'] / total if total else 0.0
+            table.add_row([s['name'], '%.2f' % s['duration'],
+                           '%.1f' % share, s['status']])
+        table.add_row(['Total', '%.2f' % total, '', ''])
+        return table
+
+    def as_dict(self):
+        return {'total': self.total, 'stages': list(self.stages)}
+
+    def write_json(self, path, **extra):
+        """Write the stages to a JSON file
+
+        :param path: Path of the file to write
+        :type  path: string
+
+        :param extra: Extra top level keys, e.g. the stack name
+        """
+        report = self.as_dict()
+        report.update(extra)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def parse_event_time(value):
+    """Return the seconds since the epoch of a Heat event time
+
+    Heat gives times such as 2017-10-01T12:00:00Z, with or without
+    fractional seconds and the trailing Z.
+    """
+    value = value.rstrip('Z')
+    value, _sep, fraction = value.partition('.')
+    seconds = calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%S'))
+    if fraction:
+        seconds += float('0.' + fraction)
+    return seconds
+
+
+class EventTimeline(object):
+    """Durations of the resources of a deployment, from a recorded event log
+
+    The log is written by stack_events.EventRecorder with the --event-log
+    option of "openstack overcloud deploy". Each resource lasts from its
+    first IN_PROGRESS event to the COMPLETE or FAILED event which follows,
+    only the last run is kept when the log holds several stack actions.
+
+    Heat events don't tell which resources depend on each other, so the
+    critical path is estimated from the top level resources: starting from
+    the last one to finish, each step is the resource which finished last
+    before the previous step started.
+    """
+
+    def __init__(self, records):
+        # Resource runs keyed by their path from the root stack
+        self.resources = collections.OrderedDict()
+        # The runs of the root stacks, keyed by stack name
+        self.stacks = collections.OrderedDict()
+        # Workflow executions keyed by ID
+        self.executions = collections.OrderedDict()
+        seen = set()
+        for record in records:
+            if record.get('type') == 'heat':
+                if record.get('id') in seen:
+                    continue
+                seen.add(record.get('id'))
+                self._add_event(record)
+            elif record.get('type') == 'workflow':
+                self._add_payload(record)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(stack_events.read_event_log(path))
+
+    def _add_event(self, record):
+        status = record.get('status') or ''
+        if not record.get('event_time'):
+            return
+        when = parse_event_time(record['event_time'])
+        if record.get('stack_id') and (
+                record.get('stack_id') == record.get('physical_resource_id')):
+            if record.get('resource_name') != record.get('stack'):
+                # The resource of a nested stack gives its duration already
+                return
+            runs = self.stacks
+            path = record['stack']
+        else:
+            runs = self.resources
+            path = record.get('resource_path') or record.get('resource_name')
+        run = runs.get(path)
+        if status.endswith('_IN_PROGRESS'):
+            if run is None or run['end'] is not None:
+                runs[path] = {'path': path, 'start': when, 'end': None,
+                              'status': status}
+        elif run is not None and run['end'] is None and (
+                status.endswith('_COMPLETE') or status.endswith('_FAILED')):
+            run['end'] = when
+            run['status'] = status
+
+    def _add_payload(self, record):
+        payload = record.get('payload') or {}
+        execution = payload.get('execution') or {}
+        execution_id = execution.get('id')
+        if not execution_id:
+            return
+        run = self.executions.setdefault(execution_id, {
+            'id': execution_id, 'start': record['recorded'], 'messages': 0,
+            'status': 'RUNNING'})
+        run['end'] = record['recorded']
+        run['messages'] += 1
+        run['status'] = payload.get('status', run['status'])
+
+    @staticmethod
+    def duration(run):
+        if run.get('end') is None:
+            return None
+        return run['end'] - run['start']
+
+    def finished(self):
+        """Return the resources which finished, longest first"""
+        runs = [r for r in self.resources.values() if r['end'] is not None]
+        return sorted(runs, key=self.duration, reverse=True)
+
+    def roles(self):
+        """Return the start, end and resource count of each role
+
+        Roles are the top level resources with numbered members, as given
+        by the ResourceGroup of each role. A resource belongs to the role
+        with the longest name that starts a component of its path, so that
+        ComputeDeployment_Step1 counts towards Compute.
+        """
+        names = set()
+        for path in self.resources:
+            parts = path.split('.')
+            if len(parts) > 1 and parts[1].isdigit():
+                names.add(parts[0])
+        # Longest names first, so ComputeHCI is matched before Compute
+        names = sorted(names, key=len, reverse=True)
+
+        roles = collections.OrderedDict()
+        for run in self.resources.values():
+            if run['end'] is None:
+                continue
+            role = self._role_of(run['path'], names)
+            if role is None:
+                continue
+            entry = roles.setdefault(role, {
+                'path': role, 'start': run['start'], 'end': run['end'],
+                'count': 0})
+            entry['start'] = min(entry['start'], run['start'])
+            entry['end'] = max(entry['end'], run['end'])
+            entry['count'] += 1
+        return sorted(roles.values(), key=self.duration, reverse=True)
+
+    @staticmethod
+    def _role_of(path, names):
+        parts = path.split('.')
+        for name in names:
+            for part in parts:
+                if part.startswith(name):
+                    return name
+        return None
+
+    def critical_path(self):
+        """Return the estimated critical path, in the order it ran"""
+        top = [r for r in self.resources.values()
+               if r['end'] is not None and '.' not in r['path']]
+        path = []
+        candidates = top
+        while candidates:
+            last = max(candidates, key=lambda r: r['end'])
+            path.append(last)
+            # Heat timestamps have a one second resolution, runs which end
+            # when the last one starts precede it unless already on the path
+            candidates = [r for r in top if r['end'] <= last['start']
+                          and not any(r is p for p in path)]
+        path.reverse()
+        return path
+
+    def as_tables(self, top=20):
+        """Return the PrettyTables of the resources, roles and critical path
+
+        :param top: How many of the longest resources to include
+        :type  top: integer
+        """
+        origin = min([r['start'] for r in self.resources.values()] +
+                     [r['start'] for r in self.stacks.values()] or [0])
+
+        def row(run):
+            duration = self.duration(run)
+            return [run['path'], '%.0f' % (run['start'] - origin),
+                    '' if duration is None else '%.0f' % duration,
+                    run.get('status', '')]
+
+        tables = []
+        for title, runs in (
+                ('Stack', list(self.stacks.values())),
+                ('Resource', self.finished()[:top]),
+                ('Critical path', self.critical_path())):
+            table = PrettyTable([title, 'Start (s)', 'Duration (s)', 'Status'])
+            table.align[title] = 'l'
+            for run in runs:
+                table.add_row(row(run))
+            tables.append(table)
+
+        table = PrettyTable(['Role', 'Start (s)', 'Duration (s)', 'Resources'])
+        table.align['Role'] = 'l'
+        for run in self.roles():
+            table.add_row([run['path'], '%.0f' % (run['start'] - origin),
+                           '%.0f' % self.duration(run), run['count']])
+        tables.append(table)
+
+        table = PrettyTable(['Workflow execution', 'Duration (s)',
+                             'Messages', 'Status'])
+        table.align['Workflow execution'] = 'l'
+        for run in self.executions.values():
+            table.add_row([run['id'], '%.0f' % self.duration(run),
+                           run['messages'], run['status']])
+        tables.append(table)
+        return tables
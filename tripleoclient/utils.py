@@ -14,6 +14,9 @@
 #
 
 from __future__ import print_function
+import argparse
+import collections
+from concurrent import futures
 import csv
 import datetime
 import hashlib
@@ -25,15 +28,18 @@ import six
 import socket
 import subprocess
 import sys
+import threading
 import time
 import yaml
 
-from heatclient.common import event_utils
 from heatclient.exc import HTTPNotFound
 from osc_lib.i18n import _
 from six.moves import configparser
 
+from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient import stack_events
+from tripleoclient import waiting
 
 
 def bracket_ipv6(address):
@@ -157,96 +163,259 @@ def wait_for_stack_ready(orchestration_client, stack_name, marker=None,
     :param verbose: Whether to print events
     :type verbose: boolean
     """
-    stack = get_stack(orchestration_client, stack_name)
+    stack = get_stack(orchestration_client, stack_name,
+                      resolve_outputs=False)
     if not stack:
         return False
     stack_name = stack.stack_name
 
-    if verbose:
-        out = sys.stdout
-    else:
-        out = open(os.devnull, "w")
-    stack_status, msg = event_utils.poll_for_events(
-        orchestration_client, stack_name, action=action,
-        poll_period=5, marker=marker, out=out, nested_depth=2)
+    # The events are only formatted when they are printed
+    out = sys.stdout if verbose else None
+    tailer = stack_events.EventTailer(
+        orchestration_client, stack_name, action=action, marker=marker,
+        out=out, nested_depth=2, recorder=stack_events.active_recorder())
+    stack_status, msg = tailer.wait()
     print(msg)
     return stack_status == '%s_COMPLETE' % action
 
 
-def nodes_in_states(baremetal_client, states):
-    """List the introspectable nodes with the right provision_states."""
-    nodes = baremetal_client.node.list(maintenance=False, associated=False)
-    return [node for node in nodes if node.provision_state in states]
+# The fields of the nodes needed to list and match their profiles
+PROFILE_NODE_FIELDS = ['uuid', 'name', 'provision_state', 'maintenance',
+                       'properties']
 
 
-def wait_for_provision_state(baremetal_client, node_uuid, provision_state,
-                             loops=10, sleep=1):
-    """Wait for a given Provisioning state in Ironic
+def node_fields_supported(baremetal_client):
+    """Whether the nodes can be listed with only some of their fields
 
-    Updating the provisioning state is an async operation, we
-    need to wait for it to be completed.
+    Listing the nodes with fields needs the Ironic API version 1.8.
+    """
+    api_version = baremetal_client.http_client.os_ironic_api_version
+    if api_version == 'latest':
+        return True
+    try:
+        return [int(part) for part in api_version.split('.')] >= [1, 8]
+    except (AttributeError, TypeError, ValueError):
+        return False
 
-    :param baremetal_client: Instance of Ironic client
-    :type  baremetal_client: ironicclient.v1.client.Client
 
-    :param node_uuid: The Ironic node UUID
-    :type  node_uuid: str
+def list_nodes(baremetal_client, fields=None, maintenance=None, cache=None):
+    """List all the nodes with only the given fields
 
-    :param provision_state: The provisioning state name to wait for
-    :type  provision_state: str
+    With detail=True, Ironic returns the whole of each node, including its
+    driver_info, instance_info and extra, even when only a couple of fields
+    are used, which makes the listings of large deployments slow.
 
-    :param loops: How many times to loop
-    :type loops: int
+    :param fields: The fields of the nodes to list, all of them when None
+                   or below the Ironic API version 1.8
+    :param maintenance: Only list the nodes in maintenance, when True, or
+                        those not in maintenance, when False
+    :param cache: Snapshot of the nodes to filter rather than listing them
+    :type  cache: node_cache.NodeSnapshotCache
+    """
+    if cache is not None:
+        if fields is not None and maintenance is not None:
+            fields = list(fields) + ['maintenance']
+        nodes = cache.nodes(baremetal_client, fields=fields)
+        if maintenance is not None:
+            nodes = [node for node in nodes
+                     if bool(node.maintenance) == maintenance]
+        return nodes
+
+    kwargs = {'limit': 0}
+    if maintenance is not None:
+        kwargs['maintenance'] = maintenance
+    if fields is None or not node_fields_supported(baremetal_client):
+        kwargs['detail'] = True
+    else:
+        kwargs['fields'] = fields
+    return baremetal_client.node.list(**kwargs)
 
-    :param sleep: How long to sleep between loops
-    :type sleep: int
 
-    :raises exceptions.StateTransitionFailed: if node.last_error is set
+def nodes_in_states(baremetal_client, states, cache=None):
+    """List the introspectable nodes with the right provision_states.
+
+    :param cache: Snapshot of the nodes to filter rather than listing them
+    :type  cache: node_cache.NodeSnapshotCache
+    """
+    if cache is not None:
+        nodes = [node for node in cache.nodes(baremetal_client)
+                 if not node.maintenance and not node.instance_uuid]
+    else:
+        nodes = baremetal_client.node.list(maintenance=False,
+                                           associated=False)
+    return [node for node in nodes if node.provision_state in states]
+
+
+class NodeWaiter(object):
+    """Wait for a node to reach a provision state
+
+    The waiter is given the state of the node after each poll and tells
+    whether it's done waiting. error is then set when the node failed or
+    didn't reach the state before the strategy gave up.
     """
 
-    for _l in range(0, loops):
+    def __init__(self, node_uuid, provision_state, strategy=None):
+        self.node_uuid = node_uuid
+        self.provision_state = provision_state
+        self.backoff = (strategy or waiting.DEFAULT_TRANSITION_WAIT).start()
+        self.driver = None
+        self.state = None
+        self.error = None
 
-        node = baremetal_client.node.get(node_uuid)
+    def update(self, node):
+        """Check a node and return whether it's done waiting
 
+        :param node: The node, or None when it can't be found in Ironic. It
+                     needs the provision_state and last_error fields.
+        """
         if node is None:
             # The node can't be found in ironic, so we don't need to wait for
             # the provision state
-            return
-        if node.provision_state == provision_state:
-            return
+            return True
+        self.driver = getattr(node, 'driver', None)
+        self.state = node.provision_state
+        if node.provision_state == self.provision_state:
+            return True
 
         # node.last_error should be None after any successful operation
         if node.last_error:
-            raise exceptions.StateTransitionFailed(
+            self.error = exceptions.StateTransitionFailed(
                 "Error transitioning node %(uuid)s to provision state "
                 "%(state)s: %(error)s. Now in state %(actual)s." % {
-                    'uuid': node_uuid,
-                    'state': provision_state,
+                    'uuid': self.node_uuid,
+                    'state': self.provision_state,
                     'error': node.last_error,
                     'actual': node.provision_state
                 }
             )
+            return True
 
-        time.sleep(sleep)
+        if not self.backoff.attempt():
+            self.error = exceptions.Timeout(
+                "Node %(uuid)s did not reach provision state %(state)s. "
+                "Now in state %(actual)s." % {
+                    'uuid': self.node_uuid,
+                    'state': self.provision_state,
+                    'actual': node.provision_state
+                }
+            )
+            return True
+        return False
 
-    raise exceptions.Timeout(
-        "Node %(uuid)s did not reach provision state %(state)s. "
-        "Now in state %(actual)s." % {
-            'uuid': node_uuid,
-            'state': provision_state,
-            'actual': node.provision_state
-        }
-    )
+
+class NodeStatePoller(object):
+    """Wait for many nodes to reach a provision state
+
+    All the nodes are polled with a single node list request, limited to the
+    fields the waiters need, so the load on Ironic doesn't grow with the
+    number of nodes watched. The polls back off while no node is done and
+    the delay goes back to the initial one of the strategy when one is.
+    """
+
+    fields = ['uuid', 'provision_state', 'last_error', 'driver']
+
+    def __init__(self, baremetal_client, strategy=None):
+        self.client = baremetal_client
+        self.strategy = strategy or waiting.DEFAULT_TRANSITION_WAIT
+        self._waiters = collections.OrderedDict()
+        self._cadence = waiting.WaitStrategy(
+            timeout=None, initial=self.strategy.initial,
+            maximum=self.strategy.maximum, factor=self.strategy.factor,
+            jitter=self.strategy.jitter).start()
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def watch(self, node_uuid, provision_state, strategy=None):
+        """Wait for a node to reach provision_state from the next poll"""
+        waiter = NodeWaiter(node_uuid, provision_state,
+                            strategy=strategy or self.strategy)
+        self._waiters[node_uuid] = waiter
+        return waiter
+
+    def poll(self):
+        """List the nodes once and return the waiters which are done"""
+        if not self._waiters:
+            return []
+        nodes = dict((node.uuid, node) for node in
+                     list_nodes(self.client, fields=self.fields))
+        done = []
+        for node_uuid, waiter in list(self._waiters.items()):
+            if waiter.update(nodes.get(node_uuid)):
+                del self._waiters[node_uuid]
+                done.append(waiter)
+        if done:
+            self._cadence.reset()
+        return done
+
+    def next_delay(self):
+        """Return how long to sleep before the next poll"""
+        delay = self._cadence.next_delay()
+        remaining = [w.backoff.remaining for w in self._waiters.values()
+                     if w.backoff.remaining is not None]
+        if remaining:
+            delay = min(delay, min(remaining))
+        return delay
+
+    def wait(self):
+        """Poll until all the nodes are done, yielding their waiters"""
+        while self._waiters:
+            for waiter in self.poll():
+                yield waiter
+            if self._waiters:
+                time.sleep(self.next_delay())
+
+
+def wait_for_provision_state(baremetal_client, node_uuid, provision_state,
+                             loops=10, sleep=1, strategy=None):
+    """Wait for a given Provisioning state in Ironic
+
+    Updating the provisioning state is an async operation, we
+    need to wait for it to be completed. Use NodeStatePoller to wait for
+    several nodes at once.
+
+    :param baremetal_client: Instance of Ironic client
+    :type  baremetal_client: ironicclient.v1.client.Client
+
+    :param node_uuid: The Ironic node UUID
+    :type  node_uuid: str
+
+    :param provision_state: The provisioning state name to wait for
+    :type  provision_state: str
+
+    :param loops: How many times to loop
+    :type loops: int
+
+    :param sleep: How long to sleep between loops
+    :type sleep: int
+
+    :param strategy: How to wait, instead of loops and sleep
+    :type strategy: tripleoclient.waiting.WaitStrategy
+
+    :raises exceptions.StateTransitionFailed: if node.last_error is set
+    """
+
+    strategy = strategy or waiting.WaitStrategy.fixed(loops, sleep)
+    waiter = NodeWaiter(node_uuid, provision_state, strategy=strategy)
+    while not waiter.update(baremetal_client.node.get(node_uuid)):
+        time.sleep(waiter.backoff.next_delay())
+    if waiter.error is not None:
+        raise waiter.error
 
 
 def set_nodes_state(baremetal_client, nodes, transition, target_state,
-                    skipped_states=()):
+                    skipped_states=(), max_concurrency=10, strategy=None,
+                    stats=None):
     """Make all nodes available in the baremetal service for a deployment
 
     For each node, make it available unless it is already available or active.
     Available nodes can be used for a deployment and an active node is already
     in use.
 
+    Up to max_concurrency nodes are transitioned at once. The nodes in
+    transition are all polled with a single node list request, and a new
+    node is started as soon as one of them reaches the target state.
+
     :param baremetal_client: Instance of Ironic client
     :type  baremetal_client: ironicclient.v1.client.Client
 
@@ -266,97 +435,184 @@ def set_nodes_state(baremetal_client, nodes, transition, target_state,
                            changed.
     :type  skipped_states: iterable of strings
 
-    :param error_states: Node states treated as error for this transition
-    :type error_states: collection of strings
+    :param max_concurrency: How many nodes to transition at once
+    :type  max_concurrency: int
 
-    :param error_message: Optional message to append to an error message
-    :param error_message: str
+    :param strategy: How long to wait for each node and how often to poll,
+                     by default the one stats give for the transition
+    :type  strategy: tripleoclient.waiting.WaitStrategy
 
-    :raises exceptions.StateTransitionFailed: if a node enters any of the
-                                              states in error_states
+    :param stats: Durations of the previous transitions, the duration of
+                  each node which reaches target_state is added
+    :type  stats: tripleoclient.waiting.TransitionStats
 
-    :raises exceptions.Timeout: if a node takes too long to reach target state
+    :returns: iterator of the UUIDs of the nodes, in the order they finished.
+              Nodes which failed or timed out are logged and included.
     """
 
     log = logging.getLogger(__name__ + ".set_nodes_state")
 
-    for node in nodes:
-
-        if node.provision_state in skipped_states:
-            continue
+    pending = collections.deque(
+        node for node in nodes if node.provision_state not in skipped_states)
+    if strategy is None and stats is not None:
+        strategy = stats.strategy(transition)
+    poller = NodeStatePoller(baremetal_client, strategy=strategy)
 
+    def start(node):
         log.debug(
             "Setting provision state from '{0}' to '{1}' for Node {2}"
             .format(node.provision_state, transition, node.uuid))
-
         baremetal_client.node.set_provision_state(node.uuid, transition)
-        try:
-            wait_for_provision_state(baremetal_client, node.uuid, target_state)
-        except exceptions.StateTransitionFailed as e:
-            log.error("FAIL: State transition failed for Node {0}. {1}"
-                      .format(node.uuid, e))
-        except exceptions.Timeout as e:
-            log.error("FAIL: Timeout waiting for Node {0}. {1}"
-                      .format(node.uuid, e))
-        yield node.uuid
+        return node.uuid
+
+    with futures.ThreadPoolExecutor(
+            max_workers=max(1, max_concurrency)) as executor:
+        while pending or len(poller):
+            batch = []
+            while pending and len(poller) + len(batch) < max_concurrency:
+                batch.append(pending.popleft())
+            for node_uuid in executor.map(start, batch):
+                poller.watch(node_uuid, target_state)
+
+            for waiter in poller.poll():
+                if isinstance(waiter.error, exceptions.StateTransitionFailed):
+                    log.error("FAIL: State transition failed for Node {0}. {1}"
+                              .format(waiter.node_uuid, waiter.error))
+                elif waiter.error is not None:
+                    log.error("FAIL: Timeout waiting for Node {0}. {1}"
+                              .format(waiter.node_uuid, waiter.error))
+                elif stats is not None and waiter.state is not None:
+                    stats.record(waiter.driver, transition,
+                                 waiter.backoff.elapsed)
+                yield waiter.node_uuid
+
+            if len(poller):
+                time.sleep(poller.next_delay())
+
+
+class StackOutputs(object):
+    """Index of the outputs of a stack, keyed by output_key
+
+    The index is built the first time an output is looked up, from the
+    outputs of the stack rather than from a copy of the whole stack made by
+    stack.to_dict(). The values are shared with the stack and must not be
+    modified.
+
+    When the stack was fetched without its outputs, see get_stack, each
+    output is fetched with the output show API the first time it's looked
+    up, so Heat only computes and sends the outputs which are needed.
+
+    The get_* helpers below accept either a stack or a StackOutputs, a
+    caller looking up several outputs should build one StackOutputs and
+    pass it to each of them.
+    """
+
+    def __init__(self, stack):
+        self.stack = stack
+        self._index = None
+        # Outputs fetched one by one, None for the missing ones
+        self._fetched = {}
+
+    @classmethod
+    def of(cls, stack):
+        """Return the outputs of a stack, or stack if it's a StackOutputs"""
+        if isinstance(stack, cls):
+            return stack
+        return cls(stack)
+
+    def _lazy(self):
+        """Whether the stack was fetched without its outputs"""
+        info = getattr(self.stack, '_info', None)
+        return isinstance(info, dict) and 'outputs' not in info
+
+    def _outputs(self):
+        if self._lazy():
+            # All the outputs are needed, get them at once
+            self.stack.get()
+        outputs = getattr(self.stack, 'outputs', None)
+        if not isinstance(outputs, list):
+            outputs = self.stack.to_dict().get('outputs')
+        return outputs or []
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = dict((output['output_key'], output)
+                               for output in self._outputs())
+        return self._index
+
+    def _output(self, key):
+        if self._index is not None or not self._lazy():
+            return self.index.get(key)
+        if key not in self._fetched:
+            try:
+                output = self.stack.output_show(key)['output']
+            except HTTPNotFound:
+                output = None
+            self._fetched[key] = output
+        return self._fetched[key]
+
+    def __contains__(self, key):
+        return self._output(key) is not None
+
+    def get(self, key, default=None):
+        """Return the value of an output, or default if it doesn't exist"""
+        output = self._output(key)
+        if output is None:
+            return default
+        return output['output_value']
+
+    def as_dict(self):
+        """Return a dict of the values of all the outputs"""
+        return dict((key, output['output_value'])
+                    for key, output in six.iteritems(self.index))
 
 
 def get_overcloud_endpoint(stack):
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'KeystoneURL':
-            return output['output_value']
+    return StackOutputs.of(stack).get('KeystoneURL')
 
 
 def get_service_ips(stack):
-    service_ips = {}
-    for output in stack.to_dict().get('outputs', {}):
-        service_ips[output['output_key']] = output['output_value']
-    return service_ips
+    return StackOutputs.of(stack).as_dict()
 
 
 def get_endpoint_map(stack):
-    endpoint_map = {}
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'EndpointMap':
-            endpoint_map = output['output_value']
-            break
-    return endpoint_map
+    return StackOutputs.of(stack).get('EndpointMap', {})
 
 
 def get_role_data(stack):
-    role_data = {}
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'RoleData':
-            for role in output['output_value']:
-                role_data[role] = output['output_value'][role]
-    return role_data
+    return dict(StackOutputs.of(stack).get('RoleData') or {})
 
 
 def get_role_config(stack):
-    role_data = {}
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'RoleConfig':
-            for role in output['output_value']:
-                role_data[role] = output['output_value'][role]
-    return role_data
+    return dict(StackOutputs.of(stack).get('RoleConfig') or {})
 
 
 def get_endpoint(key, stack):
-    endpoint_map = get_endpoint_map(stack)
+    outputs = StackOutputs.of(stack)
+    endpoint_map = get_endpoint_map(outputs)
     if endpoint_map:
         return endpoint_map[key]['host']
     else:
-        return get_service_ips(stack).get(key + 'Vip')
+        return outputs.get(key + 'Vip')
 
 
-def get_stack(orchestration_client, stack_name):
+def get_stack(orchestration_client, stack_name, resolve_outputs=True):
     """Get the ID for the current deployed overcloud stack if it exists.
 
     Caller is responsible for checking if return is None
+
+    With resolve_outputs=False Heat doesn't compute the outputs, which can
+    be tens of MB for a large overcloud. A StackOutputs of such a stack
+    fetches the outputs one by one when they're needed.
     """
 
     try:
-        stack = orchestration_client.stacks.get(stack_name)
+        if resolve_outputs:
+            stack = orchestration_client.stacks.get(stack_name)
+        else:
+            stack = orchestration_client.stacks.get(stack_name,
+                                                    resolve_outputs=False)
         return stack
     except HTTPNotFound:
         pass
@@ -376,6 +632,48 @@ def run_shell(cmd):
     return subprocess.call([cmd], shell=True)
 
 
+def check_ipmi_bmc(address, user, password, timeout=30,
+                   ipmitool='ipmitool'):
+    """Check that a BMC answers to ipmitool chassis status
+
+    ipmitool is run without a shell and gets the password from the
+    IPMI_PASSWORD environment variable, so the credentials are neither
+    interpreted by a shell nor visible in the process list.
+
+    :param timeout: Seconds after which ipmitool is killed
+    :type  timeout: int
+
+    :param ipmitool: Path of the ipmitool command
+
+    :returns: tuple of the exit status of ipmitool, None when it timed out,
+              and its output
+    """
+    env = dict(os.environ, IPMI_PASSWORD=password)
+    cmd = [ipmitool, '-R', '1', '-I', 'lanplus', '-H', address, '-U', user,
+           '-E', 'chassis', 'status']
+    try:
+        process = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+    except OSError as e:
+        return 127, str(e)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        process.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output, _err = process.communicate()
+    finally:
+        timer.cancel()
+    if timed_out:
+        return None, output
+    return process.returncode, output
+
+
 def all_unique(x):
     """Return True if the collection has no duplications."""
     return len(set(x)) == len(x)
@@ -401,6 +699,81 @@ def file_checksum(filepath):
     return checksum.hexdigest()
 
 
+def tree_checksum(path):
+    """Calculate a sha256 checksum of a directory tree
+
+    The relative path and contents of every file are included, symlinks are
+    not followed and their target is used instead of their contents.
+
+    :param path: Path of the directory (e.g. /home/stack/templates)
+    :type  path: string
+    """
+    checksum = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            rel_path = os.path.relpath(full_path, path)
+            checksum.update(rel_path.encode('utf-8') + b'\0')
+            if os.path.islink(full_path):
+                checksum.update(os.readlink(full_path).encode('utf-8'))
+            else:
+                with open(full_path, 'rb') as f:
+                    while True:
+                        fragment = f.read(65536)
+                        if not fragment:
+                            break
+                        checksum.update(fragment)
+            checksum.update(b'\0')
+    return checksum.hexdigest()
+
+
+def _deploy_fingerprint_path(stack_name):
+    return os.path.join(
+        os.path.expanduser(constants.DEPLOY_FINGERPRINT_DIRECTORY),
+        stack_name)
+
+
+def read_deploy_fingerprint(stack_name):
+    """Return the fingerprint of the last successful deployment of a stack
+
+    Returns None when no deployment was recorded.
+    """
+    try:
+        with open(_deploy_fingerprint_path(stack_name)) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def write_deploy_fingerprint(stack_name, fingerprint):
+    """Record the fingerprint of a successful deployment of a stack"""
+    path = _deploy_fingerprint_path(stack_name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(fingerprint)
+
+
+def remove_deploy_fingerprint(stack_name):
+    """Forget the fingerprint of the last deployment of a stack"""
+    path = _deploy_fingerprint_path(stack_name)
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def positive_int(value):
+    """Parse a command line option which must be an integer above 0"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < 1:
+        raise argparse.ArgumentTypeError(
+            _('%s is not a positive integer') % value)
+    return number
+
+
 def ensure_run_as_normal_user():
     """Check if the command runs under normal user (EUID!=0)"""
     if os.geteuid() == 0:
@@ -440,15 +813,97 @@ def node_add_capabilities(bm_client, node, **updated):
     return caps
 
 
+class ProfileIndex(object):
+    """The nodes available for deployment, indexed for profile matching
+
+    The nodes are indexed once by their profile and, for the available
+    nodes without a profile, by the <profile>_profile capabilities which
+    make them candidates for a profile, rather than scanning all the nodes
+    for every flavor. The nodes are kept in UUID order, so that the same
+    nodes are picked every time.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = {}
+        self.capabilities = {}
+        # Nodes not yet picked for a flavor
+        self.free = set()
+        self._by_profile = collections.defaultdict(list)
+        self._by_capability = collections.defaultdict(list)
+        for node in sorted(nodes, key=lambda n: n.uuid):
+            caps = node_get_capabilities(node)
+            self.nodes[node.uuid] = node
+            self.capabilities[node.uuid] = caps
+            self.free.add(node.uuid)
+            profile = caps.get('profile')
+            self._by_profile[profile].append(node.uuid)
+            # do not assign profiles for active nodes
+            if not profile and node.provision_state == 'available':
+                for key, value in caps.items():
+                    if key.endswith('_profile') and \
+                            value.lower() in ('1', 'true'):
+                        self._by_capability[key].append(node.uuid)
+
+    def _take(self, uuids, count=None):
+        taken = []
+        for uu in uuids:
+            if count is not None and len(taken) >= count:
+                break
+            if uu in self.free:
+                taken.append(uu)
+        self.free.difference_update(taken)
+        return taken
+
+    def take_profile(self, profile):
+        """Take the free nodes with a profile"""
+        return self._take(self._by_profile.get(profile, ()))
+
+    def take_candidates(self, profile, count):
+        """Take up to count free nodes which can be given a profile
+
+        These are the nodes without a profile and with their XXX_profile
+        capability set, by ironic-inspector or manually.
+        """
+        return self._take(self._by_capability.get('%s_profile' % profile,
+                                                  ()), count)
+
+    def free_without_profile(self):
+        """Return the free nodes without a profile"""
+        return [uu for profile in (None, '')
+                for uu in self._by_profile.get(profile, ())
+                if uu in self.free]
+
+
+def _add_profiles(bm_client, updates, max_concurrency):
+    """Set the profile of nodes, up to max_concurrency at once
+
+    :param updates: list of (node, profile)
+    """
+    with futures.ThreadPoolExecutor(
+            max_workers=max(1, min(max_concurrency,
+                                   len(updates)))) as executor:
+        # Raises the first error, once all the updates were tried
+        list(executor.map(
+            lambda update: node_add_capabilities(bm_client, update[0],
+                                                 profile=update[1]),
+            updates))
+
+
 def assign_and_verify_profiles(bm_client, flavors,
-                               assign_profiles=False, dry_run=False):
+                               assign_profiles=False, dry_run=False,
+                               cache=None, max_concurrency=10):
     """Assign and verify profiles for given flavors.
 
+    The flavors are processed in name order and the nodes in UUID order.
+
     :param bm_client: ironic client instance
     :param flavors: map flavor name -> (flavor object, required count)
     :param assign_profiles: whether to allow assigning profiles to nodes
     :param dry_run: whether to skip applying actual changes (only makes sense
                     if assign_profiles is True)
+    :param cache: snapshot of the nodes to use rather than listing them, it
+                  is invalidated when profiles are assigned
+    :param max_concurrency: how many nodes to update at once
     :returns: tuple (errors count, warnings count)
     """
     log = logging.getLogger(__name__ + ".assign_and_verify_profiles")
@@ -456,18 +911,18 @@ def assign_and_verify_profiles(bm_client, flavors,
     predeploy_warnings = 0
 
     # nodes available for deployment and scaling (including active)
-    bm_nodes = {node.uuid: node
-                for node in bm_client.node.list(maintenance=False,
-                                                detail=True)
-                if node.provision_state in ('available', 'active')}
-    # create a pool of unprocessed nodes and record their capabilities
-    free_node_caps = {uu: node_get_capabilities(node)
-                      for uu, node in bm_nodes.items()}
+    index = ProfileIndex(
+        node for node in list_nodes(bm_client,
+                                    fields=PROFILE_NODE_FIELDS,
+                                    maintenance=False, cache=cache)
+        if node.provision_state in ('available', 'active'))
+    updates = []
 
     # TODO(dtantsur): use command-line arguments to specify the order in
     # which profiles are processed (might matter for assigning profiles)
     profile_flavor_used = False
-    for flavor_name, (flavor, scale) in flavors.items():
+    for flavor_name in sorted(flavors):
+        flavor, scale = flavors[flavor_name]
         if not scale:
             log.debug("Skipping verification of flavor %s because "
                       "none will be deployed", flavor_name)
@@ -488,9 +943,9 @@ def assign_and_verify_profiles(bm_client, flavors,
 
         profile_flavor_used = True
 
-        # first collect nodes with known profiles
-        assigned_nodes = [uu for uu, caps in free_node_caps.items()
-                          if caps.get('profile') == profile]
+        # first collect nodes with known profiles, the nodes taken are not
+        # reused for other profiles
+        assigned_nodes = index.take_profile(profile)
         required_count = scale - len(assigned_nodes)
 
         if required_count < 0:
@@ -499,29 +954,16 @@ def assign_and_verify_profiles(bm_client, flavors,
             predeploy_warnings += 1
             required_count = 0
         elif required_count > 0 and assign_profiles:
-            # find more nodes by checking XXX_profile capabilities that are
-            # set by ironic-inspector or manually
-            capability = '%s_profile' % profile
-            more_nodes = [
-                uu for uu, caps in free_node_caps.items()
-                # use only nodes without a know profile
-                if not caps.get('profile') and
-                caps.get(capability, '').lower() in ('1', 'true') and
-                # do not assign profiles for active nodes
-                bm_nodes[uu].provision_state == 'available'
-            ][:required_count]
+            more_nodes = index.take_candidates(profile, required_count)
             assigned_nodes.extend(more_nodes)
             required_count -= len(more_nodes)
 
         for uu in assigned_nodes:
-            # make sure these nodes are not reused for other profiles
-            node_caps = free_node_caps.pop(uu)
             # save profile for newly assigned nodes, but only if we
             # succeeded in finding enough of them
-            if not required_count and not node_caps.get('profile'):
-                node = bm_nodes[uu]
-                if not dry_run:
-                    node_add_capabilities(bm_client, node, profile=profile)
+            if not required_count and \
+                    not index.capabilities[uu].get('profile'):
+                updates.append((index.nodes[uu], profile))
                 log.info('Node %s was assigned profile %s', uu, profile)
             else:
                 log.debug('Node %s has profile %s', uu, profile)
@@ -538,8 +980,14 @@ def assign_and_verify_profiles(bm_client, flavors,
                 "boot_option:local", profile)
             predeploy_errors += 1
 
-    nodes_without_profile = [uu for uu, caps in free_node_caps.items()
-                             if not caps.get('profile')]
+    if updates and not dry_run:
+        try:
+            _add_profiles(bm_client, updates, max_concurrency)
+        finally:
+            if cache is not None:
+                cache.invalidate()
+
+    nodes_without_profile = index.free_without_profile()
     if nodes_without_profile and profile_flavor_used:
         predeploy_warnings += 1
         log.warning(
@@ -618,17 +1066,15 @@ def get_roles_info(parsed_args):
     }
 
 
-def _csv_to_nodes_dict(nodes_csv):
-    """Convert CSV to a list of dicts formatted for os_cloud_config
+def _iter_csv_nodes(nodes_csv):
+    """Yield the nodes of a CSV file formatted for os_cloud_config
 
-    Given a CSV file in the format below, convert it into the
+    Given a CSV file in the format below, convert each row into the
     structure expected by os_cloud_config JSON files.
 
     pm_type, pm_addr, pm_user, pm_password, mac
     """
 
-    data = []
-
     for row in csv.reader(nodes_csv):
         node = {
             "pm_user": row[2],
@@ -645,9 +1091,189 @@ def _csv_to_nodes_dict(nodes_csv):
         except IndexError:
             pass
 
-        data.append(node)
+        yield node
+
+
+def _csv_to_nodes_dict(nodes_csv):
+    """Convert CSV to a list of dicts formatted for os_cloud_config"""
+    return list(_iter_csv_nodes(nodes_csv))
+
+
+class _JSONNodeStream(object):
+    """Decode the nodes of a JSON file one at a time
+
+    The file is read in chunks and each node is decoded as soon as it was
+    read, so a very large inventory is never held in memory at once and its
+    first nodes are available before the rest of the file is read. The
+    nodes are the items of the "nodes" list of the top level object, or of
+    the top level list.
+    """
 
-    return data
+    chunk_size = 64 * 1024
+    whitespace = ' \t\r\n'
+
+    def __init__(self, env_file):
+        self._file = env_file
+        self._decoder = simplejson.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read another chunk, return False at the end of the file"""
+        if self._eof:
+            return False
+        data = self._file.read(self.chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while (self._pos < len(self._buffer) and
+                    self._buffer[self._pos] in self.whitespace):
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return self._buffer[self._pos:self._pos + 1]
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Expected '%s' at '%s'" % (
+                char, self._buffer[self._pos:self._pos + 20]))
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next
+            # chunk
+            if end < len(self._buffer) or not self._fill():
+                self._pos = end
+                return value
+
+    def _items(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() == ']':
+                self._pos += 1
+                return
+            self._expect(',')
+
+    def nodes(self):
+        char = self._peek()
+        if char == '[':
+            for node in self._items():
+                yield node
+            return
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'nodes' and self._peek() == '[':
+                for node in self._items():
+                    yield node
+            else:
+                self._value()
+            if self._peek() == '}':
+                return
+            self._expect(',')
+
+
+def validate_node(node):
+    """Return why a node of an inventory is invalid, None if it's valid"""
+    if not isinstance(node, dict):
+        return _("not a mapping")
+    if not node.get('pm_type'):
+        return _("pm_type is missing")
+    for key in ('pm_type', 'pm_addr', 'pm_user', 'pm_password', 'name',
+                'arch'):
+        if key in node and not isinstance(node[key], six.string_types):
+            return _("%s must be a string") % key
+    mac = node.get('mac', [])
+    if not isinstance(mac, list) or not all(
+            isinstance(m, six.string_types) for m in mac):
+        return _("mac must be a list of addresses")
+    ports = node.get('ports', [])
+    if not isinstance(ports, list) or not all(
+            isinstance(p, dict) and p.get('address') for p in ports):
+        return _("ports must be a list of mappings with an address")
+    for key in ('cpu', 'memory', 'disk'):
+        if key in node and not str(node[key]).isdigit():
+            return _("%s must be a number") % key
+    return None
+
+
+def iter_env_file(env_file, file_type=None, errors=None, validate=False):
+    """Yield the nodes of a JSON, YAML or CSV inventory
+
+    JSON and CSV files are read incrementally, so the first nodes can be
+    used, and the first invalid one reported, before the whole file was
+    read.
+
+    :param env_file: The open inventory file
+    :param file_type: json or csv, found from the file extension if None
+
+    :param errors: Invalid nodes raise InvalidConfiguration when None,
+                   otherwise their errors are appended to this list and
+                   they are skipped
+    :type  errors: list
+
+    :param validate: Whether to check each node with validate_node, which
+                     is stricter than the import commands
+
+    :raises exceptions.InvalidConfiguration: when the file can't be parsed
+    """
+    name = getattr(env_file, 'name', '')
+    if file_type == 'json' or name.endswith('.json'):
+        nodes = _JSONNodeStream(env_file).nodes()
+    elif file_type == 'csv' or name.endswith('.csv'):
+        nodes = _iter_csv_nodes(env_file)
+    elif name.endswith('.yaml'):
+        nodes_config = yaml.safe_load(env_file) or []
+        if 'nodes' in nodes_config:
+            nodes_config = nodes_config['nodes']
+        nodes = iter(nodes_config)
+    else:
+        raise exceptions.InvalidConfiguration(
+            _("Invalid file extension for %s, must be json, yaml or csv") %
+            name)
+
+    index = 0
+    while True:
+        try:
+            node = next(nodes)
+        except StopIteration:
+            return
+        except (ValueError, IndexError, csv.Error) as e:
+            raise exceptions.InvalidConfiguration(
+                _("Unable to parse %(name)s after %(count)d nodes: "
+                  "%(error)s") % {'name': name, 'count': index, 'error': e})
+        error = validate_node(node) if validate else None
+        if error is not None:
+            message = _("Node %(index)d of %(name)s is invalid: "
+                        "%(error)s") % {'index': index, 'name': name,
+                                        'error': error}
+            if errors is None:
+                raise exceptions.InvalidConfiguration(message)
+            errors.append(message)
+        else:
+            yield node
+        index += 1
 
 
 def parse_env_file(env_file, file_type=None):
@@ -712,8 +1338,8 @@ def replace_links_in_template_contents(contents, link_replacement):
     file paths according to link_replacement dict. (Key/value in
     link_replacement are from/to, respectively.)
 
-    If the string contents don't look like a Heat template, return the
-    contents unmodified.
+    If the string contents don't look like a Heat template, or contain no
+    link to replace, return the contents unmodified.
     """
 
     template = {}
@@ -726,9 +1352,12 @@ def replace_links_in_template_contents(contents, link_replacement):
             template.get('heat_template_version')):
         return contents
 
-    template = replace_links_in_template(template, link_replacement)
+    replaced = replace_links_in_template(template, link_replacement)
+    if replaced is template:
+        # Nothing to replace, avoid a needless re-serialization
+        return contents
 
-    return yaml.safe_dump(template)
+    return yaml.safe_dump(replaced)
 
 
 def replace_links_in_template(template_part, link_replacement):
@@ -737,6 +1366,10 @@ def replace_links_in_template(template_part, link_replacement):
     Scan the template for 'get_file' and 'type' occurences, and
     replace the file paths according to link_replacement
     dict. (Key/value in link_replacement are from/to, respectively.)
+
+    The template is not modified in place. Only the dicts and lists on the
+    path to a replaced link are copied, any part of the template which
+    contains no link to replace is returned as the very same object.
     """
 
     def replaced_dict_value(key, value):
@@ -746,14 +1379,24 @@ def replace_links_in_template(template_part, link_replacement):
         else:
             return replace_links_in_template(value, link_replacement)
 
-    def replaced_list_value(value):
-        return replace_links_in_template(value, link_replacement)
-
     if isinstance(template_part, dict):
-        return {k: replaced_dict_value(k, v)
-                for k, v in six.iteritems(template_part)}
+        replaced = None
+        for k, v in six.iteritems(template_part):
+            new_v = replaced_dict_value(k, v)
+            if new_v is not v:
+                if replaced is None:
+                    replaced = dict(template_part)
+                replaced[k] = new_v
+        return template_part if replaced is None else replaced
     elif isinstance(template_part, list):
-        return map(replaced_list_value, template_part)
+        replaced = None
+        for i, v in enumerate(template_part):
+            new_v = replace_links_in_template(v, link_replacement)
+            if new_v is not v:
+                if replaced is None:
+                    replaced = list(template_part)
+                replaced[i] = new_v
+        return template_part if replaced is None else replaced
     else:
         return template_part
 
@@ -16,7 +16,9 @@
 from __future__ import print_function
 
 import argparse
+from concurrent import futures
 import logging
+import os
 import simplejson
 import time
 import uuid
@@ -24,9 +26,12 @@ import uuid
 import ironic_inspector_client
 from osc_lib.command import command
 from osc_lib.i18n import _
+from prettytable import PrettyTable
 
+from tripleoclient import constants
 from tripleoclient import exceptions
 from tripleoclient import utils
+from tripleoclient import waiting
 from tripleoclient.workflows import baremetal
 
 
@@ -42,59 +47,115 @@ class ValidateInstackEnv(command.Command):
             '-f', '--file', dest='instackenv',
             help=_("Path to the instackenv.json file."),
             default='instackenv.json')
+        parser.add_argument(
+            '--max-workers', type=utils.positive_int, default=16,
+            help=_("How many BMCs to check at once. (default: "
+                   "%(default)s)"))
+        parser.add_argument(
+            '--bmc-timeout', type=int, default=30,
+            help=_("Seconds after which a BMC check fails. (default: "
+                   "%(default)s)"))
+        parser.add_argument(
+            '--ipmitool', default='ipmitool',
+            help=argparse.SUPPRESS)
         return parser
 
+    def _check_node(self, node, maclist, baremetal_ips, checks, executor,
+                    parsed_args):
+        self.log.info("Checking node %s" % node['pm_addr'])
+
+        credentials = True
+        try:
+            if len(node['pm_password']) == 0:
+                self.log.error('ERROR: Password 0 length.')
+                self.error_count += 1
+        except Exception as e:
+            self.log.error('ERROR: Password does not exist: %s', e)
+            self.error_count += 1
+            credentials = False
+        try:
+            if len(node['pm_user']) == 0:
+                self.log.error('ERROR: User 0 length.')
+                self.error_count += 1
+        except Exception as e:
+            self.log.error('ERROR: User does not exist: %s', e)
+            self.error_count += 1
+            credentials = False
+        try:
+            if len(node['mac']) == 0:
+                self.log.error('ERROR: MAC address 0 length.')
+                self.error_count += 1
+            maclist.extend(node['mac'])
+        except Exception as e:
+            self.log.error('ERROR: MAC address does not exist: %s', e)
+            self.error_count += 1
+
+        if node['pm_type'] == "pxe_ssh":
+            self.log.debug("Identified virtual node")
+
+        if node['pm_type'] == "pxe_ipmitool":
+            self.log.debug("Identified baremetal node")
+            # The missing credentials were already reported
+            if credentials:
+                checks.append(executor.submit(self._check_bmc, node,
+                                              parsed_args))
+            baremetal_ips.append(node['pm_addr'])
+
+    def _check_bmc(self, node, parsed_args):
+        """Check the BMC of an IPMI node
+
+        :returns: tuple of the node, the result and its detail
+        """
+        status, output = utils.check_ipmi_bmc(
+            node['pm_addr'], node['pm_user'], node['pm_password'],
+            timeout=parsed_args.bmc_timeout, ipmitool=parsed_args.ipmitool)
+        if status is None:
+            return node, 'TIMEOUT', 'No answer after %d seconds' % (
+                parsed_args.bmc_timeout)
+        lines = (output or '').strip().splitlines()
+        detail = lines[-1] if lines else ''
+        return node, 'OK' if status == 0 else 'FAILED', detail
+
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
 
         self.error_count = 0
 
-        with open(parsed_args.instackenv, 'r') as net_file:
-            env_data = simplejson.load(net_file)
-
         maclist = []
         baremetal_ips = []
-        for node in env_data['nodes']:
-            self.log.info("Checking node %s" % node['pm_addr'])
-
-            try:
-                if len(node['pm_password']) == 0:
-                    self.log.error('ERROR: Password 0 length.')
-                    self.error_count += 1
-            except Exception as e:
-                self.log.error('ERROR: Password does not exist: %s', e)
-                self.error_count += 1
+        checks = []
+        errors = []
+        # The nodes are read one at a time and the check of each BMC starts
+        # as soon as its node was read.
+        with open(parsed_args.instackenv, 'r') as net_file, \
+                futures.ThreadPoolExecutor(
+                    max_workers=max(1, parsed_args.max_workers)) as executor:
             try:
-                if len(node['pm_user']) == 0:
-                    self.log.error('ERROR: User 0 length.')
-                    self.error_count += 1
-            except Exception as e:
-                self.log.error('ERROR: User does not exist: %s', e)
-                self.error_count += 1
-            try:
-                if len(node['mac']) == 0:
-                    self.log.error('ERROR: MAC address 0 length.')
-                    self.error_count += 1
-                maclist.extend(node['mac'])
-            except Exception as e:
-                self.log.error('ERROR: MAC address does not exist: %s', e)
+                for node in utils.iter_env_file(net_file, 'json',
+                                                errors=errors,
+                                                validate=True):
+                    self._check_node(node, maclist, baremetal_ips, checks,
+                                     executor, parsed_args)
+            except exceptions.InvalidConfiguration as e:
+                self.log.error('ERROR: %s', e)
                 self.error_count += 1
+            results = [check.result() for check in checks]
 
-            if node['pm_type'] == "pxe_ssh":
-                self.log.debug("Identified virtual node")
-
-            if node['pm_type'] == "pxe_ipmitool":
-                self.log.debug("Identified baremetal node")
+        for error in errors:
+            self.log.error('ERROR: %s', error)
+            self.error_count += 1
 
-                cmd = ('ipmitool -R 1 -I lanplus -H %s -U %s -P %s chassis '
-                       'status' % (node['pm_addr'], node['pm_user'],
-                                   node['pm_password']))
-                self.log.debug("Executing: %s", cmd)
-                status = utils.run_shell(cmd)
-                if status != 0:
-                    self.log.error('ERROR: ipmitool failed')
+        if results:
+            table = PrettyTable(['BMC address', 'User', 'Result', 'Detail'])
+            table.align['Detail'] = 'l'
+            for node, result, detail in results:
+                if result != 'OK':
+                    self.log.error('ERROR: ipmitool failed for %s',
+                                   node['pm_addr'])
                     self.error_count += 1
-                baremetal_ips.append(node['pm_addr'])
+                table.add_row([node['pm_addr'], node['pm_user'], result,
+                               detail])
+            print(table)
 
         if not utils.all_unique(baremetal_ips):
             self.log.error('ERROR: Baremetals IPs are not all unique.')
@@ -234,10 +295,15 @@ class StartBaremetalIntrospectionBulk(command.Command):
         self.log.debug("Moving available/enroll nodes to manageable state.")
         available_nodes = utils.nodes_in_states(client, ("available",
                                                          "enroll"))
+        stats = waiting.TransitionStats(
+            os.path.expanduser(constants.TRANSITION_STATS_FILE))
         for node_uuid in utils.set_nodes_state(client, available_nodes,
-                                               'manage', 'manageable'):
+                                               'manage', 'manageable',
+                                               stats=stats):
             self.log.debug(
                 "Node {0} has been set to manageable.".format(node_uuid))
+        stats.save()
+        self.log.debug("Node transition durations:\n%s" % stats.as_table())
 
         print("Starting introspection of manageable nodes")
         baremetal.introspect_manageable_nodes(
@@ -111,13 +111,15 @@ class DownloadConfig(command.Command):
         name = parsed_args.name
         config_dir = parsed_args.config_dir
         self._mkdir(config_dir)
-        stack = utils.get_stack(clients.orchestration, name)
+        stack = utils.get_stack(clients.orchestration, name,
+                                resolve_outputs=False)
         tmp_path = tempfile.mkdtemp(prefix='tripleo-',
                                     suffix='-config',
                                     dir=config_dir)
         self.log.info("Generating configuration under the directory: "
                       "%s" % tmp_path)
-        role_data = utils.get_role_data(stack)
+        outputs = utils.StackOutputs(stack)
+        role_data = utils.get_role_data(outputs)
         for role_name, role in six.iteritems(role_data):
             role_path = os.path.join(tmp_path, role_name)
             self._mkdir(role_path)
@@ -146,7 +148,7 @@ class DownloadConfig(command.Command):
                         yaml.safe_dump(data,
                                        conf_file,
                                        default_flow_style=False)
-        role_config = utils.get_role_config(stack)
+        role_config = utils.get_role_config(outputs)
         for config_name, config in six.iteritems(role_config):
             conf_path = os.path.join(tmp_path, config_name + ".yaml")
             with self._open_file(conf_path) as conf_file:
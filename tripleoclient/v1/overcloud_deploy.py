@@ -15,7 +15,10 @@
 from __future__ import print_function
 
 import argparse
+from concurrent import futures
 import glob
+import hashlib
+import json
 import logging
 import os
 import os.path
@@ -35,7 +38,10 @@ from swiftclient.exceptions import ClientException
 from tripleo_common import update
 
 from tripleoclient import constants
+from tripleoclient import environment
 from tripleoclient import exceptions
+from tripleoclient import stack_events
+from tripleoclient import timing
 from tripleoclient import utils
 from tripleoclient.workflows import deployment
 from tripleoclient.workflows import parameters as workflow_params
@@ -43,6 +49,30 @@ from tripleoclient.workflows import plan_management
 from tripleoclient.workflows import validations
 
 
+# The parameters set by the client depending on whether the stack is created
+# or updated, rather than on the inputs of the deployment
+PER_ACTION_PARAMETERS = ('StackAction', 'UpdateIdentifier',
+                         'NovaComputeLibvirtType')
+
+
+def _without(env, removed):
+    """Return a copy of env without the values found in removed
+
+    Dictionaries are compared key by key, and those left empty are removed.
+    """
+    result = {}
+    for key, value in env.items():
+        if key not in removed:
+            result[key] = value
+        elif isinstance(value, dict) and isinstance(removed[key], dict):
+            value = _without(value, removed[key])
+            if value:
+                result[key] = value
+        elif value != removed[key]:
+            result[key] = value
+    return result
+
+
 class DeployOvercloud(command.Command):
     """Deploy Overcloud"""
 
@@ -50,6 +80,8 @@ class DeployOvercloud(command.Command):
     predeploy_errors = 0
     predeploy_warnings = 0
     _password_cache = None
+    _pending_validations = None
+    timer = None
 
     def _setup_clients(self, parsed_args):
         self.clients = self.app.client_manager
@@ -60,6 +92,23 @@ class DeployOvercloud(command.Command):
             self.compute_client = self.clients.compute
             self.baremetal_client = self.clients.baremetal
 
+    def _stage(self, name):
+        """Time a stage of the deployment for the timing report"""
+        if self.timer is None:
+            self.timer = timing.StageTimer()
+        return self.timer.stage(name)
+
+    def _report_timing(self, parsed_args):
+        if self.timer is None or not self.timer.stages:
+            return
+        print("Deployment stage timings:")
+        print(self.timer.as_table())
+        if parsed_args.timing_report:
+            self.timer.write_json(parsed_args.timing_report,
+                                  stack=parsed_args.stack)
+            self.log.info("Timing report written to %s"
+                          % parsed_args.timing_report)
+
     def _update_parameters(self, args, stack):
         parameters = {}
 
@@ -167,7 +216,6 @@ class DeployOvercloud(command.Command):
             swift_path = "user-environments/{}".format(abs_env_path[1:])
         else:
             swift_path = "user-environments/{}".format(abs_env_path)
-        contents = yaml.safe_dump(env_map, default_flow_style=False)
         self.log.debug("Uploading %s to swift at %s"
                        % (abs_env_path, swift_path))
         self.object_client.put_object(container_name, swift_path, contents)
@@ -177,7 +225,7 @@ class DeployOvercloud(command.Command):
     def _process_multiple_environments(self, created_env_files, tht_root,
                                        user_tht_root, cleanup=True):
         env_files = {}
-        localenv = {}
+        localenv = environment.LayeredEnvironment()
         for env_path in created_env_files:
             self.log.debug("Processing environment files %s" % env_path)
             abs_env_path = os.path.abspath(env_path)
@@ -236,9 +284,9 @@ class DeployOvercloud(command.Command):
                 self.log.debug("Adding files %s for %s" % (files, env_path))
                 env_files.update(files)
 
-            # 'env' can be a deeply nested dictionary, so a simple update is
-            # not enough
-            localenv = template_utils.deep_update(localenv, env)
+            # The environments are only merged once all of them are known,
+            # see _deploy_tripleo_heat_templates
+            localenv.add(env, abs_env_path)
         return env_files, localenv
 
     def _heat_deploy(self, stack, stack_name, template_path, parameters,
@@ -259,34 +307,45 @@ class DeployOvercloud(command.Command):
             obj = self.object_client.get_object(stack_name, object_path)
             return obj and obj[1]
 
-        template_files, template = template_utils.get_template_contents(
-            template_object=plan_yaml_path,
-            object_request=do_object_request)
+        with self._stage('Fetch plan template'):
+            template_files, template = template_utils.get_template_contents(
+                template_object=plan_yaml_path,
+                object_request=do_object_request)
 
         files = dict(list(template_files.items()) + list(env_files.items()))
 
-        moved_files = self._upload_missing_files(
-            stack_name, files, tht_root)
-        self._process_and_upload_environment(
-            stack_name, env, moved_files, tht_root)
+        with self._stage('Upload missing files'):
+            moved_files = self._upload_missing_files(
+                stack_name, files, tht_root)
+        with self._stage('Upload environment'):
+            self._process_and_upload_environment(
+                stack_name, env, moved_files, tht_root)
 
         # Invokes the workflows specified in plan environment file
         if plan_env_file:
-            workflow_params.invoke_plan_env_workflows(self.clients,
-                                                      stack_name,
-                                                      plan_env_file)
+            with self._stage('Plan environment workflows'):
+                workflow_params.invoke_plan_env_workflows(self.clients,
+                                                          stack_name,
+                                                          plan_env_file)
 
-        workflow_params.check_deprecated_parameters(self.clients, stack_name)
+        with self._stage('Deprecated parameters check'):
+            workflow_params.check_deprecated_parameters(self.clients,
+                                                        stack_name)
+
+        # The validations must have finished before Heat starts
+        self._check_predeploy_validations()
 
         if not update_plan_only:
             print("Deploying templates in the directory {0}".format(
                 os.path.abspath(tht_root)))
-            deployment.deploy_and_wait(
-                self.log, self.clients, stack,
-                stack_name, self.app_args.verbose_level,
-                timeout=timeout,
-                run_validations=run_validations,
-                skip_deploy_identifier=skip_deploy_identifier)
+            with self._stage('Stack create' if stack is None
+                             else 'Stack update'):
+                deployment.deploy_and_wait(
+                    self.log, self.clients, stack,
+                    stack_name, self.app_args.verbose_level,
+                    timeout=timeout,
+                    run_validations=run_validations,
+                    skip_deploy_identifier=skip_deploy_identifier)
 
     def _load_environment_directories(self, directories):
         if os.environ.get('TRIPLEO_ENVIRONMENT_DIRECTORY'):
@@ -302,6 +361,41 @@ class DeployOvercloud(command.Command):
                         environments.append(f)
         return environments
 
+    def _process_environment_directories(self, env_paths, tht_root,
+                                         user_tht_root, cleanup=True):
+        """Process the files found in the environment directories
+
+        Unlike the environment files given on the command line, these rarely
+        change between deployments so they go through the environment
+        directory index, which reuses the result of the previous deployments
+        for the files which didn't change and processes the others
+        concurrently. Files from the templates directory and files heatclient
+        can't process directly use the regular processing.
+        """
+        env_files = {}
+        env_layers = environment.LayeredEnvironment()
+        if not env_paths:
+            return env_files, env_layers
+
+        index = environment.EnvironmentDirectoryIndex(
+            os.path.expanduser(constants.ENV_DIRECTORY_INDEX))
+        processed = index.process(
+            [p for p in env_paths
+             if not os.path.abspath(p).startswith(user_tht_root)])
+        index.save()
+
+        for env_path in env_paths:
+            if env_path in processed:
+                files, env = processed[env_path]
+                env_files.update(files)
+                env_layers.add(env, os.path.abspath(env_path))
+            else:
+                files, env = self._process_multiple_environments(
+                    [env_path], tht_root, user_tht_root, cleanup=cleanup)
+                env_files.update(files)
+                env_layers.extend(env)
+        return env_files, env_layers
+
     def _process_and_upload_environment(self, container_name,
                                         env, moved_files, tht_root):
         """Process the environment and upload to Swift
@@ -330,14 +424,24 @@ class DeployOvercloud(command.Command):
                         path = path[1:]
                     env['resource_registry'][name] = path
 
+        # The plan environment is fetched once, it holds the parameters
+        # currently stored in the plan and the list of its environments.
+        plan_env = yaml.safe_load(self.object_client.get_object(
+            container_name, constants.PLAN_ENVIRONMENT)[1])
+
         # Parameters are removed from the environment and sent to the update
         # parameters action, this stores them in the plan environment and
-        # means the UI can find them.
+        # means the UI can find them. The action replaces each parameter
+        # given, so only the ones which differ from the plan are sent.
+        params = {}
         if 'parameter_defaults' in env:
-            params = env.pop('parameter_defaults')
-            workflow_params.update_parameters(
-                self.workflow_client, container=container_name,
-                parameters=params)
+            current = plan_env.get('parameter_defaults') or {}
+            missing = object()
+            for name, value in six.iteritems(env.pop('parameter_defaults')):
+                if current.get(name, missing) != value:
+                    params[name] = value
+            self.log.debug("%d parameters changed in the plan %s",
+                           len(params), container_name)
 
         contents = yaml.safe_dump(env, default_flow_style=False)
 
@@ -349,16 +453,21 @@ class DeployOvercloud(command.Command):
         swift_path = "user-environment.yaml"
         self.object_client.put_object(container_name, swift_path, contents)
 
-        env = yaml.safe_load(self.object_client.get_object(
-            container_name, constants.PLAN_ENVIRONMENT)[1])
-
+        # This happens before the parameters are updated, as the action
+        # rewrites the plan environment and a copy fetched earlier would
+        # discard the parameters it stored.
         user_env = {'path': swift_path}
-        if user_env not in env['environments']:
-            env['environments'].append(user_env)
-            yaml_string = yaml.safe_dump(env, default_flow_style=False)
+        if user_env not in plan_env['environments']:
+            plan_env['environments'].append(user_env)
+            yaml_string = yaml.safe_dump(plan_env, default_flow_style=False)
             self.object_client.put_object(
                 container_name, constants.PLAN_ENVIRONMENT, yaml_string)
 
+        if params:
+            workflow_params.update_parameters(
+                self.workflow_client, container=container_name,
+                parameters=params)
+
     def _upload_missing_files(self, container_name, files_dict, tht_root):
         """Find the files referenced in custom environments and upload them
 
@@ -421,7 +530,8 @@ class DeployOvercloud(command.Command):
         self.log.debug("Creating temporary templates tree in %s"
                        % new_tht_root)
         try:
-            shutil.copytree(tht_root, new_tht_root, symlinks=True)
+            with self._stage('Copy templates'):
+                shutil.copytree(tht_root, new_tht_root, symlinks=True)
             self._deploy_tripleo_heat_templates(stack, parsed_args,
                                                 new_tht_root, tht_root)
         finally:
@@ -431,68 +541,105 @@ class DeployOvercloud(command.Command):
             else:
                 shutil.rmtree(tht_tmp)
 
-    def _deploy_tripleo_heat_templates(self, stack, parsed_args,
-                                       tht_root, user_tht_root):
-        """Deploy the fixed templates in TripleO Heat Templates"""
-        parameters = self._update_parameters(parsed_args, stack)
-
-        plans = plan_management.list_deployment_plans(self.workflow_client)
-        generate_passwords = not parsed_args.disable_password_generation
-
-        # TODO(d0ugal): We need to put a more robust strategy in place here to
-        #               handle updating plans.
-        if parsed_args.stack in plans:
-            # Upload the new plan templates to swift to replace the existing
-            # templates.
-            plan_management.update_plan_from_templates(
-                self.clients, parsed_args.stack, tht_root,
-                parsed_args.roles_file, generate_passwords,
-                parsed_args.plan_environment_file,
-                parsed_args.networks_file)
-        else:
-            plan_management.create_plan_from_templates(
-                self.clients, parsed_args.stack, tht_root,
-                parsed_args.roles_file, generate_passwords,
-                parsed_args.plan_environment_file,
-                parsed_args.networks_file)
-
-        # Get any missing (e.g j2 rendered) files from the plan to tht_root
-        self._download_missing_files_from_plan(
-            tht_root, parsed_args.stack)
-
-        print("Processing templates in the directory {0}".format(
-            os.path.abspath(tht_root)))
+    def _build_environment(self, stack, parsed_args, parameters, tht_root,
+                           user_tht_root):
+        """Create the user environments and merge all the environments
 
+        :returns: tuple of the files referenced by the environments and the
+                  merged environment
+        """
         self.log.debug("Creating Environment files")
-        env = {}
+        env_layers = environment.LayeredEnvironment()
         created_env_files = []
+        env_dir_files = []
 
         if parsed_args.environment_directories:
-            created_env_files.extend(self._load_environment_directories(
-                parsed_args.environment_directories))
+            env_dir_files = self._load_environment_directories(
+                parsed_args.environment_directories)
 
-        env.update(self._create_parameters_env(parameters,
-                                               tht_root,
-                                               parsed_args.stack))
+        env_layers.add(self._create_parameters_env(parameters,
+                                                   tht_root,
+                                                   parsed_args.stack),
+                       'user-environments/tripleoclient-parameters.yaml')
 
         if parsed_args.rhel_reg:
             reg_env_files, reg_env = self._create_registration_env(
                 parsed_args, tht_root)
             created_env_files.extend(reg_env_files)
-            template_utils.deep_update(env, reg_env)
+            env_layers.add(
+                reg_env,
+                'user-environments/tripleoclient-registration-parameters.yaml')
         if parsed_args.environment_files:
             created_env_files.extend(parsed_args.environment_files)
 
+        env_files, dir_env = self._process_environment_directories(
+            env_dir_files, tht_root, user_tht_root,
+            cleanup=not parsed_args.no_cleanup)
+        env_layers.extend(dir_env)
+
         self.log.debug("Processing environment files %s" % created_env_files)
-        env_files, localenv = self._process_multiple_environments(
+        files, localenv = self._process_multiple_environments(
             created_env_files, tht_root, user_tht_root,
             cleanup=not parsed_args.no_cleanup)
-        template_utils.deep_update(env, localenv)
+        env_files.update(files)
+        env_layers.extend(localenv)
 
         if stack:
             bp_cleanup = self._create_breakpoint_cleanup_env(
                 tht_root, parsed_args.stack)
-            template_utils.deep_update(env, bp_cleanup)
+            env_layers.add(
+                bp_cleanup,
+                'user-environments/tripleoclient-breakpoint-cleanup.yaml')
+
+        # All the environments are known now, merge them in one go
+        env = env_layers.merge()
+        for param in sorted(env.get('parameter_defaults', {})):
+            self.log.debug("Parameter %s set by %s"
+                           % (param, env_layers.source_of(param)))
+        return env_files, env
+
+    def _deploy_tripleo_heat_templates(self, stack, parsed_args,
+                                       tht_root, user_tht_root):
+        """Deploy the fixed templates in TripleO Heat Templates"""
+        parameters = self._update_parameters(parsed_args, stack)
+
+        # Don't change the plan if the validations may stop the deployment
+        if self._validations_can_fail(parsed_args):
+            self._check_predeploy_validations()
+
+        with self._stage('Plan create/update'):
+            plans = plan_management.list_deployment_plans(
+                self.workflow_client)
+            generate_passwords = not parsed_args.disable_password_generation
+
+            # TODO(d0ugal): We need to put a more robust strategy in place
+            #               here to handle updating plans.
+            if parsed_args.stack in plans:
+                # Upload the new plan templates to swift to replace the
+                # existing templates.
+                plan_management.update_plan_from_templates(
+                    self.clients, parsed_args.stack, tht_root,
+                    parsed_args.roles_file, generate_passwords,
+                    parsed_args.plan_environment_file,
+                    parsed_args.networks_file)
+            else:
+                plan_management.create_plan_from_templates(
+                    self.clients, parsed_args.stack, tht_root,
+                    parsed_args.roles_file, generate_passwords,
+                    parsed_args.plan_environment_file,
+                    parsed_args.networks_file)
+
+        with self._stage('Download rendered templates'):
+            # Get any missing (e.g j2 rendered) files from the plan to tht_root
+            self._download_missing_files_from_plan(
+                tht_root, parsed_args.stack)
+
+        print("Processing templates in the directory {0}".format(
+            os.path.abspath(tht_root)))
+
+        with self._stage('Process environments'):
+            env_files, env = self._build_environment(
+                stack, parsed_args, parameters, tht_root, user_tht_root)
 
         # FIXME(shardy) It'd be better to validate this via mistral
         # e.g part of the plan create/update workflow
@@ -504,12 +651,91 @@ class DeployOvercloud(command.Command):
                     'environments when using multiple controllers '
                     '(with HA).')
 
+        # The environments need the templates rendered by the plan, so the
+        # inputs can only be compared once it is updated. An unchanged
+        # deployment still uploads the whole plan and only skips Heat.
+        fingerprint = None
+        update_plan_only = parsed_args.update_plan_only
+        if parsed_args.skip_if_unchanged:
+            with self._stage('Fingerprint inputs'):
+                fingerprint = self._deploy_fingerprint(
+                    parsed_args, parameters, env, env_files, tht_root,
+                    user_tht_root)
+            if self._deployment_unchanged(stack, parsed_args.stack,
+                                          fingerprint):
+                print("The inputs of stack {0} didn't change since its last "
+                      "successful deployment, skipping the stack "
+                      "update.".format(parsed_args.stack))
+                update_plan_only = True
+
+        if not update_plan_only:
+            # The stack is about to change, the recorded inputs are stale
+            utils.remove_deploy_fingerprint(parsed_args.stack)
+
         self._try_overcloud_deploy_with_compat_yaml(
             tht_root, stack, parsed_args.stack, parameters, env_files,
-            parsed_args.timeout, env, parsed_args.update_plan_only,
+            parsed_args.timeout, env, update_plan_only,
             parsed_args.run_validations, parsed_args.skip_deploy_identifier,
             parsed_args.plan_environment_file)
 
+        if fingerprint is not None and not update_plan_only:
+            utils.write_deploy_fingerprint(parsed_args.stack, fingerprint)
+
+    def _deploy_fingerprint(self, parsed_args, parameters, env, env_files,
+                            tht_root, user_tht_root):
+        """Fingerprint the effective inputs of a deployment
+
+        The fingerprint covers the templates, the roles, networks and plan
+        environment files, the merged environment with the files it
+        references and the command line parameters and options.
+
+        The parameters and the breakpoint cleanup which depend on whether
+        the stack is created or updated are left out, so that the
+        fingerprint of a stack creation matches its next update.
+        """
+        per_action = {param: parameters[param]
+                      for param in PER_ACTION_PARAMETERS
+                      if param in parameters}
+        parameters = {param: value for param, value in parameters.items()
+                      if param not in per_action}
+        breakpoint_cleanup = {}
+        update.add_breakpoints_cleanup_into_env(breakpoint_cleanup)
+        breakpoint_cleanup['parameter_defaults'] = per_action
+        env = _without(env, breakpoint_cleanup)
+
+        def checksum(path):
+            if path and os.path.isfile(path):
+                return utils.file_checksum(path)
+            return path
+
+        inputs = {
+            'templates': utils.tree_checksum(user_tht_root),
+            'roles_file': checksum(parsed_args.roles_file),
+            'networks_file': checksum(parsed_args.networks_file),
+            'plan_environment_file': checksum(
+                parsed_args.plan_environment_file),
+            'parameters': parameters,
+            'environment': env,
+            'files': env_files,
+            'options': {
+                'disable_password_generation':
+                    parsed_args.disable_password_generation,
+                'run_validations': parsed_args.run_validations,
+                'skip_deploy_identifier': parsed_args.skip_deploy_identifier,
+                'timeout': parsed_args.timeout,
+            },
+        }
+        contents = json.dumps(inputs, sort_keys=True, default=str)
+        # tht_root is a new temporary directory for every deployment
+        contents = contents.replace(tht_root, '<templates>')
+        return hashlib.sha256(contents.encode('utf-8')).hexdigest()
+
+    def _deployment_unchanged(self, stack, stack_name, fingerprint):
+        if stack is None or stack.stack_status not in ('CREATE_COMPLETE',
+                                                       'UPDATE_COMPLETE'):
+            return False
+        return utils.read_deploy_fingerprint(stack_name) == fingerprint
+
     def _try_overcloud_deploy_with_compat_yaml(self, tht_root, stack,
                                                stack_name, parameters,
                                                env_files, timeout,
@@ -576,7 +802,8 @@ class DeployOvercloud(command.Command):
     def _deploy_postconfig(self, stack, parsed_args):
         self.log.debug("_deploy_postconfig(%s)" % parsed_args)
 
-        overcloud_endpoint = utils.get_overcloud_endpoint(stack)
+        outputs = utils.StackOutputs.of(stack)
+        overcloud_endpoint = utils.get_overcloud_endpoint(outputs)
         # NOTE(jaosorior): The overcloud endpoint can contain an IP address or
         # an FQDN depending on how what it's configured to output in the
         # tripleo-heat-templates. Such a configuration can be done by
@@ -584,7 +811,7 @@ class DeployOvercloud(command.Command):
         overcloud_ip_or_fqdn = six.moves.urllib.parse.urlparse(
             overcloud_endpoint).hostname
 
-        keystone_admin_ip = utils.get_endpoint('KeystoneAdmin', stack)
+        keystone_admin_ip = utils.get_endpoint('KeystoneAdmin', outputs)
         no_proxy = os.environ.get('no_proxy', overcloud_ip_or_fqdn)
         no_proxy_list = map(utils.bracket_ipv6,
                             [no_proxy, overcloud_ip_or_fqdn,
@@ -690,6 +917,50 @@ class DeployOvercloud(command.Command):
 
         return default_role_counts
 
+    def _run_predeploy_validations(self, stack, parameters, parsed_args):
+        with self._stage('Pre-deploy validations'):
+            return self._predeploy_verify_capabilities(
+                stack, parameters, parsed_args)
+
+    def _validations_can_fail(self, parsed_args):
+        return (parsed_args.validation_errors_fatal or
+                parsed_args.validation_warnings_fatal)
+
+    def _check_predeploy_validations(self):
+        """Wait for the pre-deploy validations and check their result
+
+        This does nothing if the validations are disabled or if their result
+        was already checked.
+
+        :raises exceptions.InvalidConfiguration: if the validations found
+                                                 errors or warnings which are
+                                                 configured to be fatal
+        """
+        pending, self._pending_validations = self._pending_validations, None
+        if pending is None:
+            return
+        result, parsed_args = pending
+        errors, warnings = result.result()
+        if errors > 0:
+            self.log.error(
+                "Configuration has %d errors, fix them before "
+                "proceeding. Ignoring these errors is likely to lead to "
+                "a failed deploy.",
+                errors)
+            if parsed_args.validation_warnings_fatal or \
+                    parsed_args.validation_errors_fatal:
+                raise exceptions.InvalidConfiguration()
+        if warnings > 0:
+            self.log.error(
+                "Configuration has %d warnings, fix them before "
+                "proceeding.",
+                warnings)
+            if parsed_args.validation_warnings_fatal:
+                raise exceptions.InvalidConfiguration()
+        else:
+            self.log.info("SUCCESS: No warnings or errors in deploy "
+                          "configuration, proceeding.")
+
     def _predeploy_verify_capabilities(self, stack, parameters, parsed_args):
         self.predeploy_errors = 0
         self.predeploy_warnings = 0
@@ -852,6 +1123,16 @@ class DeployOvercloud(command.Command):
                    'that the software configuration does not need to be '
                    'run, such as when scaling out certain roles.')
         )
+        parser.add_argument(
+            '--skip-if-unchanged',
+            action='store_true',
+            default=False,
+            help=_('Skip the stack update when the templates, '
+                   'environments and parameters are identical to the last '
+                   'successful deployment of the stack done from this '
+                   'machine with this option, and the stack is in a '
+                   'COMPLETE state. The plan is still updated.')
+        )
         reg_group = parser.add_argument_group('Registration Parameters')
         reg_group.add_argument(
             '--rhel-reg',
@@ -895,6 +1176,20 @@ class DeployOvercloud(command.Command):
             default=False,
             help=_('Disable password generation.')
         )
+        parser.add_argument(
+            '--timing-report',
+            metavar='<FILE>',
+            help=_('Write the duration of each deployment stage to FILE as '
+                   'JSON. A summary table is always printed at the end of '
+                   'the deployment.')
+        )
+        parser.add_argument(
+            '--event-log',
+            metavar='<FILE>',
+            help=_('Append the stack events and workflow messages received '
+                   'during the deployment to FILE, a compressed log which can '
+                   'be analysed with "openstack overcloud deploy timeline".')
+        )
         parser.add_argument(
             '--deployed-server',
             action='store_true',
@@ -909,6 +1204,16 @@ class DeployOvercloud(command.Command):
 
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
+        self.timer = timing.StageTimer()
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            with stack_events.recording(parsed_args.event_log):
+                self._deploy_overcloud(parsed_args)
+        finally:
+            self._executor.shutdown(wait=False)
+            self._report_timing(parsed_args)
+
+    def _deploy_overcloud(self, parsed_args):
         self._setup_clients(parsed_args)
 
         # Swiftclient logs things like 404s at error level, which is a problem
@@ -921,7 +1226,8 @@ class DeployOvercloud(command.Command):
         self._validate_args(parsed_args)
         utils.store_cli_param(parsed_args)
 
-        stack = utils.get_stack(self.orchestration_client, parsed_args.stack)
+        stack = utils.get_stack(self.orchestration_client, parsed_args.stack,
+                                resolve_outputs=False)
 
         if stack and stack.stack_status == 'IN_PROGRESS':
             raise exceptions.StackInProgress(
@@ -930,29 +1236,6 @@ class DeployOvercloud(command.Command):
 
         parameters = self._update_parameters(parsed_args, stack)
 
-        if not parsed_args.disable_validations:
-            errors, warnings = self._predeploy_verify_capabilities(
-                stack, parameters, parsed_args)
-            if errors > 0:
-                self.log.error(
-                    "Configuration has %d errors, fix them before "
-                    "proceeding. Ignoring these errors is likely to lead to "
-                    "a failed deploy.",
-                    errors)
-                if parsed_args.validation_warnings_fatal or \
-                        parsed_args.validation_errors_fatal:
-                    raise exceptions.InvalidConfiguration()
-            if warnings > 0:
-                self.log.error(
-                    "Configuration has %d warnings, fix them before "
-                    "proceeding.",
-                    warnings)
-                if parsed_args.validation_warnings_fatal:
-                    raise exceptions.InvalidConfiguration()
-            else:
-                self.log.info("SUCCESS: No warnings or errors in deploy "
-                              "configuration, proceeding.")
-
         stack_create = stack is None
         if stack_create:
             self.log.info("No stack found, will be doing a stack create")
@@ -978,15 +1261,28 @@ class DeployOvercloud(command.Command):
                         "must specify --reg-org, and "
                         "--reg-activation-key.")
 
+        if not parsed_args.disable_validations:
+            # The validations are independent from the templates, they run
+            # while the templates are copied and, if their result can't stop
+            # the deployment, while the plan and environments are prepared.
+            # _check_predeploy_validations waits for them.
+            self._pending_validations = (self._executor.submit(
+                self._run_predeploy_validations, stack, parameters,
+                parsed_args), parsed_args)
+
         if parsed_args.dry_run:
+            self._check_predeploy_validations()
             print("Validation Finished")
             return
 
         self._deploy_tripleo_heat_templates_tmpdir(stack, parsed_args)
+        self._check_predeploy_validations()
 
         # Get a new copy of the stack after stack update/create. If it was
         # a create then the previous stack object would be None.
-        stack = utils.get_stack(self.orchestration_client, parsed_args.stack)
+        # The outputs are fetched one by one when needed.
+        stack = utils.get_stack(self.orchestration_client, parsed_args.stack,
+                                resolve_outputs=False)
 
         if parsed_args.update_plan_only:
             # If we are only updating the plan, then we either wont have a
@@ -994,22 +1290,55 @@ class DeployOvercloud(command.Command):
             # wont do anything.
             return
 
-        # Force fetching of attributes
-        stack.get()
+        outputs = utils.StackOutputs(stack)
 
-        overcloudrcs = deployment.overcloudrc(
-            self.workflow_client, container=stack.stack_name,
-            no_proxy=parsed_args.no_proxy)
+        with self._stage('Write overcloudrc'):
+            overcloudrcs = deployment.overcloudrc(
+                self.workflow_client, container=stack.stack_name,
+                no_proxy=parsed_args.no_proxy)
 
-        utils.write_overcloudrc(stack.stack_name, overcloudrcs)
-        utils.create_tempest_deployer_input()
+            utils.write_overcloudrc(stack.stack_name, overcloudrcs)
+            utils.create_tempest_deployer_input()
 
         # Run postconfig on create or force. Use force to makes sure endpoints
         # are created with deploy reruns and upgrades
         if (stack_create or parsed_args.force_postconfig
                 and not parsed_args.skip_postconfig):
-            self._deploy_postconfig(stack, parsed_args)
+            with self._stage('Post-deploy configuration'):
+                self._deploy_postconfig(outputs, parsed_args)
 
-        overcloud_endpoint = utils.get_overcloud_endpoint(stack)
+        overcloud_endpoint = utils.get_overcloud_endpoint(outputs)
         print("Overcloud Endpoint: {0}".format(overcloud_endpoint))
         print("Overcloud Deployed")
+
+
+class DeployTimeline(command.Command):
+    """Show the timeline of a deployment recorded with --event-log"""
+
+    log = logging.getLogger(__name__ + ".DeployTimeline")
+
+    def get_parser(self, prog_name):
+        parser = super(DeployTimeline, self).get_parser(prog_name)
+        parser.add_argument(
+            'event_log',
+            metavar='<FILE>',
+            help=_('Event log written by "openstack overcloud deploy '
+                   '--event-log".')
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help=_('Number of the longest resources to show. '
+                   '(default: %(default)s)')
+        )
+        return parser
+
+    def take_action(self, parsed_args):
+        self.log.debug("take_action(%s)" % parsed_args)
+        if not os.path.isfile(parsed_args.event_log):
+            raise oscexc.CommandError(
+                "Event log %s not found" % parsed_args.event_log)
+        timeline = timing.EventTimeline.from_file(parsed_args.event_log)
+        for table in timeline.as_tables(top=parsed_args.top):
+            print(table)
@@ -14,7 +14,9 @@
 #
 
 import argparse
+import hashlib
 import logging
+import os
 import uuid
 
 from osc_lib.command import command
@@ -68,7 +70,8 @@ class DeleteNode(command.Command):
         clients = self.app.client_manager
         orchestration_client = clients.orchestration
 
-        stack = oooutils.get_stack(orchestration_client, parsed_args.stack)
+        stack = oooutils.get_stack(orchestration_client, parsed_args.stack,
+                                   resolve_outputs=False)
 
         if not stack:
             raise InvalidConfiguration("stack {} not found".format(
@@ -142,14 +145,54 @@ class IntrospectNode(command.Command):
                             help=_('Run the pre-deployment validations. These '
                                    'external validations are from the TripleO '
                                    'Validations project.'))
+        parser.add_argument('--batch-size', type=oooutils.positive_int,
+                            help=_('Introspect the nodes this many at a time, '
+                                   'each batch with its own workflow, rather '
+                                   'than all at once.'))
+        parser.add_argument('--max-concurrency',
+                            type=oooutils.positive_int, default=1,
+                            help=_('How many batches of nodes to introspect '
+                                   'at once, with --batch-size. '
+                                   '(default: %(default)s)'))
+        parser.add_argument('--retries', type=int, default=1,
+                            help=_('How many more times to introspect the '
+                                   'nodes which failed, with --batch-size. '
+                                   '(default: %(default)s)'))
         return parser
 
+    def _introspect_in_batches(self, parsed_args, queue_name):
+        nodes = parsed_args.node_uuids
+        if not nodes:
+            nodes = [node.uuid for node in oooutils.nodes_in_states(
+                self.app.client_manager.baremetal, ('manageable',))]
+            if not nodes:
+                print('No manageable nodes to introspect.')
+                return
+
+        baremetal.IntrospectionScheduler(
+            self.app.client_manager,
+            nodes,
+            batch_size=parsed_args.batch_size,
+            max_concurrency=parsed_args.max_concurrency,
+            retries=parsed_args.retries,
+            run_validations=parsed_args.run_validations,
+            queue_name=queue_name).run()
+
+        if parsed_args.provide:
+            baremetal.provide(self.app.client_manager,
+                              node_uuids=nodes,
+                              queue_name=queue_name)
+
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
 
         queue_name = str(uuid.uuid4())
         nodes = parsed_args.node_uuids
 
+        if parsed_args.batch_size:
+            self._introspect_in_batches(parsed_args, queue_name)
+            return
+
         if nodes:
             baremetal.introspect(self.app.client_manager,
                                  node_uuids=nodes,
@@ -200,9 +243,35 @@ class ImportNode(command.Command):
                             help=_('Whether to set instances for booting from '
                                    'local hard drive (local) or network '
                                    '(netboot).'))
+        parser.add_argument('--chunk-size', type=oooutils.positive_int,
+                            default=50,
+                            help=_('How many nodes to register with each '
+                                   'workflow. (default: %(default)s)'))
+        parser.add_argument('--concurrency', type=oooutils.positive_int,
+                            default=4,
+                            help=_('How many chunks of nodes to register at '
+                                   'once. (default: %(default)s)'))
+        parser.add_argument('--restart', action='store_true',
+                            help=_('Register all the nodes, even those '
+                                   'registered by a previous import of the '
+                                   'same file which failed.'))
         parser.add_argument('env_file', type=argparse.FileType('r'))
         return parser
 
+    def _checkpoint(self, parsed_args):
+        """The checkpoint of the imports of the inventory file"""
+        digest = hashlib.sha1(os.path.abspath(
+            parsed_args.env_file.name).encode('utf-8')).hexdigest()
+        directory = os.path.expanduser(
+            constants.NODE_IMPORT_CHECKPOINT_DIRECTORY)
+        baremetal.remove_stale_checkpoints(directory)
+        path = os.path.join(directory, '%s.json' % digest)
+        checkpoint = baremetal.RegistrationCheckpoint(path)
+        if parsed_args.restart:
+            checkpoint.remove()
+            checkpoint.nodes = {}
+        return checkpoint
+
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
 
@@ -217,9 +286,12 @@ class ImportNode(command.Command):
             deploy_kernel = 'bm-deploy-kernel'
             deploy_ramdisk = 'bm-deploy-ramdisk'
 
-        nodes = baremetal.register_or_update(
+        nodes = baremetal.register_or_update_in_chunks(
             self.app.client_manager,
             nodes_json=nodes_config,
+            chunk_size=parsed_args.chunk_size,
+            max_concurrency=parsed_args.concurrency,
+            checkpoint=self._checkpoint(parsed_args),
             queue_name=queue_name,
             kernel_name=deploy_kernel,
             ramdisk_name=deploy_ramdisk,
@@ -163,7 +163,8 @@ class DeployPlan(command.Command):
 
         clients = self.app.client_manager
         orchestration_client = clients.orchestration
-        stack = utils.get_stack(orchestration_client, parsed_args.name)
+        stack = utils.get_stack(orchestration_client, parsed_args.name,
+                                resolve_outputs=False)
 
         print("Starting to deploy plan: {}".format(parsed_args.name))
         deployment.deploy_and_wait(self.log, clients, stack, parsed_args.name,
@@ -13,14 +13,37 @@
 #   under the License.
 
 import logging
+import os
 
 from osc_lib.command import command
 from osc_lib.i18n import _
 
+from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient import node_cache
 from tripleoclient import utils
 
 
+def _add_node_cache_argument(parser):
+    parser.add_argument(
+        '--node-cache-ttl',
+        type=int,
+        default=0,
+        help=_('Save the list of nodes and reuse the one saved by a previous '
+               'profiles command for up to this many seconds, as long as no '
+               'node changed since. (default: %(default)s, never)')
+    )
+
+
+def _node_cache(parsed_args):
+    """The snapshot of the nodes used by the profiles commands"""
+    if parsed_args.node_cache_ttl > 0:
+        return node_cache.get_cache(
+            os.path.expanduser(constants.NODE_SNAPSHOT_FILE),
+            ttl=parsed_args.node_cache_ttl)
+    return node_cache.get_cache()
+
+
 class MatchProfiles(command.Command):
     """Assign and validate profiles on nodes"""
 
@@ -34,6 +57,7 @@ class MatchProfiles(command.Command):
             default=False,
             help=_('Only run validations, but do not apply any changes.')
         )
+        _add_node_cache_argument(parser)
         utils.add_deployment_plan_arguments(parser)
         return parser
 
@@ -46,7 +70,8 @@ class MatchProfiles(command.Command):
         errors, warnings = utils.assign_and_verify_profiles(
             bm_client, flavors,
             assign_profiles=True,
-            dry_run=parsed_args.dry_run
+            dry_run=parsed_args.dry_run,
+            cache=_node_cache(parsed_args)
         )
         if errors:
             raise exceptions.ProfileMatchingError(
@@ -90,13 +115,21 @@ class ListProfiles(command.Lister):
 
     log = logging.getLogger(__name__ + ".ListProfiles")
 
+    def get_parser(self, prog_name):
+        parser = super(ListProfiles, self).get_parser(prog_name)
+        _add_node_cache_argument(parser)
+        return parser
+
     def take_action(self, parsed_args):
         self.log.debug("take_action(%s)" % parsed_args)
         client = self.app.client_manager.baremetal
 
         result = []
 
-        for node in client.node.list(detail=True, maintenance=False):
+        for node in utils.list_nodes(client,
+                                     fields=utils.PROFILE_NODE_FIELDS,
+                                     maintenance=False,
+                                     cache=_node_cache(parsed_args)):
             if node.provision_state not in ('active', 'available'):
                 continue
 
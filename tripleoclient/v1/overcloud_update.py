@@ -70,7 +70,8 @@ class UpdateOvercloud(command.Command):
         clients = self.app.client_manager
 
         stack = oooutils.get_stack(clients.orchestration,
-                                   parsed_args.stack)
+                                   parsed_args.stack,
+                                   resolve_outputs=False)
 
         stack_name = stack.stack_name
         if parsed_args.interactive:
@@ -113,7 +114,8 @@ class ClearBreakpointsOvercloud(command.Command):
 
         heat = clients.orchestration
 
-        stack = oooutils.get_stack(heat, parsed_args.stack)
+        stack = oooutils.get_stack(heat, parsed_args.stack,
+                                   resolve_outputs=False)
 
         package_update.clear_breakpoints(clients, stack_id=stack.id,
                                          refs=parsed_args.refs)
@@ -46,6 +46,7 @@ from tripleoclient import constants
 from tripleoclient import exceptions
 from tripleoclient import fake_keystone
 from tripleoclient import heat_launcher
+from tripleoclient import stack_inspection
 
 from tripleo_common.utils import passwords as password_utils
 
@@ -113,13 +114,14 @@ class DeployUndercloud(command.Command):
             print('Installing prerequisites ...')
             subprocess.check_call(['yum', '-y', 'install'] + processed)
 
-    def _lookup_tripleo_server_stackid(self, client, stack_id):
+    def _lookup_tripleo_server_stackid(self, inspector, stack_id):
         server_stack_id = None
 
-        for X in client.resources.list(stack_id, nested_depth=6):
-            if X.resource_type in (
-                    'OS::TripleO::Server',
-                    'OS::TripleO::UndercloudServer'):
+        for X in inspector.find(stack_id,
+                                ('OS::TripleO::Server',
+                                 'OS::TripleO::UndercloudServer'),
+                                nested_depth=6):
+            if X.physical_resource_id:
                 server_stack_id = X.physical_resource_id
 
         return server_stack_id
@@ -196,18 +198,23 @@ class DeployUndercloud(command.Command):
         self.log.info("Looking up server stack id...")
         server_stack_id = None
         # NOTE(dprince) wait a bit to create the server_stack_id resource
-        for c in range(timeout * 60):
-            time.sleep(1)
-            server_stack_id = self._lookup_tripleo_server_stackid(
-                orchestration_client, stack_id)
-            status = orchestration_client.stacks.get(stack_id).status
-            if status == 'FAILED':
-                event_utils.poll_for_events(orchestration_client, stack_name)
-                msg = ('Stack failed before deployed-server resource '
-                       'created.')
-                raise Exception(msg)
-            if server_stack_id:
-                break
+        # The inspector keeps the resources of the nested stacks which are
+        # complete, it must be closed before forking.
+        with stack_inspection.StackInspector(
+                orchestration_client) as inspector:
+            for c in range(timeout * 60):
+                time.sleep(1)
+                server_stack_id = self._lookup_tripleo_server_stackid(
+                    inspector, stack_id)
+                status = orchestration_client.stacks.get(stack_id).status
+                if status == 'FAILED':
+                    event_utils.poll_for_events(orchestration_client,
+                                                stack_name)
+                    msg = ('Stack failed before deployed-server resource '
+                           'created.')
+                    raise Exception(msg)
+                if server_stack_id:
+                    break
         if not server_stack_id:
             msg = ('Unable to find deployed server stack id. '
                    'See tripleo-heat-templates to ensure proper '
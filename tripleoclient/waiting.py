@@ -0,0 +1,227 @@
+#   Copyright 2017 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import json
+import logging
+import os
+import random
+import time
+
+from prettytable import PrettyTable
+
+LOG = logging.getLogger(__name__)
+
+
+class Backoff(object):
+    """The deadline and the delays between the polls of a single wait
+
+    Created by WaitStrategy.start. Each delay is the previous one multiplied
+    by the strategy factor, up to its maximum, and randomly spread by its
+    jitter so that many waits started together don't poll in lockstep.
+    """
+
+    def __init__(self, strategy, clock=time.time, rand=random.random):
+        self.strategy = strategy
+        self._clock = clock
+        self._rand = rand
+        self.started = clock()
+        self.attempts = 0
+        self._delay = strategy.initial
+
+    @property
+    def elapsed(self):
+        return self._clock() - self.started
+
+    @property
+    def remaining(self):
+        """Seconds left before the deadline, None without a timeout"""
+        if self.strategy.timeout is None:
+            return None
+        return max(0.0, self.strategy.timeout - self.elapsed)
+
+    @property
+    def expired(self):
+        if (self.strategy.attempts is not None and
+                self.attempts >= self.strategy.attempts):
+            return True
+        return self.remaining == 0.0
+
+    def attempt(self):
+        """Count a poll, return whether the wait can go on"""
+        self.attempts += 1
+        return not self.expired
+
+    def reset(self):
+        """Go back to the initial delay, e.g. after some progress"""
+        self._delay = self.strategy.initial
+
+    def next_delay(self):
+        """Return how long to sleep before the next poll"""
+        delay = self._delay
+        self._delay = min(self._delay * self.strategy.factor,
+                          self.strategy.maximum)
+        jitter = self.strategy.jitter
+        if jitter:
+            delay *= 1 - jitter + 2 * jitter * self._rand()
+        remaining = self.remaining
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return max(0.0, delay)
+
+
+class WaitStrategy(object):
+    """How long to wait for something and how often to check it
+
+    :param timeout: Seconds before giving up, None to rely on attempts
+    :param attempts: How many polls before giving up, None for no limit
+    :param initial: Delay before the second poll
+    :param maximum: Longest delay between two polls
+    :param factor: What each delay is multiplied by for the next one
+    :param jitter: Fraction by which each delay is randomly spread
+    """
+
+    def __init__(self, timeout=600, attempts=None, initial=1, maximum=15,
+                 factor=2, jitter=0.1):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.initial = initial
+        self.maximum = max(maximum, initial)
+        self.factor = factor
+        self.jitter = jitter
+
+    @classmethod
+    def fixed(cls, loops, sleep):
+        """Poll up to loops times, sleep seconds apart"""
+        return cls(timeout=None, attempts=loops, initial=sleep,
+                   maximum=sleep, factor=1, jitter=0)
+
+    def start(self, clock=time.time):
+        """Start a wait"""
+        return Backoff(self, clock=clock)
+
+    def __repr__(self):
+        return ('WaitStrategy(timeout=%r, attempts=%r, initial=%r, '
+                'maximum=%r)' % (self.timeout, self.attempts, self.initial,
+                                 self.maximum))
+
+
+# Used for the node transitions nothing is known about yet
+DEFAULT_TRANSITION_WAIT = WaitStrategy(timeout=600, initial=1, maximum=15)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class TransitionStats(object):
+    """Persistent durations of the node provision state transitions
+
+    The durations are kept per driver and transition, up to window of the
+    latest ones for each, and give the wait strategy of a transition: its
+    timeout is a few times the slowest duration seen for any driver, and its
+    delays are a fraction of the usual duration, so that fast transitions
+    are checked often and slow ones aren't polled for nothing.
+    """
+
+    version = 1
+
+    def __init__(self, path=None, window=50):
+        self.path = path
+        self.window = window
+        self._durations = self._load()
+        self._changed = False
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                stats = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug("Ignoring transition stats %s: %s", self.path, e)
+            return {}
+        if not isinstance(stats, dict) or \
+                stats.get('version') != self.version:
+            return {}
+        return stats.get('durations') or {}
+
+    def save(self):
+        """Write the stats if they changed"""
+        if not self.path or not self._changed:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version,
+                       'durations': self._durations}, f, indent=2,
+                      sort_keys=True)
+        os.rename(tmp_path, self.path)
+        self._changed = False
+
+    def record(self, driver, transition, duration):
+        """Record how long a node of a driver took for a transition"""
+        durations = self._durations.setdefault(
+            str(driver), {}).setdefault(transition, [])
+        durations.append(round(duration, 2))
+        del durations[:-self.window]
+        self._changed = True
+
+    def durations(self, transition, driver=None):
+        """Return the recorded durations of a transition
+
+        :param driver: Only return those of this driver, when given
+        """
+        result = []
+        for name, transitions in self._durations.items():
+            if driver is None or name == driver:
+                result.extend(transitions.get(transition, []))
+        return result
+
+    def strategy(self, transition, default=DEFAULT_TRANSITION_WAIT):
+        """Return the wait strategy of a transition
+
+        The default is used until the transition was recorded.
+        """
+        durations = self.durations(transition)
+        if not durations:
+            return default
+        typical = _percentile(durations, 50)
+        slowest = _percentile(durations, 95)
+        initial = min(max(typical / 8.0, 0.5), 5)
+        return WaitStrategy(timeout=max(60, 3 * slowest), initial=initial,
+                            maximum=min(max(typical / 2.0, initial), 30),
+                            factor=default.factor, jitter=default.jitter)
+
+    def as_table(self):
+        """Return the durations per driver and transition as a PrettyTable"""
+        table = PrettyTable(['Driver', 'Transition', 'Count', 'Median (s)',
+                             '95th percentile (s)', 'Max (s)'])
+        table.align['Driver'] = 'l'
+        table.align['Transition'] = 'l'
+        for driver in sorted(self._durations):
+            transitions = self._durations[driver]
+            for transition in sorted(transitions):
+                durations = transitions[transition]
+                if not durations:
+                    continue
+                table.add_row([driver, transition, len(durations),
+                               '%.1f' % _percentile(durations, 50),
+                               '%.1f' % _percentile(durations, 95),
+                               '%.1f' % max(durations)])
+        return table
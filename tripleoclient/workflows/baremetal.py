@@ -14,9 +14,23 @@
 
 from __future__ import print_function
 
+import collections
+from concurrent import futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
 from tripleoclient import exceptions
 from tripleoclient.workflows import base
 
+LOG = logging.getLogger(__name__)
+
+# How long the checkpoint of an import not run again is kept, in seconds
+CHECKPOINT_MAX_AGE = 7 * 24 * 3600
+
 
 def register_or_update(clients, **workflow_input):
     """Node Registration or Update
@@ -49,6 +63,195 @@ def register_or_update(clients, **workflow_input):
             'Exception registering nodes: {}'.format(payload['message']))
 
 
+def node_key(node):
+    """Return what identifies a node of an inventory across imports
+
+    Its MAC addresses when it has some, otherwise its BMC address and port.
+    """
+    macs = list(node.get('mac') or [])
+    macs.extend(p.get('address') for p in node.get('ports') or [])
+    if macs:
+        return ','.join(sorted(m.lower() for m in macs if m))
+    return '%s:%s' % (node.get('pm_addr'), node.get('pm_port', ''))
+
+
+def node_digest(node):
+    """Return a digest of the inventory entry of a node"""
+    return hashlib.sha1(json.dumps(
+        node, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RegistrationCheckpoint(object):
+    """The nodes of an inventory already registered by an import
+
+    The UUID of every node registered is recorded by node_key, with the
+    digest of its inventory entry, as soon as its chunk is done, so an
+    import which failed part way can be run again and only register the
+    remaining nodes and the nodes changed since.
+    """
+
+    version = 2
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.nodes = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                checkpoint = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(checkpoint, dict) or \
+                checkpoint.get('version') != self.version:
+            return {}
+        return checkpoint.get('nodes') or {}
+
+    def __contains__(self, node):
+        recorded = self.nodes.get(node_key(node))
+        return (isinstance(recorded, dict) and
+                recorded.get('digest') == node_digest(node))
+
+    def uuid(self, node):
+        """Return the UUID a node was registered with"""
+        return self.nodes[node_key(node)]['uuid']
+
+    def record(self, nodes, registered_nodes):
+        """Record the nodes of a chunk once it was registered
+
+        :param nodes: The nodes of the chunk, from the inventory
+        :param registered_nodes: The nodes returned by the workflow
+        :raises exceptions.RegisterOrUpdateError: if the registered nodes do
+                not all match a node of the chunk, nothing is recorded then
+        """
+        # The workflow returns the nodes in the order they were given
+        uuids = [n.get('uuid') for n in registered_nodes]
+        if len(uuids) != len(nodes) or not all(uuids):
+            raise exceptions.RegisterOrUpdateError(
+                'The workflow returned %d nodes with a UUID for a chunk of '
+                '%d nodes' % (len([u for u in uuids if u]), len(nodes)))
+        with self._lock:
+            for node, uuid in zip(nodes, uuids):
+                self.nodes[node_key(node)] = {'uuid': uuid,
+                                              'digest': node_digest(node)}
+            self._save()
+
+    def _save(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version, 'nodes': self.nodes}, f)
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        """Forget the checkpoint, once the whole inventory was registered"""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+def remove_stale_checkpoints(directory, max_age=CHECKPOINT_MAX_AGE):
+    """Remove the checkpoints of the imports not run for max_age seconds"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                LOG.debug('Removing the stale checkpoint %s', path)
+                os.unlink(path)
+        except OSError as e:
+            LOG.debug('Failed to remove the checkpoint %s: %s', path, e)
+
+
+def register_or_update_in_chunks(clients, nodes_json, chunk_size=50,
+                                 max_concurrency=4, checkpoint=None,
+                                 **workflow_input):
+    """Register or update the nodes with a workflow per chunk of nodes
+
+    Up to max_concurrency chunks are registered at once, each with its own
+    messaging queue. With a checkpoint, the nodes it holds are skipped and
+    each chunk registered is added to it. The checkpoint is removed once all
+    the nodes were registered.
+
+    :param checkpoint: Nodes registered by the previous attempts
+    :type  checkpoint: RegistrationCheckpoint
+
+    :returns: the registered nodes, those from the checkpoint only have
+              their uuid
+    :raises exceptions.RegisterOrUpdateError: once all the chunks were
+            tried, if any of them failed
+    """
+    done = []
+    pending = []
+    for node in nodes_json:
+        if checkpoint is not None and node in checkpoint:
+            done.append({'uuid': checkpoint.uuid(node)})
+        else:
+            pending.append(node)
+    skipped = len(nodes_json) - len(pending)
+    if skipped:
+        print('Skipping %d nodes registered by a previous import' % skipped)
+
+    chunk_size = max(1, chunk_size)
+    chunks = [pending[i:i + chunk_size]
+              for i in range(0, len(pending), chunk_size)]
+    queue_name = workflow_input.pop('queue_name')
+
+    def register(index_and_chunk):
+        index, chunk = index_and_chunk
+        chunk_queue = queue_name
+        if len(chunks) > 1:
+            chunk_queue = '%s-%d' % (queue_name, index)
+            print('Registering nodes %d to %d of %d' % (
+                index * chunk_size + 1, index * chunk_size + len(chunk),
+                len(pending)))
+        registered = register_or_update(
+            clients, nodes_json=chunk, queue_name=chunk_queue,
+            **workflow_input)
+        if checkpoint is not None:
+            checkpoint.record(chunk, registered)
+        return registered
+
+    def safe_register(index_and_chunk):
+        try:
+            return register(index_and_chunk), None
+        except Exception as e:
+            LOG.debug('Failed to register chunk %d', index_and_chunk[0],
+                      exc_info=True)
+            return None, e
+
+    errors = []
+    if chunks:
+        with futures.ThreadPoolExecutor(
+                max_workers=max(1, min(max_concurrency,
+                                       len(chunks)))) as executor:
+            for registered, error in executor.map(safe_register,
+                                                  enumerate(chunks)):
+                if error is not None:
+                    errors.append(error)
+                else:
+                    done.extend(registered)
+
+    if errors and len(chunks) == 1:
+        raise errors[0]
+    if errors:
+        raise exceptions.RegisterOrUpdateError(
+            '%d of %d chunks of nodes failed to register, run the import '
+            'again to register the remaining nodes: %s' % (
+                len(errors), len(chunks),
+                '; '.join(str(e) for e in errors)))
+    if checkpoint is not None:
+        checkpoint.remove()
+    return done
+
+
 def _format_provide_errors(payload):
     errors = []
     messages = payload.get('message', [])
@@ -132,6 +335,159 @@ def introspect(clients, **workflow_input):
     print("Introspection completed.")
 
 
+class IntrospectionScheduler(object):
+    """Introspect nodes a batch at a time
+
+    Each batch of nodes is introspected by its own
+    tripleo.baremetal.v1.introspect workflow and messaging queue, with up to
+    max_concurrency batches at once, so that a large number of nodes doesn't
+    boot on the provisioning network all together. The state of every node
+    is taken from the introspected_nodes of the workflow messages, and the
+    nodes which failed are put back in a later batch up to retries times.
+
+    The validations are only run with the first batch, since they check the
+    undercloud rather than the nodes.
+
+    :param batch_size: How many nodes to introspect with each workflow
+    :param max_concurrency: How many batches to introspect at once
+    :param retries: How many more times to introspect a node which failed
+    """
+
+    PENDING = 'pending'
+    INTROSPECTING = 'introspecting'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, clients, node_uuids, batch_size=20, max_concurrency=1,
+                 retries=1, run_validations=False, queue_name=None):
+        self.clients = clients
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.run_validations = run_validations
+        self.queue_name = queue_name
+        self.nodes = collections.OrderedDict(
+            (node_uuid, self.PENDING) for node_uuid in node_uuids)
+        self.attempts = dict.fromkeys(self.nodes, 0)
+        self.errors = {}
+        self._pending = collections.deque(self.nodes)
+        self._batches = 0
+
+    def _next_batch(self):
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            node_uuid = self._pending.popleft()
+            self.nodes[node_uuid] = self.INTROSPECTING
+            self.attempts[node_uuid] += 1
+            batch.append(node_uuid)
+        return batch
+
+    def _introspect(self, index, batch):
+        workflow_client = self.clients.workflow_engine
+        tripleoclients = self.clients.tripleoclient
+        queue_name = '%s-%d' % (self.queue_name, index)
+
+        results = {}
+        with tripleoclients.messaging_websocket(queue_name) as ws:
+            execution = base.start_workflow(
+                workflow_client,
+                'tripleo.baremetal.v1.introspect',
+                workflow_input={
+                    'node_uuids': batch,
+                    'run_validations': self.run_validations and index == 0,
+                    'queue_name': queue_name
+                }
+            )
+
+            for payload in base.wait_for_messages(workflow_client, ws,
+                                                  execution):
+                results.update(payload.get('introspected_nodes') or {})
+
+        if payload['status'] == 'SUCCESS':
+            message = None
+        else:
+            message = payload.get('message') or 'Failed.'
+            if isinstance(message, list):
+                message = '; '.join(str(m) for m in message if m)
+        errors = {}
+        for node_uuid in batch:
+            status = results.get(node_uuid)
+            if status is not None and status.get('error') is not None:
+                errors[node_uuid] = status['error']
+            elif message is not None and not (status or {}).get('finished'):
+                errors[node_uuid] = message
+        return errors
+
+    def _finish(self, batch, errors):
+        for node_uuid in batch:
+            if node_uuid not in errors:
+                self.nodes[node_uuid] = self.DONE
+                self.errors.pop(node_uuid, None)
+                continue
+            self.errors[node_uuid] = errors[node_uuid]
+            if self.attempts[node_uuid] <= self.retries:
+                LOG.debug('Introspection of node %s failed, retrying: %s',
+                          node_uuid, errors[node_uuid])
+                self.nodes[node_uuid] = self.PENDING
+                self._pending.append(node_uuid)
+            else:
+                self.nodes[node_uuid] = self.FAILED
+
+    def count(self, state):
+        """Return how many nodes are in a state"""
+        return sum(1 for s in self.nodes.values() if s == state)
+
+    def progress(self):
+        """Return a summary of the state of the nodes"""
+        return ('Introspection: %d of %d nodes done, %d failed, %d in '
+                'progress, %d pending' % (
+                    self.count(self.DONE), len(self.nodes),
+                    self.count(self.FAILED), self.count(self.INTROSPECTING),
+                    self.count(self.PENDING)))
+
+    def _submit(self, executor, running):
+        while self._pending and len(running) < self.max_concurrency:
+            batch = self._next_batch()
+            index = self._batches
+            self._batches += 1
+            running[executor.submit(self._introspect, index, batch)] = batch
+
+    def run(self):
+        """Introspect all the nodes
+
+        :raises exceptions.IntrospectionError: once all the nodes were
+                tried, if any of them still failed
+        """
+        print("Waiting for introspection to finish...")
+
+        running = {}
+        with futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency) as executor:
+            self._submit(executor, running)
+            print(self.progress())
+            while running:
+                done, _not_done = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    batch = running.pop(future)
+                    try:
+                        errors = future.result()
+                    except Exception as e:
+                        LOG.debug('Failed to introspect batch %s', batch,
+                                  exc_info=True)
+                        errors = dict.fromkeys(batch, str(e))
+                    self._finish(batch, errors)
+                self._submit(executor, running)
+                print(self.progress())
+
+        failed = [n for n, s in self.nodes.items() if s == self.FAILED]
+        if failed:
+            raise exceptions.IntrospectionError(
+                "Introspection completed with errors:\n%s" % '\n'.join(
+                    "%s: %s" % (n, self.errors[n]) for n in failed))
+        print("Introspection completed.")
+
+
 def introspect_manageable_nodes(clients, **workflow_input):
     """Introspect all manageable nodes
 
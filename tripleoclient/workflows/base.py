@@ -13,6 +13,7 @@ import json
 import logging
 
 from tripleoclient import exceptions
+from tripleoclient import stack_events
 
 LOG = logging.getLogger(__name__)
 
@@ -59,6 +60,7 @@ def wait_for_messages(mistral, websocket, execution, timeout=None):
     """
     try:
         for payload in websocket.wait_for_messages(timeout=timeout):
+            stack_events.record_payload(payload)
             yield payload
             # If the message is from a sub-workflow, we just need to pass it
             # on to be displayed. This should never be the last message - so
@@ -11,14 +11,16 @@
 # under the License.
 from __future__ import print_function
 
+from concurrent import futures
 import pprint
 import time
 import uuid
 
 from heatclient.common import event_utils
-from openstackclient import shell
+from heatclient.exc import HTTPNotFound
 
 from tripleoclient import exceptions
+from tripleoclient import stack_failures
 from tripleoclient import utils
 
 from tripleoclient.workflows import base
@@ -60,37 +62,85 @@ def deploy_and_wait(log, clients, stack, plan_name, verbose_level,
     if timeout is not None:
         workflow_input['timeout'] = timeout
 
-    deploy(clients, **workflow_input)
-
     orchestration_client = clients.orchestration
 
     if stack is None:
         log.info("Performing Heat stack create")
         action = 'CREATE'
         marker = None
+        deploy(clients, **workflow_input)
     else:
         log.info("Performing Heat stack update")
-        # Make sure existing parameters for stack are reused
-        # Find the last top-level event to use for the first marker
-        events = event_utils.get_events(orchestration_client,
-                                        stack_id=plan_name,
-                                        event_args={'sort_dir': 'desc',
-                                                    'limit': 1})
-        marker = events[0].id if events else None
         action = 'UPDATE'
+        # Make sure existing parameters for stack are reused
+        # Find the last top-level event to use for the first marker, while
+        # the deploy workflow runs and before the update creates new events.
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            marker_future = executor.submit(_last_event_id,
+                                            orchestration_client, plan_name)
+            deploy(clients, **workflow_input)
+            marker = marker_future.result()
+        finally:
+            executor.shutdown(wait=False)
+
+    if not wait_for_stack_action(orchestration_client, plan_name, stack,
+                                 action):
+        log.warning("Heat stack %s not seen yet, waiting for its events "
+                    "anyway" % action.lower())
 
-    time.sleep(10)
     verbose_events = verbose_level > 0
     create_result = utils.wait_for_stack_ready(
         orchestration_client, plan_name, marker, action, verbose_events)
     if not create_result:
-        shell.OpenStackShell().run(["stack", "failures", "list", plan_name])
+        stack_failures.print_failures(orchestration_client, plan_name)
         if stack is None:
             raise exceptions.DeploymentError("Heat Stack create failed.")
         else:
             raise exceptions.DeploymentError("Heat Stack update failed.")
 
 
+def _last_event_id(orchestration_client, plan_name):
+    events = event_utils.get_events(orchestration_client,
+                                    stack_id=plan_name,
+                                    event_args={'sort_dir': 'desc',
+                                                'limit': 1})
+    return events[0].id if events else None
+
+
+def wait_for_stack_action(orchestration_client, plan_name, previous, action,
+                          timeout=60):
+    """Wait until Heat shows the stack action started by the deploy workflow
+
+    The deploy workflow returns once it asked Heat to create or update the
+    stack, the stack is polled with a short backoff until the action is
+    visible rather than waiting for a fixed time.
+
+    :param previous: The stack before the deployment, or None
+    :returns: Whether the action was seen before the timeout
+    """
+    delay = 0.5
+    waited = 0
+    while True:
+        try:
+            current = orchestration_client.stacks.get(plan_name,
+                                                      resolve_outputs=False)
+        except HTTPNotFound:
+            current = None
+        if current is not None:
+            if previous is None:
+                return True
+            if (current.stack_status == '%s_IN_PROGRESS' % action or
+                    current.stack_status != previous.stack_status or
+                    current.updated_time != previous.updated_time):
+                return True
+        if waited >= timeout:
+            return False
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 5)
+
+
 def overcloudrc(workflow_client, **input_):
     return base.call_action(workflow_client, 'tripleo.deployment.overcloudrc',
                             **input_)
@@ -62,7 +62,7 @@ def update_and_wait(log, clients, stack, plan_name, verbose_level,
     update_manager.do_interactive_update()
 
     stack = oooutils.get_stack(clients.orchestration,
-                               plan_name)
+                               plan_name, resolve_outputs=False)
 
     return stack.status
 